@@ -0,0 +1,358 @@
+# benchmark the public functions of every stage on synthetic inputs of several sizes
+# wall time and peak memory (peak RSS during the call) of each call are measured in a forked process
+# and saved as .json, together with the scaling exponent (slope of log(time) against log(size)) of every function
+# e.g. python benchmark/run_benchmark.py --sizes 10000 100000 1000000 --out bench.json
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, "mesh"), os.path.dirname(os.path.abspath(__file__))]
+import synthetic
+
+
+def data_file(data_dir, size, name, make):
+    # generate an input of the given size once, i.e. make(path) is called only if path does not exist
+    path = os.path.join(data_dir, str(size), name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        make(path)
+    return path
+
+
+def mesh_store(data_dir, size):
+    from mesh_store import build_store
+    pm = data_file(data_dir, size, "polyMesh", lambda p: synthetic.poly_mesh(p, size, fmt="binary"))
+    return data_file(data_dir, size, "mesh_store", lambda p: build_store(pm, p))
+
+
+def mesh_layer(data_dir, size):
+    from mesh_store import open_store
+    from polygon import write_mesh_layer
+    store = mesh_store(data_dir, size)
+
+    def make(path):
+        mesh = open_store(store, ["point", "face", "face_offset"])
+        write_mesh_layer(mesh["point"], mesh["face"], mesh["face_offset"], path)
+    return data_file(data_dir, size, "mesh.gpkg", make)
+
+
+def extent(data_dir, size):
+    from mesh_store import open_store
+    point = open_store(mesh_store(data_dir, size), ["point"])["point"]
+    return float(point[:, 0].max()), float(point[:, 1].max())
+
+
+# setup functions of benchmark cases, i.e. setup(data_dir, size, out_dir) -> (function, args, kwargs)
+# the inputs are generated outside the measured call
+def case_vertex_index(data_dir, size, out_dir):
+    from meshConversion import vertex_index
+    pts = np.random.default_rng(0).integers(0, int(np.sqrt(size)) + 1, size=(2 * size, 2)).astype(np.float64)
+    return vertex_index, (pts,), {"tol": 0.0}
+
+
+def case_cad2poly(data_dir, size, out_dir):
+    from meshConversion import cad2poly
+    csv = data_file(data_dir, size, "cad.csv", lambda p: synthetic.cad_csv(p, size))
+    return cad2poly, (csv, os.path.join(out_dir, "cad.poly")), {}
+
+
+def triangle_prefix(data_dir, size):
+    prefix = os.path.join(data_dir, str(size), "tri")
+    data_file(data_dir, size, "tri.node", lambda p: synthetic.triangle_files(prefix, size))
+    return prefix
+
+
+def case_edge_cell_find(data_dir, size, out_dir):
+    from meshConversion import loadTriangle, edge_cell_index, edge_cell_find
+    prefix = triangle_prefix(data_dir, size)
+    ele = loadTriangle(prefix + ".ele", "ele")
+    edge = loadTriangle(prefix + ".edge", "edge")
+
+    def run(tri, en):
+        return edge_cell_find(edge_cell_index(tri), en)
+    return run, (ele["ele"], edge["edge"]), {}
+
+
+def case_poly2msh(data_dir, size, out_dir):
+    from meshConversion import poly2msh
+    prefix = triangle_prefix(data_dir, size)
+    return poly2msh, (prefix + ".node", prefix + ".edge", prefix + ".ele", os.path.join(out_dir, "mesh.msh")), {}
+
+
+def case_poly2msh_rcm(data_dir, size, out_dir):
+    from meshConversion import poly2msh
+    prefix = triangle_prefix(data_dir, size)
+    return poly2msh, (prefix + ".node", prefix + ".edge", prefix + ".ele", os.path.join(out_dir, "mesh.msh")), \
+        {"renumber": "rcm"}
+
+
+def case_read_faces(data_dir, size, out_dir):
+    from foam_reader import read_faces
+    pm = data_file(data_dir, size, "polyMesh_ascii", lambda p: synthetic.poly_mesh(p, size, fmt="ascii"))
+    return read_faces, (os.path.join(pm, "faces"),), {}
+
+
+def case_foam_to_txt(data_dir, size, out_dir):
+    from foam_to_txt import foam_to_txt
+    pm = data_file(data_dir, size, "polyMesh", lambda p: synthetic.poly_mesh(p, size, fmt="binary"))
+    return foam_to_txt, (pm, out_dir), {"fmt": "npy"}
+
+
+def case_build_store(data_dir, size, out_dir):
+    from mesh_store import build_store
+    pm = data_file(data_dir, size, "polyMesh", lambda p: synthetic.poly_mesh(p, size, fmt="binary"))
+    return build_store, (pm, os.path.join(out_dir, "mesh_store")), {"force": True}
+
+
+def result_dir(data_dir, size):
+    from mesh_store import open_store
+    n_cell = len(open_store(mesh_store(data_dir, size), ["cell_poly_offset"])["cell_poly_offset"]) - 1
+    return data_file(data_dir, size, "result", lambda p: synthetic.fields(p, n_cell, [1, 2, 3], fmt="binary"))
+
+
+def case_read_step(data_dir, size, out_dir):
+    from foam_reader import read_step
+    return read_step, (result_dir(data_dir, size), 1), {}
+
+
+def case_flood_stats(data_dir, size, out_dir):
+    from flood_stats import flood_stats
+    from mesh_store import open_store
+    n_cell = len(open_store(mesh_store(data_dir, size), ["cell_poly_offset"])["cell_poly_offset"]) - 1
+    return flood_stats, (result_dir(data_dir, size), 4, 1, n_cell), {}
+
+
+def case_get_stats(data_dir, size, out_dir):
+    from flood_stats import get_stats
+    return get_stats, (result_dir(data_dir, size), 4, 1, mesh_store(data_dir, size),
+                       os.path.join(out_dir, "stats.gpkg")), {}
+
+
+def array_store(data_dir, size):
+    from result_store import export_results
+    store = mesh_store(data_dir, size)
+    results = result_dir(data_dir, size)
+    return data_file(data_dir, size, "results.zarr", lambda p: export_results(results, 4, 1, store, p))
+
+
+def case_export_results(data_dir, size, out_dir):
+    from result_store import export_results
+    return export_results, (result_dir(data_dir, size), 4, 1, mesh_store(data_dir, size),
+                            os.path.join(out_dir, "results.zarr")), {}
+
+
+def case_snapshot(data_dir, size, out_dir):
+    from result_store import snapshot
+    return snapshot, (array_store(data_dir, size), 1), {}
+
+
+def case_hydrograph(data_dir, size, out_dir):
+    from mesh_store import open_store
+    from result_store import hydrograph
+    n_cell = len(open_store(mesh_store(data_dir, size), ["cell_poly_offset"])["cell_poly_offset"]) - 1
+    return hydrograph, (array_store(data_dir, size), n_cell // 2), {}
+
+
+def case_write_mesh_layer(data_dir, size, out_dir):
+    from mesh_store import open_store
+    from polygon import write_mesh_layer
+    mesh = open_store(mesh_store(data_dir, size), ["point", "face", "face_offset"])
+    return write_mesh_layer, (mesh["point"], mesh["face"], mesh["face_offset"], os.path.join(out_dir, "mesh.gpkg")), {}
+
+
+def case_get_runcoeff(data_dir, size, out_dir):
+    from center_coeff import get_runcoeff
+    w, h = extent(data_dir, size)
+    lc = data_file(data_dir, size, "lc.tif", lambda p: synthetic.landcover_tif(p, w, h))
+    return get_runcoeff, (lc, None, out_dir), {"mesh": mesh_store(data_dir, size)}
+
+
+def case_get_gully(data_dir, size, out_dir):
+    from gully_number import get_gully
+    w, h = extent(data_dir, size)
+    gully = data_file(data_dir, size, "gully.shp", lambda p: synthetic.gully_shp(p, max(size // 10, 1), w, h))
+    return get_gully, (mesh_store(data_dir, size), gully, os.path.join(out_dir, "num_gully.txt")), {}
+
+
+def case_attach_attibute(data_dir, size, out_dir):
+    from polygon_attribute import attach_attibute
+    return attach_attibute, (mesh_layer(data_dir, size), result_dir(data_dir, size), out_dir, 4, 1, 5, "bench"), \
+        {"store": mesh_store(data_dir, size)}
+
+
+def case_interp_engine(data_dir, size, out_dir):
+    from interpolation import interp_engine
+    return interp_engine, (mesh_store(data_dir, size), 5), {}
+
+
+def case_interp_apply(data_dir, size, out_dir):
+    from interpolation import interp_engine, interp_apply
+    store = mesh_store(data_dir, size)
+    engine = interp_engine(store, 5, cache_dir=os.path.join(data_dir, str(size)))
+    n_cell = int(engine["node_col"].max()) + 1
+    return interp_apply, (engine, np.random.default_rng(0).random(n_cell)), {}
+
+
+def case_tile_plan(data_dir, size, out_dir):
+    from tiled import tile_plan
+    w, h = extent(data_dir, size)
+    return tile_plan, (mesh_store(data_dir, size), os.path.join(out_dir, "plan"), max(w, h) / 8), {}
+
+
+# case name -> (setup function, modules the case needs)
+cases = {
+    "vertex_index": (case_vertex_index, []),
+    "cad2poly": (case_cad2poly, ["pandas"]),
+    "edge_cell_find": (case_edge_cell_find, ["pandas"]),
+    "poly2msh": (case_poly2msh, ["pandas"]),
+    "poly2msh_rcm": (case_poly2msh_rcm, ["pandas"]),
+    "read_faces": (case_read_faces, []),
+    "foam_to_txt": (case_foam_to_txt, ["shapely"]),
+    "build_store": (case_build_store, ["shapely"]),
+    "read_step": (case_read_step, ["shapely"]),
+    "flood_stats": (case_flood_stats, ["shapely", "osgeo.gdal", "osgeo.ogr"]),
+    "get_stats": (case_get_stats, ["shapely", "osgeo.gdal", "osgeo.ogr"]),
+    "export_results": (case_export_results, ["shapely"]),
+    "snapshot": (case_snapshot, ["shapely"]),
+    "hydrograph": (case_hydrograph, ["shapely"]),
+    "write_mesh_layer": (case_write_mesh_layer, ["shapely", "osgeo.ogr"]),
+    "get_runcoeff": (case_get_runcoeff, ["shapely", "osgeo.gdal"]),
+    "get_gully": (case_get_gully, ["shapely", "osgeo.ogr"]),
+    "attach_attibute": (case_attach_attibute, ["shapely", "osgeo.gdal", "osgeo.ogr"]),
+    "interp_engine": (case_interp_engine, ["shapely"]),
+    "interp_apply": (case_interp_apply, ["shapely"]),
+    "tile_plan": (case_tile_plan, ["shapely", "osgeo.gdal", "osgeo.ogr"]),
+}
+
+
+def proc_status(field):
+    # a memory field (e.g. VmRSS, VmHWM) of /proc/self/status in MB, None if it is not available
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_reset():
+    # reset the peak resident set size (VmHWM) of this process, so generating inputs is not counted
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(name, data_dir, size, conn):
+    # run in a forked process, so peak memory of the call is not mixed with other cases
+    try:
+        os.makedirs(os.path.join(data_dir, str(size)), exist_ok=True)
+        out_dir = tempfile.mkdtemp(prefix=name + "_", dir=os.path.join(data_dir, str(size)))
+        func, args, kwargs = cases[name][0](data_dir, size, out_dir)
+        rss_base = proc_status("VmRSS")
+        if not peak_reset() or rss_base is None:
+            # ru_maxrss (in KB on Linux) can not be reset, so it includes the setup
+            rss_base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        t = time.perf_counter()
+        func(*args, **kwargs)
+        t = time.perf_counter() - t
+        rss_peak = proc_status("VmHWM")
+        if rss_peak is None:
+            rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        conn.send({"time": t, "peak_rss_mb": rss_peak, "rss_increase_mb": rss_peak - rss_base})
+    except Exception as e:
+        conn.send({"error": type(e).__name__ + ": " + str(e)})
+    conn.close()
+
+
+def missing_module(names):
+    # the first module (of a case) which cannot be imported, None if all are available
+    for m in names:
+        try:
+            __import__(m)
+        except ImportError:
+            return m
+    return None
+
+
+def scaling(results):
+    # slope of log(time) against log(size) of every case with at least two sizes
+    exponent = {}
+    for name in sorted(set(r["case"] for r in results)):
+        r = [(r["size"], r["time"]) for r in results if r["case"] == name and "time" in r]
+        if len(set(s for (s, _) in r)) > 1:
+            s, t = np.log(np.array(r)).T
+            exponent[name] = float(np.polyfit(s, t, 1)[0])
+    return exponent
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "-C", root, "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes, names=None, repeat=1, data_dir=None, out="benchmark.json"):
+    '''
+    sizes: the numbers of cells (or triangles, or CAD segments and points for cad2poly and vertex_index)
+    names: the cases to run, None for all cases (cases whose modules are not installed are skipped)
+    repeat: the number of measured calls of every case and size, the fastest one is kept
+    data_dir: the directory generated inputs are cached in, a temporary directory if None
+    out: the .json file results are saved to
+    '''
+    data_dir = tempfile.mkdtemp(prefix="benchmark_") if data_dir is None else data_dir
+    ctx = multiprocessing.get_context("fork")
+    results = []
+    for name in (cases if names is None else names):
+        skip = missing_module(cases[name][1])
+        if skip is not None:
+            print("Case " + name + " is skipped (no " + skip + ")")
+            continue
+        for size in sizes:
+            best = None
+            for k in range(repeat):
+                recv, send = ctx.Pipe(duplex=False)
+                proc = ctx.Process(target=measure, args=(name, data_dir, size, send))
+                proc.start()
+                send.close()
+                r = recv.recv() if recv.poll(None) else {"error": "no result"}
+                proc.join()
+                if "error" in r or best is None or r["time"] < best["time"]:
+                    best = r
+                if "error" in r:
+                    break
+            results.append(dict(case=name, size=size, **best))
+            print(name + " " + str(size) + ": " + (best["error"] if "error" in best else
+                  "%.3f s, peak RSS %.1f MB" % (best["time"], best["peak_rss_mb"])))
+    report = {"version": git_version(), "date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": sys.version.split()[0],
+              "numpy": np.__version__, "platform": platform.platform(), "cpu_count": os.cpu_count(),
+              "results": results, "scaling": scaling(results)}
+    with open(out, "w") as f:
+        json.dump(report, f, indent=1)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every stage on synthetic inputs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="the numbers of cells, e.g. 10000 to 10000000")
+    parser.add_argument("--cases", nargs="*", default=None, choices=list(cases), help="cases to run (default all)")
+    parser.add_argument("--repeat", type=int, default=1, help="the number of measured calls of every case and size")
+    parser.add_argument("--data-dir", default=None, help="the directory generated inputs are cached in")
+    parser.add_argument("--out", default="benchmark.json", help="the .json file results are saved to")
+    args = parser.parse_args()
+    run_benchmark(args.sizes, names=args.cases, repeat=args.repeat, data_dir=args.data_dir, out=args.out)
@@ -0,0 +1,230 @@
+# synthetic inputs of every stage at configurable sizes for benchmarks
+# CAD segment .csv, Triangle outputs, OpenFOAM polyMesh and field files, landcover GeoTIFF and gully shapefile
+import gzip
+import os
+import numpy as np
+
+# FoamFile header of generated OpenFOAM files
+foam_header = "FoamFile\n{\n    version     2.0;\n    format      %s;\n    arch        \"LSB;label=32;scalar=64\";\n" \
+              "    class       %s;\n    location    \"%s\";\n    object      %s;\n}\n\n"
+
+
+def grid_size(n_cell):
+    # nx, ny of a square grid with about n_cell cells
+    nx = max(int(np.ceil(np.sqrt(n_cell))), 2)
+    return nx, max(int(np.ceil(n_cell / nx)), 2)
+
+
+def cad_csv(file, n_seg, seed=0):
+    '''
+    Write an AutoCAD DataExtraction .csv of polylines, i.e. a square outer boundary
+    and a grid of square holes, with about n_seg segments in random order
+    '''
+    rng = np.random.default_rng(seed)
+    k = max(int(np.sqrt(n_seg / 8)), 1)
+    # the outer boundary is split into 4k segments on each side, every hole has 4 segments
+    t = np.arange(4 * k + 1, dtype=np.float64)
+    side = [np.column_stack([t, np.zeros_like(t)]), np.column_stack([np.full_like(t, 4 * k), t]),
+            np.column_stack([t[::-1], np.full_like(t, 4 * k)]), np.column_stack([np.zeros_like(t), t[::-1]])]
+    seg = [np.column_stack([s[:-1], s[1:]]) for s in side]
+    x, y = np.meshgrid(np.arange(k) * 4 + 1.5, np.arange(k) * 4 + 1.5)
+    x = x.ravel()
+    y = y.ravel()
+    corner = np.stack([np.column_stack([x, y]), np.column_stack([x + 1, y]),
+                       np.column_stack([x + 1, y + 1]), np.column_stack([x, y + 1])], axis=1)
+    seg.append(np.concatenate([corner, np.roll(corner, -1, axis=1)], axis=2).reshape(-1, 4))
+    seg = np.concatenate(seg)
+    seg = seg[rng.permutation(len(seg))]
+    with open(file, "w", encoding="utf-8") as f:
+        f.write("端点 X,端点 Y,起点 X,起点 Y\n")
+        np.savetxt(f, seg[:, [2, 3, 0, 1]], fmt="%.6f", delimiter=",")
+    return len(seg)
+
+
+def triangle_files(prefix, n_cell):
+    '''
+    Write Triangle's prefix.node, prefix.edge, prefix.ele of a triangulated grid of about n_cell triangles
+    with a square hole in the middle, markers are 1 on the outer boundary and 2 on the hole boundary
+    '''
+    nx, ny = grid_size(n_cell / 2)
+    i, j = np.meshgrid(np.arange(nx), np.arange(ny))
+    hole = (np.abs(i - nx / 2 + 0.5) < nx / 8) & (np.abs(j - ny / 2 + 0.5) < ny / 8)
+    i = i[~hole]
+    j = j[~hole]
+    p = j * (nx + 1) + i
+    ele = np.concatenate([np.column_stack([p, p + 1, p + nx + 2]), np.column_stack([p, p + nx + 2, p + nx + 1])])
+    # nodes of removed cells are dropped and the others are renumbered from 1
+    used, ele = np.unique(ele, return_inverse=True)
+    ele = ele.reshape(-1, 3) + 1
+    xy = np.column_stack([used % (nx + 1), used // (nx + 1)]).astype(np.float64)
+    edge = np.sort(np.concatenate([ele[:, [0, 1]], ele[:, [1, 2]], ele[:, [2, 0]]]), axis=1)
+    edge, count = np.unique(edge, axis=0, return_counts=True)
+    on_outer = (xy[:, 0] == 0) | (xy[:, 0] == nx) | (xy[:, 1] == 0) | (xy[:, 1] == ny)
+    boundary = count == 1
+    outer_edge = on_outer[edge[:, 0] - 1] & on_outer[edge[:, 1] - 1]
+    edge_marker = np.where(boundary, np.where(outer_edge, 1, 2), 0)
+    node_marker = np.zeros(len(xy), dtype=np.int64)
+    node_marker[edge[boundary & ~outer_edge].ravel() - 1] = 2
+    node_marker[on_outer] = 1
+    with open(prefix + ".node", "w") as f:
+        f.write(str(len(xy)) + " 2 0 1\n")
+        np.savetxt(f, np.column_stack([np.arange(1, len(xy) + 1), xy, node_marker]), fmt="%d %.6f %.6f %d")
+        f.write("# Generated by benchmark\n")
+    with open(prefix + ".ele", "w") as f:
+        f.write(str(len(ele)) + " 3 0\n")
+        np.savetxt(f, np.column_stack([np.arange(1, len(ele) + 1), ele]), fmt="%d")
+    with open(prefix + ".edge", "w") as f:
+        f.write(str(len(edge)) + " 1\n")
+        np.savetxt(f, np.column_stack([np.arange(1, len(edge) + 1), edge, edge_marker]), fmt="%d")
+    return len(ele)
+
+
+def write_foam(file, fmt, cls, location, name, body):
+    # write an OpenFOAM file whose body is a list of strings / bytes
+    opener = gzip.open if file.endswith(".gz") else open
+    with opener(file, "wb") as f:
+        f.write((foam_header % (fmt, cls, location, name)).encode())
+        for b in body:
+            f.write(b if isinstance(b, bytes) else b.encode())
+
+
+def foam_list(arr, fmt, kind):
+    # body of an OpenFOAM list "N(...)" of labels, scalars or vectors in ASCII or binary
+    n = len(arr)
+    if fmt == "binary":
+        dtype = np.int32 if kind == "label" else np.float64
+        return [str(n) + "\n(", np.ascontiguousarray(arr, dtype=dtype).tobytes(), ")\n"]
+    if kind == "vector":
+        text = "\n".join(map(lambda v: "(%r %r %r)" % tuple(v), arr.tolist()))
+    else:
+        text = "\n".join(map(repr, arr.tolist()))
+    return [str(n) + "\n(\n", text, "\n)\n"]
+
+
+def poly_mesh(mesh_dir, n_cell, dx=10.0, fmt="ascii"):
+    '''
+    Write OpenFOAM polyMesh (points, faces, owner, neighbour, boundary) of a grid of about n_cell cells
+    extruded to one cell in z direction, faces are faceList in ASCII or faceCompactList in binary
+    Returns the number of cells
+    '''
+    os.makedirs(mesh_dir, exist_ok=True)
+    nx, ny = grid_size(n_cell)
+    npt = (nx + 1) * (ny + 1)
+    x, y = np.meshgrid(np.arange(nx + 1) * dx, np.arange(ny + 1) * dx)
+    xy = np.column_stack([x.ravel(), y.ravel()])
+    point = np.concatenate([np.column_stack([xy, np.zeros(npt)]), np.column_stack([xy, np.full(npt, dx)])])
+
+    def pid(i, j, k):
+        return k * npt + j * (nx + 1) + i
+
+    def x_face(i, j):
+        return np.column_stack([pid(i, j, 0), pid(i, j + 1, 0), pid(i, j + 1, 1), pid(i, j, 1)])
+
+    def y_face(i, j):
+        return np.column_stack([pid(i, j, 0), pid(i, j, 1), pid(i + 1, j, 1), pid(i + 1, j, 0)])
+
+    i, j = np.meshgrid(np.arange(nx), np.arange(ny))
+    i = i.ravel()
+    j = j.ravel()
+    cell = j * nx + i
+    # internal faces are ordered by owner and then by neighbour
+    xi = i < nx - 1
+    yj = j < ny - 1
+    face = np.concatenate([x_face(i[xi] + 1, j[xi]), y_face(i[yj], j[yj] + 1)])
+    owner = np.concatenate([cell[xi], cell[yj]])
+    neighbour = np.concatenate([cell[xi] + 1, cell[yj] + nx])
+    order = np.lexsort((neighbour, owner))
+    face, owner, neighbour = face[order], owner[order], neighbour[order]
+    # walls on the 4 sides, then front (z=0) and back (z=dx)
+    a = np.arange(nx)
+    b = np.arange(ny)
+    wall = [x_face(np.zeros(ny, dtype=np.int64), b)[:, ::-1], x_face(np.full(ny, nx), b),
+            y_face(a, np.zeros(nx, dtype=np.int64))[:, ::-1], y_face(a, np.full(nx, ny))]
+    wall_owner = [b * nx, b * nx + nx - 1, a, (ny - 1) * nx + a]
+    front = np.column_stack([pid(i, j, 0), pid(i, j + 1, 0), pid(i + 1, j + 1, 0), pid(i + 1, j, 0)])
+    back = np.column_stack([pid(i, j, 1), pid(i + 1, j, 1), pid(i + 1, j + 1, 1), pid(i, j + 1, 1)])
+    n_internal = len(face)
+    n_wall = 2 * (nx + ny)
+    face = np.concatenate([face] + wall + [front, back])
+    owner = np.concatenate([owner] + wall_owner + [cell, cell])
+    loc = "constant/polyMesh"
+    write_foam(os.path.join(mesh_dir, "points"), fmt, "vectorField", loc, "points", foam_list(point, fmt, "vector"))
+    if fmt == "binary":
+        offset = np.arange(len(face) + 1) * 4
+        write_foam(os.path.join(mesh_dir, "faces"), fmt, "faceCompactList", loc, "faces",
+                   foam_list(offset, fmt, "label") + foam_list(face.ravel(), fmt, "label"))
+    else:
+        text = "\n".join(map(lambda f: "4(%d %d %d %d)" % f, map(tuple, face.tolist())))
+        write_foam(os.path.join(mesh_dir, "faces"), fmt, "faceList", loc, "faces",
+                   [str(len(face)) + "\n(\n", text, "\n)\n"])
+    write_foam(os.path.join(mesh_dir, "owner"), fmt, "labelList", loc, "owner", foam_list(owner, fmt, "label"))
+    write_foam(os.path.join(mesh_dir, "neighbour"), fmt, "labelList", loc, "neighbour",
+               foam_list(neighbour, fmt, "label"))
+    boundary = "2\n(\n    walls\n    {\n        type wall;\n        nFaces %d;\n        startFace %d;\n    }\n" \
+               "    frontAndBack\n    {\n        type empty;\n        nFaces %d;\n        startFace %d;\n    }\n)\n" \
+               % (n_wall, n_internal, 2 * nx * ny, n_internal + n_wall)
+    write_foam(os.path.join(mesh_dir, "boundary"), "ascii", "polyBoundaryMesh", loc, "boundary", [boundary])
+    return nx * ny
+
+
+def fields(result_dir, n_cell, times, fmt="ascii", seed=0):
+    '''
+    Write h.gz and U.gz (nonuniform internalField) of every time in result_dir/<time>
+    '''
+    rng = np.random.default_rng(seed)
+    for t in times:
+        t_dir = os.path.join(result_dir, str(t))
+        os.makedirs(t_dir, exist_ok=True)
+        h = rng.random(n_cell)
+        u = np.column_stack([rng.normal(size=(n_cell, 2)), np.zeros(n_cell)])
+        for (name, cls, kind, arr) in [("h", "volScalarField", "scalar", h), ("U", "volVectorField", "vector", u)]:
+            dim = "[0 1 0 0 0 0 0]" if name == "h" else "[0 1 -1 0 0 0 0]"
+            body = ["dimensions      " + dim + ";\n\ninternalField   nonuniform List<" + kind + "> "]
+            body += foam_list(arr, fmt, kind)
+            body += [";\n\nboundaryField\n{\n}\n"]
+            write_foam(os.path.join(t_dir, name + ".gz"), fmt, cls, str(t), name, body)
+
+
+def landcover_tif(file, width, height, pixel=5.0, seed=0):
+    '''
+    Write a landcover GeoTIFF of random classes covering [0, width] x [0, height] (needs GDAL)
+    '''
+    from osgeo import gdal
+    rng = np.random.default_rng(seed)
+    cols = int(np.ceil(width / pixel))
+    rows = int(np.ceil(height / pixel))
+    ds = gdal.GetDriverByName("GTiff").Create(file, cols, rows, 1, gdal.GDT_Byte, options=["TILED=YES"])
+    ds.SetGeoTransform((0, pixel, 0, rows * pixel, 0, -pixel))
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(255)
+    classes = np.array([10, 20, 30, 50, 60, 90, 255], dtype=np.uint8)
+    for r in range(0, rows, 1024):
+        band.WriteArray(classes[rng.integers(0, len(classes), size=(min(1024, rows - r), cols))], 0, r)
+    ds = None
+
+
+def gully_shp(file, n_gully, width, height, seed=0):
+    '''
+    Write a point shapefile of n_gully random gullies named "Y<k>" and as many other points named "X<k>"
+    (needs OGR)
+    '''
+    from osgeo import ogr
+    rng = np.random.default_rng(seed)
+    xy = rng.random((2 * n_gully, 2)) * [width, height]
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    if os.path.exists(file):
+        driver.DeleteDataSource(file)
+    data_source = driver.CreateDataSource(file)
+    layer = data_source.CreateLayer("gully", None, ogr.wkbPoint)
+    layer.CreateField(ogr.FieldDefn("NAME", ogr.OFTString))
+    defn = layer.GetLayerDefn()
+    layer.StartTransaction()
+    for k in range(len(xy)):
+        feat = ogr.Feature(defn)
+        feat.SetField("NAME", ("Y" if k % 2 == 0 else "X") + str(k))
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(float(xy[k, 0]), float(xy[k, 1]))
+        feat.SetGeometry(point)
+        layer.CreateFeature(feat)
+    layer.CommitTransaction()
+    data_source = layer = None
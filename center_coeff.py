@@ -1,60 +1,234 @@
 # get the runoff coefficient of OpenFOAM cell centers according to landcover
 from osgeo import gdal
-from itertools import islice
-import struct
-import re
+import hashlib
+import os
+import numpy as np
+import shapely
+from foam_reader import read_internal_field
+from mesh_geometry import csr_polygons
+from mesh_store import open_store, store_hash
 
 
-fmttypes = {'Byte':'B', 'UInt16':'H', 'Int16':'h', 'UInt32':'I', 'Int32':'i', 'Float32':'f', 'Float64':'d'}
+# default landcover class -> runoff coefficient, other classes -> 1
+lc_coeff = {10: 0.4, 20: 0.2, 30: 0.2, 50: 0.2, 60: 1, 90: 0.6}
 
 
-def get_runcoeff(lc, p, dest):
+def load_lut(file=None, default=1):
+    '''
+    Load the landcover class -> runoff coefficient lookup table
+    file: text file with one "class coefficient" pair per line ("#" for comments), None for lc_coeff
+    default: the coefficient of classes not in the table
+    Returns a 256-entry array (65536-entry if any class > 255) indexed by landcover class
+    '''
+    if file is None:
+        table = lc_coeff
+    else:
+        pair = np.loadtxt(file, comments="#", ndmin=2)
+        table = {int(c): v for (c, v) in pair}
+    bad = [c for c in table if c < 0 or c > 65535]
+    if len(bad) > 0:
+        raise ValueError("Landcover classes should be in 0..65535, got " + ", ".join(str(c) for c in bad))
+    lut = np.full(256 if max(table, default=0) < 256 else 65536, default, dtype=np.float64)
+    lut[list(table.keys())] = list(table.values())
+    return lut
+
+
+def apply_lut(lc_class, lut, nodata_coeff, default=1):
+    '''
+    Map landcover classes to runoff coefficients with one indexing operation
+    NaN classes (out of extent or NoData) get nodata_coeff, classes beyond the table get default
+    '''
+    valid = ~np.isnan(lc_class)
+    lc_int = np.where(valid, lc_class, -1).astype(np.int64)
+    in_lut = (lc_int >= 0) & (lc_int < len(lut))
+    coeff = np.where(in_lut, lut[np.where(in_lut, lc_int, 0)], default)
+    coeff[~valid] = nodata_coeff
+    return coeff
+
+
+def overlap_matrix(ds, poly, chunk=1000000):
+    '''
+    Compute the cell x pixel overlap matrix in sparse (coordinate) form
+    Parameters
+    ----------
+    ds: the opened GDAL raster dataset
+    poly: shapely polygons of cells ordered by cell id
+    chunk: the number of (cell, pixel) pairs processed at once (a cell covering more pixels is processed alone)
+    Returns
+    -------
+    a dictionary of "cell", "row", "col" (pixel index) and "weight" (fraction of the cell area in the pixel)
+    '''
+    gt = ds.GetGeoTransform()
+    area = shapely.area(poly)
+    bounds = shapely.bounds(poly)
+    # pixel ranges covered by the bounding box of each cell, clipped to the raster
+    c0 = np.clip(np.floor((bounds[:, 0] - gt[0]) / gt[1]), 0, ds.RasterXSize - 1).astype(np.int64)
+    c1 = np.clip(np.floor((bounds[:, 2] - gt[0]) / gt[1]), 0, ds.RasterXSize - 1).astype(np.int64)
+    r0 = np.clip(np.floor((bounds[:, 3] - gt[3]) / gt[5]), 0, ds.RasterYSize - 1).astype(np.int64)
+    r1 = np.clip(np.floor((bounds[:, 1] - gt[3]) / gt[5]), 0, ds.RasterYSize - 1).astype(np.int64)
+    nx = c1 - c0 + 1
+    ny = r1 - r0 + 1
+    # cells are split into runs of at most chunk candidate pixels, so a few huge cells cannot blow up memory
+    pair_end = np.cumsum(nx * ny)
+    part = {"cell": [], "row": [], "col": [], "weight": []}
+    i = 0
+    while i < len(poly):
+        j = max(int(np.searchsorted(pair_end, pair_end[i] - nx[i] * ny[i] + chunk, side="right")), i + 1)
+        cell = np.arange(i, j)
+        i = j
+        cnt = nx[cell] * ny[cell]
+        cell = np.repeat(cell, cnt)
+        k = np.arange(len(cell)) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+        col = c0[cell] + k % nx[cell]
+        row = r0[cell] + k // nx[cell]
+        pixel = shapely.box(gt[0] + col * gt[1], gt[3] + (row + 1) * gt[5],
+                            gt[0] + (col + 1) * gt[1], gt[3] + row * gt[5])
+        inter = shapely.area(shapely.intersection(poly[cell], pixel))
+        keep = inter > 0
+        part["cell"].append(cell[keep])
+        part["row"].append(row[keep])
+        part["col"].append(col[keep])
+        part["weight"].append(inter[keep] / area[cell[keep]])
+    return {k: np.concatenate(v) for (k, v) in part.items()}
+
+
+def load_overlap(ds, mesh, cache=None):
+    '''
+    Load the cell x pixel overlap matrix from the cache, or compute and cache it
+    The cache is keyed by the content hash of the mesh store and the raster grid
+    Parameters
+    ----------
+    ds: the opened GDAL raster dataset
+    mesh: the directory of the mesh store (cell polygons are read from it, see mesh_store)
+    cache: the address of the .npz cache file, None for no caching
+    '''
+    store = open_store(mesh, ["point", "cell_poly", "cell_poly_offset"])
+    c_offset = store["cell_poly_offset"]
+    key = hashlib.sha1(store_hash(mesh).encode())
+    key.update(np.array([*ds.GetGeoTransform(), ds.RasterXSize, ds.RasterYSize], dtype=np.float64).tobytes())
+    key = key.hexdigest()
+    if cache is not None and os.path.isfile(cache):
+        overlap = dict(np.load(cache))
+        if str(overlap.pop("key")) == key:
+            return overlap, len(c_offset) - 1
+        print("Overlap cache is out of date, recompute it")
+    overlap = overlap_matrix(ds, csr_polygons(store["point"], store["cell_poly"], c_offset))
+    if cache is not None:
+        np.savez(cache, key=key, **overlap)
+    return overlap, len(c_offset) - 1
+
+
+def area_coeff(overlap, lc_class, lut, n_cell, nodata_coeff, default=1):
+    '''
+    Area-weighted runoff coefficient of cells, i.e. sum of (fraction of class in cell) * (coefficient of class)
+    Parameters
+    ----------
+    overlap: the overlap matrix returned by overlap_matrix
+    lc_class: landcover class of each overlap entry, NaN for NoData
+    '''
+    valid = ~np.isnan(lc_class)
+    w = np.where(valid, overlap["weight"], 0)
+    c = apply_lut(lc_class, lut, nodata_coeff, default)
+    w_sum = np.bincount(overlap["cell"], weights=w, minlength=n_cell)
+    wc_sum = np.bincount(overlap["cell"], weights=w * c, minlength=n_cell)
+    # fractions are normalized by the area with valid landcover
+    coeff = np.full(n_cell, nodata_coeff, dtype=np.float64)
+    np.divide(wc_sum, w_sum, out=coeff, where=w_sum > 0)
+    return coeff
+
+
+def sample_raster(ds, xy, nodata, mode="window", block_rows=1024):
+    '''
+    Sample the 1st band of a raster at points in one vectorized pass
+    Parameters
+    ----------
+    ds: the opened GDAL raster dataset
+    xy: (n, 2) array of map coordinates of points
+    nodata: the value returned for points out of the raster extent or on NoData pixels
+    mode, block_rows: how the raster is read, see sample_pixels
+    Returns
+    -------
+    (n,) array of pixel values
+    '''
+    gt = ds.GetGeoTransform()
+    # Convert from map to pixel coordinates.
+    # Only works for geotransforms with no rotation.
+    px = np.floor((xy[:, 0] - gt[0]) / gt[1]).astype(np.int64)  # x pixel
+    py = np.floor((xy[:, 1] - gt[3]) / gt[5]).astype(np.int64)  # y pixel
+    return sample_pixels(ds, px, py, nodata, mode=mode, block_rows=block_rows)
+
+
+def sample_pixels(ds, px, py, nodata, mode="window", block_rows=1024):
+    '''
+    Gather values of the 1st band of a raster at pixel indices with fancy indexing
+    Parameters
+    ----------
+    ds: the opened GDAL raster dataset
+    px, py: column and row indices of pixels
+    nodata: the value returned for pixels out of the raster extent or on NoData pixels
+    mode: "window" to read the bounding window of all pixels at once,
+    "block" to read the bounding window block by block (block_rows rows at once) for very large rasters
+    '''
+    rb = ds.GetRasterBand(1)
+    inside = (px >= 0) & (px < ds.RasterXSize) & (py >= 0) & (py < ds.RasterYSize)
+    value = np.full(len(px), nodata, dtype=np.float64)
+    if not inside.any():
+        return value
+    x0 = int(px[inside].min())
+    x1 = int(px[inside].max()) + 1
+    y0 = int(py[inside].min())
+    y1 = int(py[inside].max()) + 1
+    step = (y1 - y0) if mode == "window" else block_rows
+    # pixels are sorted by row once, every block takes its slice by binary search
+    order = np.flatnonzero(inside)
+    order = order[np.argsort(py[order], kind="stable")]
+    row = py[order]
+    for r0 in range(y0, y1, step):
+        r1 = min(r0 + step, y1)
+        sel = order[np.searchsorted(row, r0):np.searchsorted(row, r1)]
+        if len(sel) == 0:
+            continue
+        window = rb.ReadAsArray(x0, r0, x1 - x0, r1 - r0)
+        value[sel] = window[py[sel] - r0, px[sel] - x0]
+    band_nodata = rb.GetNoDataValue()
+    if band_nodata is not None:
+        value[inside & (value == band_nodata)] = nodata
+    return value
+
+
+def get_runcoeff(lc, p, dest, lut=None, nodata_coeff=1, mode="window", block_rows=1024, mesh=None, cache=None):
     '''
     lc: the address the landcover tiff is stored in
-    p: the address the OpenFOAM cell center file is stored in
-    (cell center file can be extracted by OpenFOAM function)
+    p: the directory of the mesh store, or the address the OpenFOAM cell center file is stored in
+    (cell center file can be extracted by OpenFOAM function, not used in area-weighted mode)
     dest: the directory address the output runoff coeff stored in
+    lut: the address of landcover class -> runoff coeff table (see load_lut), None for lc_coeff
+    nodata_coeff: the runoff coeff of cells out of the landcover extent or on NoData pixels
+    mode, block_rows: how the landcover is read, see sample_pixels
+    mesh: the directory of the mesh store, if given, the runoff coeff of a cell is weighted by
+    the area fraction of every landcover class inside the cell polygon
+    cache: the address of .npz file caching the cell x pixel overlap matrix in area-weighted mode
     '''
     lc = gdal.Open(lc)
-    gt = lc.GetGeoTransform()
-    rb = lc.GetRasterBand(1)
-    p_file = open(file=p)
-    output_file = open(file=dest+"/alpha.txt", mode="a")
-    p_lines = p_file.readlines()
-    for line in islice(p_lines, 22, None):
-        if line[0] == ")":
-            break
-        else:
-            data = re.split(r"[\(\)]", line)
-            data = re.split(r"\s", data[1])
-            del(data[-1])
-            mx = float(data[0])
-            my = float(data[1])
-            # Convert from map to pixel coordinates.
-            # Only works for geotransforms with no rotation.
-            px = int((mx - gt[0]) / gt[1])  # x pixel
-            py = int((my - gt[3]) / gt[5])  # y pixel
-            structval = rb.ReadRaster(px, py, 1, 1, buf_type=rb.DataType)
-            bandtype = gdal.GetDataTypeName(rb.DataType)
-            intval = struct.unpack(fmttypes[bandtype], structval)
-            if intval[0] == 10:
-                output_file.write("0.4\n")
-            elif intval[0] == 20:
-                output_file.write("0.2\n")
-            elif intval[0] == 30:
-                output_file.write("0.2\n")
-            elif intval[0] == 50:
-                output_file.write("0.2\n")
-            elif intval[0] == 60:
-                output_file.write("1\n")
-            elif intval[0] == 90:
-                output_file.write("0.6\n")
-            else:
-                output_file.write("1\n")
-    p_file.close()
-    output_file.close()
-
-
-lc_file = "tiff/lc_case.tif"
-p_file = "case_10m/center"
-get_runcoeff(lc=lc_file, p=p_file, dest="case_10m")
+    lut = load_lut(lut)
+    if mesh is None:
+        # cell centers are computed from polyMesh in the mesh store, or read from the cell center file
+        center = open_store(p, ["cell_center"])["cell_center"] if os.path.isdir(p) else read_internal_field(p, "vector")
+        lc_class = sample_raster(lc, center[:, 0:2], nodata=np.nan, mode=mode, block_rows=block_rows)
+        out_num = int(np.isnan(lc_class).sum())
+        coeff = apply_lut(lc_class, lut, nodata_coeff)
+    else:
+        overlap, n_cell = load_overlap(lc, mesh, cache=cache)
+        lc_class = sample_pixels(lc, overlap["col"], overlap["row"], nodata=np.nan, mode=mode, block_rows=block_rows)
+        coeff = area_coeff(overlap, lc_class, lut, n_cell, nodata_coeff)
+        out_num = n_cell - len(np.unique(overlap["cell"][~np.isnan(lc_class)]))
+    lc = None
+    if out_num > 0:
+        print("The number of cells out of landcover or on NoData is " + str(out_num))
+    np.savetxt(dest+"/alpha.txt", coeff, fmt="%g")
+
+
+if __name__ == "__main__":
+    lc_file = "tiff/lc_case.tif"
+    p_file = "case_10m/mesh_store"
+    get_runcoeff(lc=lc_file, p=p_file, dest="case_10m")
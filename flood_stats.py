@@ -0,0 +1,105 @@
+# reduce OpenFOAM simulation results of all time steps into flood statistics of cells
+# (max depth, max velocity, time of peak, arrival time, duration above threshold) in one streaming pass,
+# and save them as mesh layer attributes or pictures instead of exporting pictures of every time step
+import os
+import numpy as np
+import sys
+from functools import partial
+from foam_reader import read_step, prefetch
+from mesh_store import open_store
+from polygon import layer_driver, write_mesh_layer
+from polygon_attribute import cell_raster, open_raster, write_band, close_raster
+
+# statistics of cells, names are short enough for ESRI Shapefile fields
+# max_h: max water depth (m), t_max_h: time of max_h, max_v: max velocity magnitude (m/s), t_max_v: time of max_v
+# t_arrive: the first time h > threshold (-1 for never), dur_wet: duration of h > threshold
+stat_names = ["max_h", "t_max_h", "max_v", "t_max_v", "t_arrive", "dur_wet"]
+
+
+def stats_init(n_cell):
+    # running statistics of n_cell cells
+    stats = {k: np.zeros(n_cell) for k in stat_names}
+    stats["max_h"][:] = -np.inf
+    stats["max_v"][:] = -np.inf
+    stats["t_arrive"][:] = -1
+    return stats
+
+
+def stats_fold(stats, t, dt, h, U, threshold):
+    '''
+    Fold h, U of time t into running statistics in place
+    dt: the time since the last time step, which is counted in dur_wet if h > threshold at time t
+    '''
+    v = np.hypot(U[:, 0], U[:, 1])
+    peak = h > stats["max_h"]
+    stats["max_h"][peak] = h[peak]
+    stats["t_max_h"][peak] = t
+    peak = v > stats["max_v"]
+    stats["max_v"][peak] = v[peak]
+    stats["t_max_v"][peak] = t
+    wet = h > threshold
+    stats["t_arrive"][wet & (stats["t_arrive"] < 0)] = t
+    stats["dur_wet"][wet] += dt
+
+
+def flood_stats(result_dir, n, step, n_cell, threshold=0.01):
+    '''
+    Reduce h, U of time steps step, 2*step, ..., (n-1)*step into statistics of cells (see stat_names)
+    with O(cells) memory, the next time step is read in background while the current one is folded
+    Returns a dictionary of statistic name -> (n_cell,) array
+    '''
+    t_list = [i*step for i in range(1, int(n))]
+    if len(t_list) == 0:
+        raise ValueError("No time step to reduce, n should be larger than 1")
+    stats = stats_init(n_cell)
+    t_last = 0
+    for (k, (t, (h, U))) in enumerate(prefetch(partial(read_step, result_dir, n=n_cell), t_list)):
+        stats_fold(stats, t, t - t_last, h, U, threshold)
+        t_last = t
+        print("Time " + str(t) + " reduced (" + str(k+1) + "/" + str(len(t_list)) + ")")
+    return stats
+
+
+def write_stats(stats, dest, store, mesh=None, unit_size=None, cache_dir=None, compress=None, cog=False,
+                nodata=-9999):
+    '''
+    Save statistics of cells
+    dest: .shp, .gpkg or .fgb for a layer of cell polygons with statistics as attributes,
+    otherwise a multi-band picture (one band per statistic) rasterized by the mesh layer
+    store: the directory of the mesh store
+    mesh, unit_size, cache_dir: the mesh layer, the pixel size and the cache directory of the picture
+    compress, cog: see polygon_attribute.raster_options
+    nodata: NoData value of pixels out of the mesh
+    '''
+    if os.path.splitext(dest)[1].lower() in layer_driver:
+        cell = open_store(store, ["point", "cell_poly", "cell_poly_offset"])
+        write_mesh_layer(cell["point"], cell["cell_poly"], cell["cell_poly_offset"], dest, fields=stats)
+        return
+    if mesh is None or unit_size is None:
+        raise ValueError("The mesh layer and the pixel size are needed for picture " + dest)
+    out = {"compress": compress, "cog": cog, "encoding": "float32", "nodata": nodata}
+    cell_id, inside, gt, n_cell = cell_raster(mesh, int(unit_size), store, cache_dir=cache_dir)
+    target_ds = open_raster(dest + ".part", cell_id.shape[0], cell_id.shape[1], len(stats), gt, out)
+    for (k, (name, arr)) in enumerate(stats.items()):
+        write_band(target_ds, k + 1, arr[cell_id], inside, name, name, out)
+    close_raster(target_ds, dest + ".part", out)
+    os.replace(dest + ".part", dest)
+
+
+def get_stats(result_dir, n, step, store, dest, threshold=0.01, mesh=None, unit_size=None, cache_dir=None,
+              compress=None, cog=False):
+    '''
+    result_dir: the address OpenFOAM simulation result is stored in
+    n: the total number of result file we want to process
+    step: time step for result file
+    store: the directory of the mesh store
+    dest: the output layer (.shp, .gpkg, .fgb) or picture (.tiff), see write_stats
+    threshold: the water depth (m) above which a cell is taken as flooded
+    '''
+    n_cell = len(open_store(store, ["cell_poly_offset"])["cell_poly_offset"]) - 1
+    stats = flood_stats(result_dir, int(n), int(step), n_cell, threshold=float(threshold))
+    write_stats(stats, dest, store, mesh=mesh, unit_size=unit_size, cache_dir=cache_dir, compress=compress, cog=cog)
+
+
+if __name__ == "__main__":
+    get_stats(result_dir=sys.argv[1], n=sys.argv[2], step=sys.argv[3], store=sys.argv[4], dest=sys.argv[5])
@@ -0,0 +1,347 @@
+# read OpenFOAM files (points, faces, owner, neighbour ...) into NumPy arrays
+# ASCII, binary and gzip-compressed (.gz) files are supported, list bodies are streamed in chunks
+import gzip
+import os
+import re
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+CHUNK = 1 << 24  # bytes read at once when streaming a list body
+paren_table = bytes.maketrans(b"()\t", b"   ")
+token_re = re.compile(rb'\s*(?://[^\n]*\n?\s*|/\*.*?\*/\s*)*("[^"]*"|[(){};\[\]]|[^\s(){};"\[\]]+)', re.S)
+
+
+def foam_file(src, name):
+    '''
+    Find an OpenFOAM file in src directory by its name, i.e. name, name.gz or name.txt
+    '''
+    for f in [name, name + ".gz", name + ".txt"]:
+        if os.path.isfile(os.path.join(src, f)):
+            return os.path.join(src, f)
+    raise FileNotFoundError("No " + name + " file in " + src)
+
+
+def foam_open(file):
+    # open an OpenFOAM file in binary mode, gzip-compressed file is decompressed on the fly
+    if file.endswith(".gz"):
+        return gzip.open(file, "rb")
+    return open(file, "rb")
+
+
+def foam_token(f, buf):
+    '''
+    Get the next token (comments are skipped) from the file f whose unread bytes start with buf
+    Returns the token (b"" at the end of file) and the remaining bytes
+    '''
+    while True:
+        if len(buf) < 4096:
+            buf = buf + f.read(1 << 16)
+        m = token_re.match(buf)
+        # the token may be cut by the end of buf, so read more unless it is at the end of file
+        if m is None or m.end() == len(buf):
+            more = f.read(1 << 16)
+            if len(more) > 0:
+                buf = buf + more
+                continue
+            if m is None:
+                return b"", b""
+        return m.group(1), buf[m.end():]
+
+
+def foam_header(f, buf=b""):
+    '''
+    Parse the FoamFile header dictionary
+    Returns
+    -------
+    header : a dictionary of header entries, e.g. {"format": "binary", "class": "faceCompactList", ...}
+             with "label" and "scalar" (bytes of label and scalar) parsed from "arch"
+    buf : the remaining bytes after the header
+    '''
+    tk, buf = foam_token(f, buf)
+    if tk != b"FoamFile":
+        raise ValueError("No FoamFile header")
+    tk, buf = foam_token(f, buf)
+    header = {}
+    entry = []
+    while True:
+        tk, buf = foam_token(f, buf)
+        if tk == b"}" or tk == b"":
+            break
+        elif tk == b";":
+            if len(entry) > 0:
+                header[entry[0]] = " ".join(entry[1:]).strip('"')
+            entry = []
+        else:
+            entry.append(tk.decode())
+    arch = header.get("arch", "")
+    label = re.search(r"label=(\d+)", arch)
+    scalar = re.search(r"scalar=(\d+)", arch)
+    header["label"] = int(label.group(1)) // 8 if label else 4
+    header["scalar"] = int(scalar.group(1)) // 8 if scalar else 8
+    return header, buf
+
+
+def foam_binary(f, buf, num, dtype):
+    # read num items of dtype of a binary list body directly into an array
+    arr = np.empty(num, dtype=dtype)
+    mv = memoryview(arr).cast("B")
+    k = min(len(buf), len(mv))
+    mv[:k] = buf[:k]
+    buf = buf[k:]
+    while k < len(mv):
+        r = f.readinto(mv[k:])
+        if not r:
+            raise ValueError("Unexpected end of file in binary list")
+        k += r
+    return arr, buf
+
+
+def foam_ascii(f, buf, kind, dtype):
+    '''
+    Stream an ASCII list body (after its opening "(") until the matching ")"
+    Returns the flat parsed values and the remaining bytes after the list
+    '''
+    parts = []
+    pending = b""
+    depth = 0
+    while True:
+        if len(buf) == 0:
+            buf = f.read(CHUNK)
+            if len(buf) == 0:
+                raise ValueError("Unexpected end of file in ASCII list")
+        b_arr = np.frombuffer(buf, dtype=np.uint8)
+        d = depth + np.cumsum((b_arr == 40).astype(np.int64) - (b_arr == 41))
+        end = np.flatnonzero(d < 0)
+        if len(end) > 0:
+            piece = pending + buf[:end[0]]
+            buf = buf[end[0]+1:]
+            parts.append(foam_parse(piece, kind, dtype))
+            break
+        depth = d[-1]
+        # keep the last (probably incomplete) token for the next chunk
+        buf = pending + buf
+        cut = max(buf.rfind(b" "), buf.rfind(b"\n")) + 1
+        piece = buf[:cut]
+        pending = buf[cut:]
+        buf = b""
+        parts.append(foam_parse(piece, kind, dtype))
+    return np.concatenate(parts), buf
+
+
+def foam_parse(piece, kind, dtype):
+    # parse a piece of ASCII list body into a flat array
+    # face "n(v1 ... vn)" is parsed as "n v1 ... vn -1"
+    if kind == "face":
+        piece = piece.replace(b")", b" -1 ")
+    piece = piece.translate(paren_table)
+    return np.fromstring(piece.decode("ascii"), dtype=dtype, sep=" ")
+
+
+def face_decode(flat):
+    '''
+    Decode the flat stream of "n v1 ... vn -1" faces into (vertices, offsets)
+    '''
+    end = np.flatnonzero(flat == -1)
+    if len(end) == 0:
+        return flat[:0], np.zeros(1, dtype=flat.dtype)
+    start = np.concatenate([[0], end[:-1] + 1])
+    size = flat[start]
+    if np.any(end - start - 1 != size):
+        raise ValueError("Inconsistent face sizes in face list")
+    keep = np.ones(len(flat), dtype=bool)
+    keep[start] = False
+    keep[end] = False
+    offset = np.concatenate([[0], np.cumsum(size)])
+    return flat[keep], offset
+
+
+def read_list(f, buf, kind, header):
+    '''
+    Read one OpenFOAM list, i.e. "N(...)" or "N{value}", from the file f whose unread bytes start with buf
+    Parameters
+    ----------
+    kind : "label", "scalar", "vector" or "face" (faceList in ASCII)
+    header : the FoamFile header returned by foam_header
+    Returns
+    -------
+    arr : (N,) array for label/scalar, (N, 3) array for vector, (vertices, offsets) for face
+    buf : the remaining bytes after the list
+    '''
+    label_t = np.dtype("<i" + str(header["label"]))
+    scalar_t = np.dtype("<f" + str(header["scalar"]))
+    dtype = scalar_t if kind in ["scalar", "vector"] else label_t
+    width = 3 if kind == "vector" else 1
+    tk, buf = foam_token(f, buf)
+    # List<T> may be written before the size in field files
+    if tk.startswith(b"List<"):
+        tk, buf = foam_token(f, buf)
+    num = int(tk)
+    tk, buf = foam_token(f, buf)
+    if tk == b"{":
+        # uniform list N{value}
+        value = []
+        while True:
+            tk, buf = foam_token(f, buf)
+            if tk == b"}":
+                break
+            if tk not in [b"(", b")"]:
+                value.append(float(tk))
+        arr = np.tile(np.array(value, dtype=dtype), (num, 1)).reshape((num, width) if width > 1 else num)
+        return arr, buf
+    elif tk != b"(":
+        raise ValueError("Expect ( of list but get " + tk.decode())
+    if header.get("format", "ascii") == "binary":
+        if kind == "face":
+            raise ValueError("Binary faceList is not supported, use faceCompactList")
+        arr, buf = foam_binary(f, buf, num * width, dtype)
+        tk, buf = foam_token(f, buf)
+    else:
+        arr, buf = foam_ascii(f, buf, kind, np.int64 if kind == "face" else dtype)
+        if kind == "face":
+            arr = face_decode(arr)
+            if len(arr[1]) - 1 != num:
+                raise ValueError("Expect " + str(num) + " faces but get " + str(len(arr[1]) - 1))
+            return arr, buf
+    if len(arr) != num * width:
+        raise ValueError("Expect " + str(num * width) + " values but get " + str(len(arr)))
+    return (arr.reshape((num, width)) if width > 1 else arr), buf
+
+
+def read_points(file):
+    '''
+    Read OpenFOAM polyMesh points file into (n, 3) float64 array
+    '''
+    with foam_open(file) as f:
+        header, buf = foam_header(f)
+        points, _ = read_list(f, buf, "vector", header)
+    return points.astype(np.float64, copy=False)
+
+
+def read_faces(file):
+    '''
+    Read OpenFOAM polyMesh faces file (faceList or faceCompactList) in CSR form
+    Returns
+    -------
+    face : flat array of vertex ids of all faces
+    offset : (n+1,) array, vertex ids of face i are face[offset[i]:offset[i+1]]
+    '''
+    with foam_open(file) as f:
+        header, buf = foam_header(f)
+        if header.get("class") == "faceCompactList":
+            offset, buf = read_list(f, buf, "label", header)
+            face, _ = read_list(f, buf, "label", header)
+        else:
+            (face, offset), _ = read_list(f, buf, "face", header)
+    return face.astype(np.int64, copy=False), offset.astype(np.int64, copy=False)
+
+
+def read_labels(file):
+    '''
+    Read OpenFOAM labelList file, e.g. polyMesh owner and neighbour, into int64 array
+    '''
+    with foam_open(file) as f:
+        header, buf = foam_header(f)
+        labels, _ = read_list(f, buf, "label", header)
+    return labels.astype(np.int64, copy=False)
+
+
+def read_internal_field(file, kind, n=None):
+    '''
+    Read the internalField of an OpenFOAM field file (e.g. cell center file C, h, U) in one pass
+    "uniform value" and "nonuniform List<scalar|vector>" in ASCII or binary format are supported
+    Parameters
+    ----------
+    kind : "scalar" or "vector"
+    n : the number of cells, only needed for uniform field
+    Returns
+    -------
+    (n,) array for scalar field, (n, 3) array for vector field
+    '''
+    with foam_open(file) as f:
+        header, buf = foam_header(f)
+        while True:
+            tk, buf = foam_token(f, buf)
+            if tk == b"":
+                raise ValueError("No internalField in " + file)
+            elif tk == b"internalField":
+                break
+        tk, buf = foam_token(f, buf)
+        if tk == b"uniform":
+            if n is None:
+                raise ValueError("The number of cells is needed for uniform internalField in " + file)
+            value = []
+            while True:
+                tk, buf = foam_token(f, buf)
+                if tk == b";":
+                    break
+                if tk not in [b"(", b")"]:
+                    value.append(float(tk))
+            field = np.tile(np.array(value, dtype=np.float64), (n, 1))
+            return field.reshape(n) if kind == "scalar" else field
+        elif tk != b"nonuniform":
+            raise ValueError("Expect uniform or nonuniform internalField in " + file)
+        field, _ = read_list(f, buf, kind, header)
+    if n is not None and len(field) != n:
+        raise ValueError("Expect " + str(n) + " cells but get " + str(len(field)) + " in " + file)
+    return field.astype(np.float64, copy=False)
+
+
+def read_step(result_dir, t, n=None):
+    '''
+    Read water depth h and velocity U of time t from result_dir/t/h(.gz) and result_dir/t/U(.gz)
+    '''
+    t_dir = os.path.join(result_dir, str(t))
+    h = read_internal_field(foam_file(t_dir, "h"), "scalar", n)
+    U = read_internal_field(foam_file(t_dir, "U"), "vector", n)
+    return h, U
+
+
+def prefetch(read, items):
+    '''
+    Yield (item, read(item)) for all items, while read(next item) runs in a background thread
+    so that at most two items' data are held in memory
+    '''
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(read, items[0]) if len(items) > 0 else None
+        for k in range(len(items)):
+            data = future.result()
+            if k + 1 < len(items):
+                future = pool.submit(read, items[k+1])
+            yield items[k], data
+
+
+def read_boundary(file):
+    '''
+    Read OpenFOAM polyMesh boundary file
+    Returns a list of (patch name, patch type, start face, number of faces)
+    '''
+    with foam_open(file) as f:
+        header, buf = foam_header(f)
+        tk, buf = foam_token(f, buf)
+        num = int(tk)
+        tk, buf = foam_token(f, buf)
+        patch = []
+        for i in range(0, num):
+            name, buf = foam_token(f, buf)
+            tk, buf = foam_token(f, buf)
+            entry = {}
+            key = []
+            depth = 1
+            # keep the top level entries of the patch dictionary
+            while depth > 0:
+                tk, buf = foam_token(f, buf)
+                if tk == b"":
+                    raise ValueError("Unexpected end of file in " + file)
+                elif tk in [b"{", b"("]:
+                    depth += 1
+                elif tk in [b"}", b")"]:
+                    depth -= 1
+                elif tk == b";":
+                    if depth == 1 and len(key) > 1:
+                        entry[key[0]] = key[1]
+                    key = []
+                elif depth == 1:
+                    key.append(tk.decode())
+            patch.append((name.decode(), entry.get("type", ""), int(entry["startFace"]), int(entry["nFaces"])))
+    return patch
@@ -1,50 +1,43 @@
 # split OpenFOAM mesh file to face and point files
-import re
-from itertools import islice
+import numpy as np
+from foam_reader import foam_file, read_points, read_faces
+from mesh_geometry import face_take
 
 
-def foam_to_txt(src, dest):
-    # open existing foam point file
-    p_file = open(file=src+"/points.txt")
-    point_file = open(file=dest+"/point.txt", mode="a")
-    p_lines = p_file.readlines()
-    for line in islice(p_lines, 20, None):
-        if line[0] == ")":
-            break
-        else:
-            data = re.split(r"[\(\)]", line)
-            data = re.split(r"\s", data[1])
-            del(data[-1])
-            data = " ".join(data)
-            point_file.write(data)
-            point_file.write("\n")
-    p_file.close()
-    point_file.close()
+def face_order(offset):
+    '''
+    Order faces as quadrangles first, then triangles, then other polygons (OpenFOAM order kept in each group)
+    which keeps the face ids of the former face_4.txt + face_3.txt layout
+    '''
+    size = np.diff(offset)
+    group = np.where(size == 4, 0, np.where(size == 3, 1, 2))
+    return np.argsort(group, kind="stable")
 
-    f_file = open(file=src+"/faces.txt")
-    face_3_file = open(file=dest+"/face_3.txt", mode="a")
-    face_4_file = open(file=dest+"/face_4.txt", mode="a")
-    f_lines = f_file.readlines()
-    for line in islice(f_lines, 20, None):
-        if line[0] == ")":
-            break
-        else:
-            data = re.split(r"[\(\)]", line)
-            lin = re.split(r"\s", data[1])
-            l = len(lin)
-            lin.append(lin[0])
-            lin = " ".join(lin)
-            if l == 3:
-                face_3_file.write(lin)
-                face_3_file.write("\n")
-            elif l == 4:
-                face_4_file.write(lin)
-                face_4_file.write("\n")
-            else:
-                continue
-    f_file.close()
-    face_3_file.close()
-    face_4_file.close()
 
+def foam_to_txt(src, dest, fmt="txt"):
+    '''
+    src: the directory OpenFOAM points and faces files are stored in
+    (ASCII or binary, file name can be points, points.gz or points.txt, so can faces)
+    dest: the directory output files are stored in
+    fmt: "txt" for .txt outputs, "npy" for .npy outputs
+    Outputs are point, face and face_offset in CSR form (vertex ids of face i are face[face_offset[i]:face_offset[i+1]])
+    for faces of any size, and face_id (the OpenFOAM face id of face i)
+    '''
+    point = read_points(foam_file(src, "points"))
+    face, offset = read_faces(foam_file(src, "faces"))
+    face_id = face_order(offset)
+    face, offset = face_take(face, offset, face_id)
+    if fmt == "npy":
+        np.save(dest+"/point.npy", point)
+        np.save(dest+"/face.npy", face)
+        np.save(dest+"/face_offset.npy", offset)
+        np.save(dest+"/face_id.npy", face_id)
+    else:
+        np.savetxt(dest+"/point.txt", point, fmt="%s")
+        np.savetxt(dest+"/face.txt", face, fmt="%d")
+        np.savetxt(dest+"/face_offset.txt", offset, fmt="%d")
+        np.savetxt(dest+"/face_id.txt", face_id, fmt="%d")
 
-foam_to_txt(src="case_10m", dest="case_10m")
+
+if __name__ == "__main__":
+    foam_to_txt(src="case_10m", dest="case_10m")
@@ -1,47 +1,91 @@
 # Form the topological relationship between SWMM gully and OpenFOAM cell
 # i.e. get the number and name of gullies in one cell
-import ogr
-import re
+from osgeo import ogr
+import numpy as np
+import shapely
+from concurrent.futures import ThreadPoolExecutor
+from mesh_geometry import csr_polygons
+from mesh_store import open_store
 
 
-def get_gully(cf_src, g_src, dest):
-    # open mesh face shp file and gully shp file
-    driver = ogr.GetDriverByName('ESRI Shapefile')
-    face_file = driver.Open("shp/mesh_10m.shp", 0)
-    f_layer = face_file.GetLayer()
-    gully_file = driver.Open(g_src, 0)
+# load all features of an OGR layer once, i.e. FIDs, shapely geometries and attribute values
+def load_layer(layer, field=None):
+    fid = []
+    wkb = []
+    value = []
+    layer.ResetReading()
+    for feat in layer:
+        fid.append(feat.GetFID())
+        wkb.append(feat.GetGeometryRef().ExportToWkb())
+        if field is not None:
+            value.append(feat.GetField(field))
+    layer.ResetReading()
+    return np.array(fid, dtype=np.int64), shapely.from_wkb(wkb), np.array(value, dtype=object)
+
+
+def gully_join(face, gully, workers=1, chunk=100000):
+    '''
+    Find the faces every gully falls within by a batched STRtree query
+    Parameters
+    ----------
+    face: shapely polygons of mesh faces indexed by face id (None for missing ids)
+    gully: shapely points of gullies
+    workers: the number of threads querying chunks of gullies in parallel
+    chunk: the number of gullies in one chunk
+    Returns
+    -------
+    (gully index, face id) pairs sorted by face id and then by gully index
+    '''
+    tree = shapely.STRtree(face)
+
+    def query(i):
+        return tree.query(gully[i:i+chunk], predicate="within") + np.array([[i], [0]])
+
+    starts = range(0, len(gully), chunk)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pair = list(pool.map(query, starts))
+    else:
+        pair = [query(i) for i in starts]
+    pair = np.concatenate(pair, axis=1) if len(pair) > 0 else np.empty((2, 0), dtype=np.int64)
+    order = np.lexsort((pair[0], pair[1]))
+    return pair[0][order], pair[1][order]
+
+
+def get_gully(store, g_src, dest, workers=1):
+    '''
+    store: the directory of the mesh store (face polygons and cell-face relationship are read from it, see mesh_store)
+    g_src: the address of gully shp file
+    dest: the address of output txt, i.e. the number and names of gullies in every cell
+    workers: the number of threads for the spatial join
+    '''
+    # open gully shp file
+    gully_file = ogr.Open(g_src, 0)
     g_layer = gully_file.GetLayer()
     # set filter for gully (gully was named as "Yxx" deliberately in SWMM input file)
     g_layer.SetAttributeFilter("NAME LIKE 'Y%'")
+    _, gully, g_name = load_layer(g_layer, field="NAME")
+    gully_file = None
+    # face polygons are built from the store, indexed by face id
+    mesh = open_store(store, ["point", "face", "face_offset"])
+    face = csr_polygons(mesh["point"], mesh["face"], mesh["face_offset"])
+    # gullies of face f are g_index[f_offset[f]:f_offset[f+1]]
+    g_index, g_face = gully_join(face, gully, workers=workers)
+    f_offset = np.concatenate([[0], np.cumsum(np.bincount(g_face, minlength=len(face)))])
+    cell_face = open_store(store, ["cell_face", "cell_face_offset"])
+    cf_face = cell_face["cell_face"]
+    cf_offset = cell_face["cell_face_offset"]
     # create output file
-    out_file = open(dest, mode="a")
+    out_file = open(dest, mode="w")
     out_file.write("Num\tPoints\n")
-    # open cell-face relationship txt
-    cf_file = open(cf_src)
-    cf_lines = cf_file.readlines()
     # iterate on all cells
-    for line in cf_lines:
-        data = re.split(r"[\(\)]", line)
-        data = re.split(r"\s", data[1])
-        del(data[-1])
-        g_list = []
-        g_num = 0
-        # iterate on faces of one cell
-        for f_index in data:
-            face = f_layer.GetFeature(int(f_index))
-            f_ref = face.GetGeometryRef()
-            # iterate on all of gullies to tell the number of gullies which falls in the cell
-            for gully in g_layer:
-                g_ref = gully.GetGeometryRef()
-                if g_ref.Within(f_ref):
-                    g_list.append(gully.GetField("NAME"))
-                    g_num += 1
-            g_layer.ResetReading()
-        out_file.write(str(g_num)+"\t")
+    for c in range(0, len(cf_offset) - 1):
+        g_list = [g_name[g] for f in cf_face[cf_offset[c]:cf_offset[c+1]] for g in g_index[f_offset[f]:f_offset[f+1]]]
+        out_file.write(str(len(g_list))+"\t")
         out_file.write("\t".join(i for i in g_list))
         out_file.write("\n")
-    cf_file.close()
     out_file.close()
 
 
-get_gully(cf_src="case_10m/cell_face.txt", g_src="shp/gully/Junctions_50N.shp", dest="case_10m/num_gully.txt")
+if __name__ == "__main__":
+    get_gully(store="case_10m/mesh_store", g_src="shp/gully/Junctions_50N.shp", dest="case_10m/num_gully.txt")
@@ -0,0 +1,181 @@
+# interpolate cell values of OpenFOAM results to pictures smoothly
+# cell values are averaged to nodes (area-weighted), then every pixel center is interpolated from the nodes
+# of the cell it falls in (barycentric weights in triangles, bilinear weights in quadrangles)
+# weights are computed once per mesh and picture grid, so every time step is two sparse matrix-vector products
+import hashlib
+import os
+import numpy as np
+import shapely
+from mesh_geometry import csr_polygons
+from mesh_store import open_store, store_hash
+
+
+def node_matrix(cell_poly, cell_poly_offset, cell_area, n_point):
+    '''
+    Sparse (COO) matrix averaging cell values to nodes, weighted by the areas of cells around the node
+    Returns (row, col, weight), i.e. node[row] += weight * cell[col]
+    '''
+    size = np.diff(cell_poly_offset)
+    row = np.asarray(cell_poly, dtype=np.int64)
+    col = np.repeat(np.arange(len(size)), size)
+    weight = np.asarray(cell_area, dtype=np.float64)[col]
+    weight = weight / np.bincount(row, weights=weight, minlength=n_point)[row]
+    return row, col, weight
+
+
+def barycentric(p, a, b, c):
+    # barycentric weights of points p in triangles (a, b, c), all (n, 2) arrays
+    v0 = b - a
+    v1 = c - a
+    v2 = p - a
+    det = v0[:, 0] * v1[:, 1] - v1[:, 0] * v0[:, 1]
+    det = np.where(det == 0, 1, det)
+    wb = (v2[:, 0] * v1[:, 1] - v1[:, 0] * v2[:, 1]) / det
+    wc = (v0[:, 0] * v2[:, 1] - v2[:, 0] * v0[:, 1]) / det
+    return np.column_stack([1 - wb - wc, wb, wc])
+
+
+def bilinear(p, p0, p1, p2, p3):
+    '''
+    Bilinear weights of points p in quadrangles (p0, p1, p2, p3), all (n, 2) arrays
+    i.e. (u, v) solving p = (1-u)(1-v) p0 + u(1-v) p1 + uv p2 + (1-u)v p3 by the inverse bilinear map
+    '''
+    def cross(a, b):
+        return a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+    e = p1 - p0
+    f = p3 - p0
+    g = p0 - p1 + p2 - p3
+    h = p - p0
+    k2 = cross(g, f)
+    k1 = cross(e, f) + cross(h, g)
+    k0 = cross(h, e)
+    # v solves k2 v^2 + k1 v + k0 = 0, which is linear for parallelograms
+    linear = np.abs(k2) < 1e-12 * np.maximum(np.abs(k1), 1e-300)
+    root = np.sqrt(np.maximum(k1 * k1 - 4 * k0 * k2, 0))
+    k2_safe = np.where(linear, 1, k2)
+    v1 = (-k1 - root) / (2 * k2_safe)
+    v2 = (-k1 + root) / (2 * k2_safe)
+    v = np.where(np.abs(v1 - 0.5) <= np.abs(v2 - 0.5), v1, v2)
+    v = np.where(linear, -k0 / np.where(k1 == 0, 1, k1), v)
+    # u from the coordinate with the larger denominator
+    dx = e[:, 0] + g[:, 0] * v
+    dy = e[:, 1] + g[:, 1] * v
+    use_x = np.abs(dx) >= np.abs(dy)
+    u = np.where(use_x, (h[:, 0] - f[:, 0] * v) / np.where(dx == 0, 1, dx),
+                 (h[:, 1] - f[:, 1] * v) / np.where(dy == 0, 1, dy))
+    u = np.clip(u, 0, 1)
+    v = np.clip(v, 0, 1)
+    return np.column_stack([(1 - u) * (1 - v), u * (1 - v), u * v, (1 - u) * v])
+
+
+def pixel_cell(point, cell_poly, cell_poly_offset, xy, chunk=1000000):
+    '''
+    Find the cell every pixel center falls in by a batched STRtree query
+    Returns indices (into xy) of pixels inside the mesh and their cells
+    '''
+    tree = shapely.STRtree(csr_polygons(point, cell_poly, cell_poly_offset))
+    pix_list = []
+    cell_list = []
+    for start in range(0, len(xy), chunk):
+        p_idx, c_idx = tree.query(shapely.points(xy[start:start+chunk]), predicate="intersects")
+        # a pixel center on a shared edge is kept in the cell of the smallest id only
+        order = np.lexsort((c_idx, p_idx))
+        p_idx, c_idx = p_idx[order], c_idx[order]
+        p_idx, first = np.unique(p_idx, return_index=True)
+        pix_list.append(p_idx + start)
+        cell_list.append(c_idx[first])
+    pix = np.concatenate(pix_list) if len(pix_list) > 0 else np.zeros(0, dtype=np.int64)
+    cell = np.concatenate(cell_list) if len(cell_list) > 0 else np.zeros(0, dtype=np.int64)
+    return pix, cell
+
+
+def pixel_weights(point, cell_poly, cell_poly_offset, xy, chunk=1000000):
+    '''
+    Find the cell every pixel center falls in and its interpolation weights
+    Parameters
+    ----------
+    point: point coordinates, cell_poly, cell_poly_offset: cell polygons in CSR form
+    xy: (n, 2) pixel centers
+    Returns
+    -------
+    pix: indices (into xy) of pixels inside the mesh
+    node: (m, 4) node ids and weight: (m, 4) weights of pixels pix (the 4th weight is 0 for triangles)
+    '''
+    size = np.diff(cell_poly_offset)
+    pix, cell = pixel_cell(point, cell_poly, cell_poly_offset, xy, chunk=chunk)
+    node = np.zeros((len(pix), 4), dtype=np.int64)
+    weight = np.zeros((len(pix), 4))
+    p = xy[pix]
+    base = cell_poly_offset[cell]
+    quad = size[cell] == 4
+    q = np.flatnonzero(quad)
+    node[q] = cell_poly[base[q, None] + np.arange(4)]
+    weight[q] = bilinear(p[q], *[point[node[q, k], 0:2] for k in range(4)])
+    # other polygons are split into fan triangles (v0, vi, vi+1), triangles are the case of i = 1
+    todo = np.flatnonzero(~quad)
+    for i in range(1, int(size.max()) - 1 if len(size) > 0 else 0):
+        tri = todo[size[cell[todo]] > i + 1]
+        v = [cell_poly[base[tri]], cell_poly[base[tri] + i], cell_poly[base[tri] + i + 1]]
+        w = barycentric(p[tri], *[point[v[k], 0:2] for k in range(3)])
+        inside = np.all(w >= -1e-9, axis=1) | (size[cell[tri]] == i + 2)
+        tri = tri[inside]
+        node[tri, 0:3] = np.column_stack([v[k][inside] for k in range(3)])
+        weight[tri, 0:3] = np.clip(w[inside], 0, 1)
+        weight[tri] /= weight[tri].sum(axis=1)[:, None]
+        todo = np.setdiff1d(todo, tri, assume_unique=True)
+    return pix, node, weight
+
+
+def interp_engine(store, unit_size, cache_dir=None):
+    '''
+    Build (or load from cache) the interpolation engine of a mesh and a picture grid
+    the grid covers the mesh extent with pixels of unit_size, rows go upwards from the lower edge as face_raster
+    Returns a dictionary of the node matrix (node_row, node_col, node_weight), pixel weights (pix, node, weight),
+    shape (rows, cols), gt (geotransform) and n_point
+    '''
+    if cache_dir is not None:
+        key = hashlib.sha1((store_hash(store) + " " + str(unit_size)).encode()).hexdigest()
+        cache = os.path.join(cache_dir, "interp_" + key + ".npz")
+        if os.path.isfile(cache):
+            data = np.load(cache)
+            engine = {k: data[k] for k in data.files}
+            engine["gt"] = tuple(engine["gt"])
+            engine["shape"] = tuple(engine["shape"])
+            return engine
+    mesh = open_store(store, ["point", "cell_poly", "cell_poly_offset", "cell_area"])
+    point = np.asarray(mesh["point"])
+    cell_poly = np.asarray(mesh["cell_poly"])
+    cell_poly_offset = np.asarray(mesh["cell_poly_offset"])
+    xy_used = point[cell_poly, 0:2]
+    x_min, y_min = xy_used.min(axis=0)
+    x_max, y_max = xy_used.max(axis=0)
+    cols = int((x_max - x_min) / unit_size)
+    rows = int((y_max - y_min) / unit_size)
+    gt = (x_min, unit_size, 0, y_min, 0, unit_size)
+    x, y = np.meshgrid(x_min + (np.arange(cols) + 0.5) * unit_size, y_min + (np.arange(rows) + 0.5) * unit_size)
+    pix, node, weight = pixel_weights(point, cell_poly, cell_poly_offset, np.column_stack([x.ravel(), y.ravel()]))
+    row, col, node_weight = node_matrix(cell_poly, cell_poly_offset, mesh["cell_area"], len(point))
+    engine = {"node_row": row, "node_col": col, "node_weight": node_weight, "pix": pix, "node": node,
+              "weight": weight, "shape": (rows, cols), "gt": gt, "n_point": len(point)}
+    if cache_dir is not None:
+        np.savez(cache, **engine)
+    return engine
+
+
+def interp_apply(engine, value, fill=0):
+    '''
+    Interpolate cell values to the picture grid
+    Returns (rows, cols) array of pixel values (fill for pixels out of the mesh)
+    '''
+    node = np.bincount(engine["node_row"], weights=engine["node_weight"] * value[engine["node_col"]],
+                       minlength=int(engine["n_point"]))
+    out = np.full(int(engine["shape"][0]) * int(engine["shape"][1]), fill, dtype=np.float64)
+    out[engine["pix"]] = np.einsum("ij,ij->i", engine["weight"], node[engine["node"]])
+    return out.reshape(engine["shape"])
+
+
+def interp_inside(engine):
+    # (rows, cols) boolean array, True for pixels in the mesh
+    inside = np.zeros(int(engine["shape"][0]) * int(engine["shape"][1]), dtype=bool)
+    inside[engine["pix"]] = True
+    return inside.reshape(engine["shape"])
@@ -8,48 +8,183 @@ Actually, only the coordinates of points in polyline are required
 '''
 import pandas as pd
 import numpy as np
-import networkx as nx
-import random
-import re
 import os
-from shapely.geometry import Polygon, Point
+import shapely
 
 
-# split one line by spaces
-def space_split(s):
-    s_split = re.split(r"\s+", s.strip())
-    return s_split
+# find the first line which is neither blank nor comment in Triangle's file
+# return its line number and its values
+def triangle_header(file):
+    with open(file) as f:
+        for (i, line) in enumerate(f):
+            data = line.split("#")[0].split()
+            if len(data) > 0:
+                return i, [int(d) for d in data]
+    raise ValueError("Empty Triangle file: " + file)
+
+
+# read a table of Triangle's file into a typed 2D array in one pass
+def triangle_table(file, skip, num, col, dtype):
+    if num == 0:
+        return np.empty((0, col), dtype=dtype)
+    table = np.loadtxt(file, dtype=dtype, comments="#", skiprows=skip, max_rows=num, ndmin=2)
+    if table.shape != (num, col):
+        raise ValueError("Expect " + str(num) + " rows with " + str(col) + " columns in " + file
+                         + " but get " + str(table.shape))
+    return table
+
+
+def loadTriangle(file, kind):
+    '''
+    Load Triangle's .node, .ele, .edge, .poly file into typed NumPy arrays
+    Parameters
+    ----------
+    file : the address of Triangle's file
+    kind : "node", "ele", "edge" or "poly"
+    Returns
+    -------
+    a dictionary of arrays, coordinates are float64, ids and markers are int32
+    node : {"id", "xy", "attr", "marker"}
+    ele : {"id", "ele", "attr"}
+    edge : {"id", "edge", "marker"}
+    poly : {"id", "xy", "attr", "marker", "segment_id", "segment", "segment_marker", "hole"}
+    marker is None if the file has no marker column
+    '''
+    if kind == "node":
+        h_line, (num, dim, n_attr, n_marker) = triangle_header(file)
+        table = triangle_table(file, h_line+1, num, 1+dim+n_attr+n_marker, np.float64)
+        return {"id": table[:, 0].astype(np.int32), "xy": table[:, 1:dim+1],
+                "attr": table[:, dim+1:dim+1+n_attr],
+                "marker": table[:, -1].astype(np.int32) if n_marker > 0 else None}
+    elif kind == "ele":
+        h_line, (num, n_pt, n_attr) = triangle_header(file)
+        if n_attr == 0:
+            table = triangle_table(file, h_line+1, num, 1+n_pt, np.int32)
+            return {"id": table[:, 0], "ele": table[:, 1:], "attr": np.empty((num, 0))}
+        table = triangle_table(file, h_line+1, num, 1+n_pt+n_attr, np.float64)
+        return {"id": table[:, 0].astype(np.int32), "ele": table[:, 1:n_pt+1].astype(np.int32),
+                "attr": table[:, n_pt+1:]}
+    elif kind == "edge":
+        h_line, (num, n_marker) = triangle_header(file)
+        table = triangle_table(file, h_line+1, num, 3+n_marker, np.int32)
+        return {"id": table[:, 0], "edge": table[:, 1:3],
+                "marker": table[:, 3] if n_marker > 0 else None}
+    elif kind == "poly":
+        # .poly file is small, so its sections are parsed line by line
+        with open(file) as f:
+            p_lines = [d for d in (line.split("#")[0].split() for line in f) if len(d) > 0]
+        num, dim, n_attr, n_marker = map(int, p_lines[0])
+        pt = np.array(p_lines[1:num+1], dtype=np.float64).reshape((num, 1+dim+n_attr+n_marker))
+        p_lines = p_lines[num+1:]
+        sg_num, sg_marker = map(int, p_lines[0])
+        sg = np.array(p_lines[1:sg_num+1], dtype=np.float64).reshape((sg_num, 3+sg_marker)).astype(np.int32)
+        p_lines = p_lines[sg_num+1:]
+        h_num = int(p_lines[0][0]) if len(p_lines) > 0 else 0
+        hole = np.array(p_lines[1:h_num+1], dtype=np.float64).reshape((h_num, 1+dim))
+        return {"id": pt[:, 0].astype(np.int32), "xy": pt[:, 1:dim+1], "attr": pt[:, dim+1:dim+1+n_attr],
+                "marker": pt[:, -1].astype(np.int32) if n_marker > 0 else None,
+                "segment_id": sg[:, 0], "segment": sg[:, 1:3],
+                "segment_marker": sg[:, 3] if sg_marker > 0 else None, "hole": hole[:, 1:]}
+    else:
+        raise ValueError("No such type: " + str(kind))
 
 
 # A reader for Triangle's .edge, .ele, .node, .poly file
+# return the first four columns, i.e. id, x, y, marker for .node and .poly, id, start, end, marker for .edge,
+# id, node1, node2, node3 for .ele
 def readTriangle(file, kind):
-    een_set = ["edge", "ele", "node"]
-    p_set = ["poly"]
-    f = open(file)
-    f_lines = f.readlines()
-    if kind in een_set:
-        # total number of edge, elements or nodes
-        num = int(re.split(r"\s+", f_lines[0])[0])
-        f_slice = f_lines[1:num+1]
-        f_arr = np.array(list(map(space_split, f_slice)))
-        return f_arr[:, 0], f_arr[:, 1], f_arr[:, 2], f_arr[:, 3]
-    elif kind in p_set:
-        num = int(re.split(r"\s+", f_lines[1])[0])
-        f_slice = f_lines[2:num+2]
-        f_arr = np.array(list(map(space_split, f_slice)))
-        return f_arr[:, 0], f_arr[:, 1], f_arr[:, 2], f_arr[:, 3]
-    else:
+    if kind not in ["edge", "ele", "node", "poly"]:
         print("No such type")
+        return
+    t = loadTriangle(file, kind)
+    if kind == "ele":
+        return t["id"], t["ele"][:, 0], t["ele"][:, 1], t["ele"][:, 2]
+    elif kind == "edge":
+        marker = t["marker"] if t["marker"] is not None else np.zeros(len(t["id"]), dtype=np.int32)
+        return t["id"], t["edge"][:, 0], t["edge"][:, 1], marker
+    else:
+        marker = t["marker"] if t["marker"] is not None else np.zeros(len(t["id"]), dtype=np.int32)
+        return t["id"], t["xy"][:, 0], t["xy"][:, 1], marker
 
 
-def index_find_2d(value, array):
-    i1 = np.where(array[:,0]==value[0])
-    i2 = np.where(array[:,1]==value[1])
-    a = np.intersect1d(i1, i2)
-    if len(a) > 0:
-        return a[0]
-    else:
-        return -1
+def near_pairs(xy, tol):
+    # all pairs (i < j) of points within the distance tol by one STRtree query
+    geom = shapely.points(xy)
+    i, j = shapely.STRtree(geom).query(geom, predicate="dwithin", distance=tol)
+    keep = i < j
+    return i[keep], j[keep]
+
+
+def near_components(xy, tol):
+    '''
+    Label groups of points chained by distances within tol (single-linkage),
+    labels are merged along near pairs by hooking and pointer jumping
+    Returns (n,) array of the smallest point id in the group of every point
+    '''
+    i, j = near_pairs(xy, tol)
+    label = np.arange(len(xy))
+    while True:
+        hook = label.copy()
+        np.minimum.at(hook, label[i], label[j])
+        np.minimum.at(hook, label[j], label[i])
+        while True:
+            jump = hook[hook]
+            if np.array_equal(jump, hook):
+                break
+            hook = jump
+        if np.array_equal(hook, label):
+            return label
+        label = hook
+
+
+def vertex_index(pts, tol=0.0):
+    '''
+    Build the unique-vertex table and the point->vertex ids in one vectorized pass
+    Parameters
+    ----------
+    pts : (n, 2) array of point coordinates
+    tol : snapping tolerance, points within the distance tol of each other (directly or through a chain of
+          such points) are merged into the vertex with the smallest (x, y), 0 for merging identical coordinates only
+    Returns
+    -------
+    pt_set : (m, 2) array of unique vertices sorted by (x, y)
+    pt_inv : (n,) array of 0-based row ids of pts in pt_set
+    '''
+    pts = np.asarray(pts, dtype=float)
+    pt_set, pt_inv = np.unique(pts, axis=0, return_inverse=True)
+    pt_inv = pt_inv.reshape(-1)
+    if len(pt_set) < 2:
+        return pt_set, pt_inv
+    if tol > 0:
+        # unique vertices are sorted by (x, y), so the smallest id of a group is its smallest vertex
+        label = near_components(pt_set, tol)
+        root, group = np.unique(label, return_inverse=True)
+        print("The number of near-duplicate vertices merged is " + str(len(pt_set) - len(root)))
+        return pt_set[root], group.reshape(-1)[pt_inv]
+    # report distinct vertices which are closer than a tiny fraction of the extent, i.e. not exactly snapped
+    eps = 1e-9 * max(float(np.ptp(pt_set, axis=0).max()), 1.0)
+    near_num = len(np.unique(near_pairs(pt_set, eps)[1]))
+    if near_num > 0:
+        print("The number of near-duplicate vertices kept apart is " + str(near_num) + ", set tol to merge them")
+    return pt_set, pt_inv
+
+
+def segment_check(s_index, e_index):
+    '''
+    Report and drop degenerate segments (both ends on one vertex), report duplicate segments
+    '''
+    s_index = np.asarray(s_index)
+    e_index = np.asarray(e_index)
+    degenerate = s_index == e_index
+    if degenerate.any():
+        print("The number of degenerate segments removed is " + str(int(degenerate.sum())))
+        s_index = s_index[~degenerate]
+        e_index = e_index[~degenerate]
+    sg_key = np.sort(np.column_stack((s_index, e_index)), axis=1)
+    dup_num = len(sg_key) - len(np.unique(sg_key, axis=0))
+    if dup_num > 0:
+        print("The number of duplicate segments is " + str(dup_num))
+    return s_index, e_index
 
 
 def zid_1d(i, outer_set, inner_set):
@@ -68,52 +203,232 @@ def zid_2d(xy, outer_set):
         return 2
 
 
-def cad2poly(pt_addr, save_addr, bd_marker=1):
+def edge_cell_index(ele):
+    '''
+    Build the edge->cell adjacency index of a triangular mesh
+    Parameters
+    ----------
+    ele : (n, 3) array of node ids of cells, cell id = row id + 1
+    Returns
+    -------
+    a tuple of (key base, sorted edge keys, cell ids, 3rd node ids) for all edges of all cells
+    where the key of edge (n1, n2) is min(n1, n2) * base + max(n1, n2)
+    '''
+    ele = np.asarray(ele, dtype=np.int64)
+    base = int(ele.max()) + 1
+    # edges of one cell: (n1, n2) with 3rd node n3, (n2, n3) with n1, (n3, n1) with n2
+    e_s = ele.reshape(-1)
+    e_e = np.roll(ele, -1, axis=1).reshape(-1)
+    e_3rd = np.roll(ele, -2, axis=1).reshape(-1)
+    e_cell = np.repeat(np.arange(1, len(ele) + 1), 3)
+    e_key = np.minimum(e_s, e_e) * base + np.maximum(e_s, e_e)
+    # stable sorting keeps the cell with smaller id first for the shared edge
+    order = np.argsort(e_key, kind="stable")
+    return base, e_key[order], e_cell[order], e_3rd[order]
+
+
+def edge_cell_find(ec_index, en):
+    '''
+    Find the cells on both sides of edges in a single batched lookup
+    Parameters
+    ----------
+    ec_index : the index returned by edge_cell_index
+    en : (m, 2) array of node ids of edges
+    Returns
+    -------
+    (m, 5) array of [node1, node2, cell1, cell2, 3rd node of cell1]
+    where cell1 < cell2 and cell2 = 0 for the boundary edge
+    '''
+    base, e_key, e_cell, e_3rd = ec_index
+    en = np.asarray(en, dtype=np.int64).reshape((-1, 2))
+    q_key = np.minimum(en[:, 0], en[:, 1]) * base + np.maximum(en[:, 0], en[:, 1])
+    lo = np.searchsorted(e_key, q_key, side="left")
+    hi = np.searchsorted(e_key, q_key, side="right")
+    if np.any(hi == lo):
+        raise ValueError("Edge not found in elements: " + str(en[np.argmax(hi == lo)]))
+    cell_2 = np.where(hi - lo > 1, e_cell[np.minimum(lo + 1, len(e_cell) - 1)], 0)
+    return np.column_stack((en, e_cell[lo], cell_2, e_3rd[lo]))
+
+
+def face_rhr(ec, node_xy, boundary):
+    '''
+    Order faces by the Right Hand's Rule using the 3rd node of cell1
+    For the boundary face, node1 and node2 are swapped; for the middle face, cell1 and cell2 are swapped
+    Parameters
+    ----------
+    ec : (m, 5) array returned by edge_cell_find
+    node_xy : (n, 2) array of node coordinates, row id = node id - 1
+    boundary : whether faces are on the boundary
+    Returns
+    -------
+    (m, 4) array of [node1, node2, cell1, cell2] for .msh file
+    '''
+    xy_1 = node_xy[ec[:, 0] - 1]
+    xy_2 = node_xy[ec[:, 1] - 1]
+    c1_xy = node_xy[ec[:, 4] - 1]
+    # using cross product to verifying the RHR
+    d_1 = xy_2 - xy_1
+    d_2 = c1_xy - xy_1
+    z1_cross = (d_1[:, 0] * d_2[:, 1] - d_1[:, 1] * d_2[:, 0]).reshape((-1, 1))
+    ec_m = np.copy(ec[:, 0:4])
+    if boundary:
+        ec_m[:, 0:2] = np.where(z1_cross < 0, ec[:, 0:2], ec[:, 1::-1])
+    else:
+        ec_m[:, 2:4] = np.where(z1_cross < 0, ec[:, 2:4], ec[:, 3:1:-1])
+    return ec_m
+
+
+def planar_face(pt_set, s_index, e_index):
+    '''
+    Traverse the faces of the planar graph formed by segments
+    Half-edges are ordered by angle around each vertex, and the next half-edge of a face
+    is the one right after the twin half-edge in clockwise order around the end vertex
+    Parameters
+    ----------
+    pt_set : (n, 2) array of vertex coordinates, vertex id = row id + 1
+    s_index, e_index : 1-based vertex ids of segments
+    Returns
+    -------
+    h_face : (2m,) array of face ids of half-edges, where half-edge i and i + m are twins
+    h_next : (2m,) array of the next half-edge in the same face
+    h_s : (2m,) array of 0-based start vertex ids of half-edges
+    area : signed area of faces, positive for bounded faces (counter-clockwise)
+           and negative for the outer contour of each connected part of the graph
+    '''
+    pt_set = np.asarray(pt_set, dtype=float)
+    sg = np.sort(np.column_stack((s_index, e_index)).astype(np.int64) - 1, axis=1)
+    sg = np.unique(sg, axis=0)
+    m = len(sg)
+    h_s = np.concatenate([sg[:, 0], sg[:, 1]])
+    h_e = np.concatenate([sg[:, 1], sg[:, 0]])
+    h_twin = np.concatenate([np.arange(m, 2*m), np.arange(0, m)])
+    # sort half-edges by start vertex and then by angle in counter-clockwise order
+    d = pt_set[h_e] - pt_set[h_s]
+    order = np.lexsort((np.arctan2(d[:, 1], d[:, 0]), h_s))
+    rank = np.empty(2*m, dtype=np.int64)
+    rank[order] = np.arange(2*m)
+    v_first = np.searchsorted(h_s[order], np.arange(len(pt_set)))
+    v_deg = np.bincount(h_s, minlength=len(pt_set))
+    t_rank = rank[h_twin] - v_first[h_e]
+    h_next = order[v_first[h_e] + (t_rank - 1) % v_deg[h_e]]
+    # label the cycles of h_next by the smallest half-edge id using pointer jumping
+    label = np.arange(2*m)
+    jump = h_next.copy()
+    for _ in range(int(np.ceil(np.log2(max(2*m, 2)))) + 1):
+        label = np.minimum(label, label[jump])
+        jump = jump[jump]
+    _, h_face = np.unique(label, return_inverse=True)
+    h_face = h_face.reshape(-1)
+    # shoelace formula over half-edges of each face
+    cross = pt_set[h_s, 0] * pt_set[h_e, 1] - pt_set[h_e, 0] * pt_set[h_s, 1]
+    area = 0.5 * np.bincount(h_face, weights=cross)
+    return h_face, h_next, h_s, area
+
+
+def face_rings(h_face, h_next, h_s):
+    '''
+    Get 1-based vertex ids of all faces in traversal order at once, every face starts from its smallest half-edge
+    The position of every half-edge in its face is found by pointer jumping along the reversed h_next
+    Returns
+    -------
+    ring : 1-based vertex ids of faces, i.e. vertices of face i are ring[offset[i]:offset[i+1]]
+    offset : (n_face + 1,) array of offsets
+    '''
+    n = len(h_face)
+    h_prev = np.empty(n, dtype=np.int64)
+    h_prev[h_next] = np.arange(n)
+    first = np.full(h_face.max() + 1 if n > 0 else 0, n, dtype=np.int64)
+    np.minimum.at(first, h_face, np.arange(n))
+    # the first half-edge of a face is its own predecessor, so pos counts the steps from it
+    start = first[h_face] == np.arange(n)
+    h_prev[start] = np.flatnonzero(start)
+    pos = (~start).astype(np.int64)
+    for _ in range(int(np.ceil(np.log2(max(n, 2)))) + 1):
+        pos = pos + pos[h_prev]
+        h_prev = h_prev[h_prev]
+    order = np.lexsort((pos, h_face))
+    offset = np.concatenate([[0], np.cumsum(np.bincount(h_face, minlength=len(first)))])
+    return h_s[order] + 1, offset
+
+
+def boundary_hole(pt_set, s_index, e_index):
+    '''
+    Classify the faces of segments into the outer boundary and holes by signed area
+    The outer boundary is the outer contour with the largest area, the fluid region is
+    the largest bounded face next to it, and all other bounded faces are holes
+    Returns
+    -------
+    outer : 1-based vertex ids of the outer boundary
+    holes : list of 1-based vertex ids of holes
+    '''
+    h_face, h_next, h_s, area = planar_face(pt_set, s_index, e_index)
+    m = len(h_face) // 2
+    h_twin = np.concatenate([np.arange(m, 2*m), np.arange(0, m)])
+    outer_id = np.argmin(area)
+    # bounded faces which share edges with the outer boundary
+    adj_id = np.unique(h_face[h_twin[h_face == outer_id]])
+    adj_id = adj_id[area[adj_id] > 0]
+    if len(adj_id) == 0:
+        raise ValueError("The outer boundary is not closed, i.e. no bounded face is next to the outer contour")
+    fluid_id = adj_id[np.argmax(area[adj_id])]
+    hole_id = np.where(area > 0)[0]
+    hole_id = hole_id[hole_id != fluid_id]
+    ring, offset = face_rings(h_face, h_next, h_s)
+    outer = ring[offset[outer_id]:offset[outer_id+1]].tolist()
+    holes = [ring[offset[i]:offset[i+1]].tolist() for i in hole_id]
+    return outer, holes
+
+
+def hole_seed(pt_set, holes):
+    '''
+    Get a deterministic inner point for every hole in one batched pass
+    The point is given by GEOS's PointOnSurface (i.e. representative_point),
+    which takes bounded time even for thin or concave holes
+    Parameters
+    ----------
+    pt_set : (n, 2) array of vertex coordinates, vertex id = row id + 1
+    holes : list of 1-based vertex ids of holes
+    Returns
+    -------
+    (h, 2) array of inner points of holes
+    '''
+    if len(holes) == 0:
+        return np.empty((0, 2))
+    # close every ring and build all polygons from a flat coordinate array
+    ring = [np.append(p, p[0]) for p in holes]
+    ring_id = np.repeat(np.arange(len(ring)), [len(r) for r in ring])
+    ring_xy = pt_set[np.concatenate(ring) - 1]
+    polygon = shapely.polygons(shapely.linearrings(ring_xy, indices=ring_id))
+    return shapely.get_coordinates(shapely.point_on_surface(polygon))
+
+
+def cad2poly(pt_addr, save_addr, bd_marker=1, tol=0.0):
     '''
     Parameters
     ----------
     pt_addr : the address of point information .csv file
     save : the address to save Triangle's .poly file
     bd_marker: the total number of boundary markers
+    tol: distance within which near-duplicate vertices are merged (0 for exact matching only)
     '''
     pt_df = pd.read_csv(pt_addr)
-    # count the number of segements
-    sg_num = len(pt_df["端点 X"])
     # count the number of vertices
-    end_pt = np.array(list(zip(pt_df["端点 X"], pt_df["端点 Y"])))
-    start_pt = np.array(list(zip(pt_df["起点 X"], pt_df["起点 Y"])))
-    pt_set = np.unique(np.concatenate([end_pt, start_pt]), axis=0)
-    pt_num = len(pt_set)
+    end_pt = np.column_stack((pt_df["端点 X"].to_numpy(dtype=float), pt_df["端点 Y"].to_numpy(dtype=float)))
+    start_pt = np.column_stack((pt_df["起点 X"].to_numpy(dtype=float), pt_df["起点 Y"].to_numpy(dtype=float)))
     # divide the mesh region into different zones which are marked separately
     # [1] construct a graph of the mesh region by specifying edge-point relationship
-    s_list = []
-    e_list = []
-    for i in range(1, sg_num + 1):
-        pt_sx = pt_df["端点 X"].iloc[i - 1]
-        pt_sy = pt_df["端点 Y"].iloc[i - 1]
-        pt_ex = pt_df["起点 X"].iloc[i - 1]
-        pt_ey = pt_df["起点 Y"].iloc[i - 1]
-        s_index = index_find_2d(value=[pt_sx, pt_sy], array=pt_set) + 1
-        e_index = index_find_2d(value=[pt_ex, pt_ey], array=pt_set) + 1
-        if s_index == 0:
-            print("Start point not found")
-            continue
-        elif e_index == 0:
-            print("End point not found")
-            continue
-        else:
-            s_list.append(s_index)
-            e_list.append(e_index)
+    # all endpoints are indexed at once, ids of .poly file begin from 1
+    pt_set, pt_inv = vertex_index(np.concatenate([end_pt, start_pt]), tol=tol)
+    pt_num = len(pt_set)
+    s_index, e_index = pt_inv.reshape((2, -1)) + 1
+    s_list, e_list = segment_check(s_index, e_index)
+    sg_num = len(s_list)
     edge_list = list(zip(s_list, e_list))
-    # [2] use the package network to find cycle basis in the undirected graph
+    # [2] traverse faces of the planar graph and classify them by signed area
     # which gives nodes' index of outer edges and inner edges
-    poly_G = nx.Graph(edge_list)
-    poly_set = nx.cycle_basis(poly_G)
-    # get the outer boundary by assuming it has the most nodes
-    obd_index = np.argmax(list(map(len, poly_set)))
-    outer_node = set(poly_set[obd_index])
-    poly_set.pop(obd_index)  # inner boundary
-    inner_node = set(sum(poly_set, []))
+    outer_poly, poly_set = boundary_hole(pt_set, s_list, e_list)
+    outer_node = set(outer_poly)
+    inner_node = set(i for p in poly_set for i in p)
     # [3] determine the zone id of nodes
     # outer node:1, inner node:2, mid_fluid:0 (default by Triangle)
     node_zid = [zid_1d(i, outer_set=outer_node, inner_set=inner_node) for i in list(range(1, pt_num+1))]
@@ -121,7 +436,7 @@ def cad2poly(pt_addr, save_addr, bd_marker=1):
     sg_zid = [zid_2d(edge_list[i], outer_set=outer_node) for i in list(range(0, sg_num))]
     # Writing .poly file
     # create the output file
-    poly_file = open(save_addr, mode="a")
+    poly_file = open(save_addr, mode="w")
     # write summary for vertices
     poly_file.write("# Part of vertices\n")
     poly_file.write(str(pt_num)+" 2 0 "+str(bd_marker)+"\n")
@@ -141,30 +456,257 @@ def cad2poly(pt_addr, save_addr, bd_marker=1):
     poly_file.write(str(hole_num)+"\n")
     print("The number of holes is " + str(hole_num))
     # write hole i with an inner point for the polygon
-    h_count = 1
-    for p in poly_set:
-        p_i = [pt_set[i-1] for i in p]
-        polygon_i = Polygon(p_i)
-        while True:
-            test_sample = random.sample(p_i,3)
-            test_centroid = np.average(test_sample, axis=0)
-            if polygon_i.contains(Point(test_centroid)):
-                poly_file.write(str(h_count)+" "+" ".join(map(str, test_centroid))+"\n")
-                break
-        h_count += 1
+    h_seed = hole_seed(pt_set, poly_set)
+    for i in range(1, hole_num+1):
+        poly_file.write(str(i)+" "+" ".join(map(str, h_seed[i-1]))+"\n")
+    poly_file.close()
+
+
+def msh_block(msh_file, fmt, arr, chunk=100000):
+    '''
+    Write a 2D array into an opened .msh file as bulk formatted text blocks
+    Parameters
+    ----------
+    msh_file : the .msh file opened in binary mode
+    fmt : format of one row, e.g. "%r %r\n" for nodes, "%x %x %x %x\n" for faces
+    arr : the array to be written
+    chunk : the number of rows formatted at once
+    '''
+    arr = np.asarray(arr)
+    for i in range(0, len(arr), chunk):
+        arr_i = arr[i:i+chunk]
+        msh_file.write(((fmt * len(arr_i)) % tuple(arr_i.ravel().tolist())).encode())
+
+
+def msh_binary(binary):
+    '''
+    Check the binary option of .msh output and return the precision of real numbers
+    Returns None for ASCII, "single" or "double" for binary sections
+    '''
+    if binary is False or binary is None:
+        return None
+    if binary is True or binary == "double":
+        return "double"
+    if binary == "single":
+        return "single"
+    raise ValueError("binary should be False, True, \"single\" or \"double\", not " + repr(binary))
+
+
+def msh_section(msh_file, sid, header, arr, fmt, binary=False):
+    '''
+    Write one zone section of .msh file
+    Parameters
+    ----------
+    msh_file : the .msh file opened in binary mode
+    sid : ASCII section id, i.e. 10 for nodes, 13 for faces, 12 for cells
+    header : the header of the section, e.g. "1 1 a 1 2"
+    arr : the array of the section body
+    fmt : format of one row for ASCII section
+    binary : False for ASCII, True or "double" for double precision binary (section id 30xx),
+             "single" for single precision binary (section id 20xx), see msh_binary
+    '''
+    precision = msh_binary(binary)
+    if precision is not None:
+        sid = (3000 if precision == "double" else 2000) + sid
+        msh_file.write(("(" + str(sid) + " (" + header + ")(").encode())
+        # integers are written as 32-bit and real numbers as 32/64-bit in little endian
+        if np.issubdtype(np.asarray(arr).dtype, np.floating):
+            msh_file.write(np.ascontiguousarray(arr, dtype="<f8" if precision == "double" else "<f4").tobytes())
+        else:
+            msh_file.write(np.ascontiguousarray(arr, dtype="<i4").tobytes())
+        msh_file.write((")\nEnd of Binary Section " + str(sid) + ")\n").encode())
+    else:
+        msh_file.write(("(" + str(sid) + " (" + header + ")(\n").encode())
+        msh_block(msh_file, fmt, arr)
+        msh_file.write("))\n".encode())
+
+
+def graph_csr(n, a, b):
+    # CSR adjacency of an undirected graph of n vertices (0-based) with edges (a, b), returns (ptr, nbr)
+    a, b = np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64)
+    keep = a != b
+    src = np.concatenate([a[keep], b[keep]])
+    dst = np.concatenate([b[keep], a[keep]])
+    order = np.lexsort((dst, src))
+    src, dst = src[order], dst[order]
+    # duplicate edges (e.g. the edge of two triangles) are kept only once
+    first = np.ones(len(src), dtype=bool)
+    first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    ptr = np.concatenate([[0], np.cumsum(np.bincount(src[first], minlength=n))])
+    return ptr, dst[first]
+
+
+def bfs_levels(ptr, nbr, start, seen):
+    '''
+    Cuthill-McKee breadth first search from start, one level of vertices at a time
+    unvisited neighbours are numbered in the order of their first visited neighbour, then by degree
+    seen is updated in place, returns the list of levels (arrays of vertices in Cuthill-McKee order)
+    '''
+    deg = np.diff(ptr)
+    seen[start] = True
+    front = np.array([start], dtype=np.int64)
+    levels = []
+    while len(front) > 0:
+        levels.append(front)
+        cnt = deg[front]
+        idx = np.arange(cnt.sum()) - np.repeat(np.cumsum(cnt) - cnt - ptr[front], cnt)
+        nb = nbr[idx]
+        parent = np.repeat(np.arange(len(front)), cnt)
+        keep = ~seen[nb]
+        nb, parent = nb[keep], parent[keep]
+        nb = nb[np.lexsort((nb, deg[nb], parent))]
+        _, first = np.unique(nb, return_index=True)
+        front = nb[np.sort(first)]
+        seen[front] = True
+    return levels
+
+
+def rcm_order(n, a, b):
+    '''
+    Reverse Cuthill-McKee ordering of a graph of n vertices (0-based) with edges (a, b)
+    every connected component starts from a pseudo-peripheral vertex (George-Liu)
+    Returns order, i.e. order[new] = old
+    '''
+    ptr, nbr = graph_csr(n, a, b)
+    deg = np.diff(ptr)
+    seen = np.zeros(n, dtype=bool)
+    order = []
+    while not seen.all():
+        rest = np.flatnonzero(~seen)
+        start = rest[np.argmin(deg[rest])]
+        # the vertex of the smallest degree in the last level is taken as the new start
+        for _ in range(2):
+            last = bfs_levels(ptr, nbr, start, seen.copy())[-1]
+            start = last[np.argmin(deg[last])]
+        order += bfs_levels(ptr, nbr, start, seen)
+    return np.concatenate(order)[::-1]
+
+
+def curve_key(xy, kind="hilbert", bits=16):
+    '''
+    Index of points on the Hilbert or Morton (Z-order) curve over the bounding box of xy
+    '''
+    xy = np.asarray(xy, dtype=float)
+    lo = xy.min(axis=0)
+    span = np.maximum(xy.max(axis=0) - lo, 1e-300)
+    n = 1 << bits
+    q = np.minimum(((xy - lo) / span * n).astype(np.int64), n - 1)
+    x, y = q[:, 0], q[:, 1]
+    d = np.zeros(len(xy), dtype=np.int64)
+    if kind == "morton":
+        for k in range(bits):
+            d |= ((x >> k) & 1) << (2 * k) | ((y >> k) & 1) << (2 * k + 1)
+        return d
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant so that the curve inside it starts and ends properly
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s >>= 1
+    return d
+
+
+def bandwidth(a, b):
+    # the bandwidth (max id difference of connected vertices) and the mean id difference of edges (a, b)
+    diff = np.abs(np.asarray(a, dtype=np.int64) - np.asarray(b, dtype=np.int64))
+    return (int(diff.max()), float(diff.mean())) if len(diff) > 0 else (0, 0.0)
+
+
+def ele_edges(ele):
+    # all node pairs (edges) of triangular cells, edges shared by two cells are repeated
+    ele = np.asarray(ele, dtype=np.int64)
+    return ele.reshape(-1), np.roll(ele, -1, axis=1).reshape(-1)
+
+
+def cell_pairs(ele):
+    # pairs of cell ids (1-based) sharing an edge, from the edge->cell index
+    _, e_key, e_cell, _ = edge_cell_index(ele)
+    same = e_key[1:] == e_key[:-1]
+    return e_cell[:-1][same], e_cell[1:][same]
+
+
+def renumber_order(kind, n, a, b, xy):
+    # order[new] = old of n vertices (0-based) with edges (a, b) and coordinates xy
+    if kind == "rcm":
+        return rcm_order(n, a, b)
+    if kind in ["hilbert", "morton"]:
+        return np.argsort(curve_key(xy, kind), kind="stable")
+    raise ValueError("Unknown renumbering " + str(kind) + ", use rcm, hilbert or morton")
+
+
+def write_msh(save_addr, node_zone, face_zone, cell_num, binary=False):
+    '''
+    Write a 2D triangular mesh into Fluent's .msh file
+    Parameters
+    ----------
+    save_addr : the address to save .msh file
+    node_zone : list of (zone id, (n, 2) array of node coordinates) ordered by node id
+    face_zone : list of (zone id, bc type, (m, 4) array of [node1, node2, cell1, cell2], zone name)
+                ordered by face id, zone name is None for zones without a (45 ...) section
+    cell_num : the number of triangular cells
+    binary : False for ASCII, True or "double" for double precision binary sections (section id 3010/3013/3012),
+             "single" for single precision binary sections (section id 2010/2013/2012), which rounds
+             projected coordinates (e.g. northings of 3.5e6 m to 0.25 m)
+    '''
+    # check the option before the file is created
+    precision = msh_binary(binary)
+    msh_file = open(save_addr, mode="wb")
+    # Dimension
+    msh_file.write("(2 2)\n".encode())
+    # [1] Node summary
+    l_node = sum(len(xy) for (_, xy) in node_zone)
+    msh_file.write(("(10 (0 1 " + format(l_node, "x") + " 0))\n").encode())
+    first = 1
+    for (zid, xy) in node_zone:
+        last = first + len(xy) - 1
+        header = " ".join([str(zid), format(first, "x"), format(last, "x"), "1 2"])
+        msh_section(msh_file, 10, header, np.asarray(xy, dtype=float), "%r %r\n", binary=binary)
+        first = last + 1
+    # [2] Face/Edge summary
+    l_face = sum(len(ec) for (_, _, ec, _) in face_zone)
+    msh_file.write(("(13 (0 1 " + format(l_face, "x") + " 0))\n").encode())
+    first = 1
+    for (zid, bc_type, ec, _) in face_zone:
+        last = first + len(ec) - 1
+        header = " ".join([str(zid), format(first, "x"), format(last, "x"), str(bc_type), "2"])
+        msh_section(msh_file, 13, header, np.asarray(ec, dtype=np.int64), "%x %x %x %x\n", binary=binary)
+        first = last + 1
+    # [3] Cell summary
+    msh_file.write(("(12 (0 1 " + format(cell_num, "x") + " 0))\n").encode())
+    # For 2D cell, 1 - tri, 2 - quad
+    header = "3 1 " + format(cell_num, "x") + " 1 0"
+    if precision is not None:
+        msh_section(msh_file, 12, header, np.ones(cell_num, dtype=np.int64), None, binary=binary)
+    else:
+        msh_file.write(("(12 (" + header + ")(\n").encode())
+        msh_file.write(("1 " * cell_num + "\n))\n").encode())
+    # [4] Zone summary
+    bc_name = {2: "interior", 3: "wall"}
+    for (zid, bc_type, _, name) in face_zone:
+        if name is not None:
+            msh_file.write(("(45 (" + str(zid) + " " + bc_name[bc_type] + " " + name + ")())\n").encode())
+    msh_file.close()
 
 
-def poly2msh(node_addr, edge_addr, ele_addr, save_addr):
+def poly2msh(node_addr, edge_addr, ele_addr, save_addr, binary=False, renumber=None, perm_addr=None):
     # The format of .msh can be referred to
     # http://oss.jishulink.com/upload/201609/1473134488450_msh%20file%20format.pdf
+    # binary: False for ASCII .msh file, True/"double" or "single" for binary zone sections (see write_msh)
+    # renumber: None to keep Triangle's order, "rcm" (Reverse Cuthill-McKee), "hilbert" or "morton" (space-filling
+    # curve) to renumber nodes (within their zones) and cells for locality, faces are then ordered by their cells
+    # perm_addr: the .npz file of the permutation (default save_addr with _perm.npz), i.e. cell[i] is the row
+    # in .ele file (0-based) of .msh cell i + 1 (OpenFOAM cell i), node[i] is the Triangle id of .msh node i + 1
     node_id, node_x, node_y, node_marker = readTriangle(file=node_addr, kind="node")
-    node_df = pd.DataFrame({"Id": node_id.astype(int), "X":node_x.astype(float),
-                            "Y":node_y.astype(float), "Node_marker": node_marker.astype(int)})
+    node_df = pd.DataFrame({"Id": node_id, "X": node_x, "Y": node_y, "Node_marker": node_marker})
     edge_id, edge_s, edge_e, edge_marker = readTriangle(file=edge_addr, kind="edge")
-    edge_df = pd.DataFrame({"Id": edge_id.astype(int), "Start": edge_s.astype(int),
-                            "End": edge_e.astype(int), "Edge_marker": edge_marker.astype(int)})
+    edge_df = pd.DataFrame({"Id": edge_id, "Start": edge_s, "End": edge_e, "Edge_marker": edge_marker})
     _, ele_n1, ele_n2, ele_n3 = readTriangle(file=ele_addr, kind="ele")
-    ele_df = pd.DataFrame({"Node1": ele_n1.astype(int), "Node2": ele_n2.astype(int), "Node3": ele_n3.astype(int)})
+    ele_df = pd.DataFrame({"Node1": ele_n1, "Node2": ele_n2, "Node3": ele_n3})
     # for .msh file, outer zone:1, inner zone:2, mid zone:3 (same as Triangle's, 0 for summary)
     node_mid = node_df[node_df["Node_marker"] == 0]
     node_outer = node_df[node_df["Node_marker"] == 1]
@@ -172,167 +714,74 @@ def poly2msh(node_addr, edge_addr, ele_addr, save_addr):
     edge_mid = edge_df[edge_df["Edge_marker"] == 0]
     edge_outer = edge_df[edge_df["Edge_marker"] == 1]
     edge_inner = edge_df[edge_df["Edge_marker"] == 2]
-    le_mid = len(edge_mid)
-    le_outer = len(edge_outer)
-    le_inner = len(edge_inner)
     # However, .msh uses first_id~last_id for one zone.
     # So we need to rearrange ids of Node, Edge, Ele
-    # a dictionary of nodes where (key, value) = (old_id, new_id)
+    # a map of nodes where node_map[old_id] = new_id
     l_mid = len(node_mid)
     l_outer = len(node_outer)
     l_inner = len(node_inner)
-    outer_node_dict = {o: n for (o, n) in zip(node_outer["Id"], range(1, l_outer+1))}
-    inner_node_dict = {o: n for (o, n) in zip(node_inner["Id"], range(l_outer+1, l_outer+l_inner + 1))}
-    mid_node_dict = {o: n for (o, n) in zip(node_mid["Id"], range(l_outer+l_inner+1, l_outer+l_inner+l_mid+1))}
-    node_dict = {**outer_node_dict, **inner_node_dict, **mid_node_dict}
-    # reverse dict for the above dict
-    outer_node_r = {n: o for (o, n) in zip(node_outer["Id"], range(1, l_outer + 1))}
-    inner_node_r = {n: o for (o, n) in zip(node_inner["Id"], range(l_outer + 1, l_outer + l_inner+1))}
-    mid_node_r = {n: o for (o, n) in zip(node_mid["Id"], range(l_outer+l_inner+1, l_outer+l_inner+l_mid+1))}
-    node_r = {**outer_node_r, **inner_node_r, **mid_node_r}
+    node_old = np.concatenate([node_outer["Id"], node_inner["Id"], node_mid["Id"]])
+    node_map = np.zeros(node_df["Id"].max() + 1, dtype=np.int64)
+    node_map[node_old] = np.arange(1, l_outer + l_inner + l_mid + 1)
+    # coordinates of nodes ordered by new id, row id = new id - 1
+    node_xy = node_df.set_index("Id").loc[node_old, ["X", "Y"]].to_numpy()
     # change the node index in the element_dataframe and edge_dataframe into new one
-    f_on = np.vectorize(lambda x: node_dict[x])
-    ele_df_new = f_on(ele_df)
-    # a dictionary where (key, value) = (edge_id, [node1_new_id, node2_new_id])
-    outer_en = np.array([[node_dict[n1_id], node_dict[n2_id]] for (n1_id, n2_id)
-                         in zip(edge_outer["Start"], edge_outer["End"])])
-    inner_en = np.array([[node_dict[n1_id], node_dict[n2_id]] for (n1_id, n2_id)
-                         in zip(edge_inner["Start"], edge_inner["End"])])
-    mid_en = np.array([[node_dict[n1_id], node_dict[n2_id]] for (n1_id, n2_id)
-                       in zip(edge_mid["Start"], edge_mid["End"])])
-
-    # find the cell index which the edge belongs to
-    def edge_cell_bd(node_list):
-        nonlocal ele_df_new
-        edge_n1 = node_list[0]
-        edge_n2 = node_list[1]
-        edge_nset = {edge_n1, edge_n2}
-        f_neighbor = np.vectorize(lambda x, y, z: edge_nset.issubset({x, y, z}))
-        neighbor_test = f_neighbor(ele_df_new[:, 0], ele_df_new[:, 1], ele_df_new[:, 2])
-        # cell index begins from 1, index = row id + 1
-        cell_df_row = np.where(neighbor_test)[0]+1
-        # transform the id of the row where the 3rd node is located at into the 3rd node id
-        cell_3rdnode = set(ele_df_new[cell_df_row[0] - 1]) - edge_nset
-        # boundary edge has only one cell
-        return np.array([*node_list, *cell_df_row, 0, *cell_3rdnode])
-
-    def edge_cell_mid(node_list):
-        nonlocal ele_df_new
-        edge_n1 = node_list[0]
-        edge_n2 = node_list[1]
-        edge_nset = {edge_n1, edge_n2}
-        f_neighbor = np.vectorize(lambda x, y, z: edge_nset.issubset({x, y, z}))
-        neighbor_test = f_neighbor(ele_df_new[:, 0], ele_df_new[:, 1], ele_df_new[:, 2])
-        cell_df_row = np.where(neighbor_test)[0]+1
-        cell_3rdnode = set(ele_df_new[cell_df_row[0]-1]) - edge_nset
-        return np.array([*node_list, *cell_df_row, *cell_3rdnode])
-
-    # When the vectorized function returns ndarray, we should specify a signature
-    outer_ec = np.array([edge_cell_bd(x) for x in outer_en])
-    inner_ec = np.array([edge_cell_bd(x) for x in inner_en])
-    mid_ec = np.array([edge_cell_mid(x) for x in mid_en])
+    ele_df_new = node_map[ele_df.to_numpy()]
+    if renumber is not None:
+        l_node = len(node_old)
+        n_a, n_b = ele_edges(ele_df_new)
+        n_before = bandwidth(n_a, n_b)
+        c_a, c_b = cell_pairs(ele_df_new)
+        c_before = bandwidth(c_a, c_b)
+        # nodes are renumbered within zones, so every zone keeps a contiguous id range
+        rank = np.empty(l_node, dtype=np.int64)
+        rank[renumber_order(renumber, l_node, n_a - 1, n_b - 1, node_xy)] = np.arange(l_node)
+        order = np.lexsort((rank, np.repeat([1, 2, 3], [l_outer, l_inner, l_mid])))
+        remap = np.empty(l_node, dtype=np.int64)
+        remap[order] = np.arange(1, l_node + 1)
+        node_map[node_old] = remap
+        node_old = node_old[order]
+        node_xy = node_xy[order]
+        ele_df_new = remap[ele_df_new - 1]
+        # cells are in one zone, renumbered by their adjacency or centroids
+        c_xy = node_xy[ele_df_new - 1].mean(axis=1)
+        cell_order = renumber_order(renumber, len(ele_df_new), c_a - 1, c_b - 1, c_xy)
+        ele_df_new = ele_df_new[cell_order]
+        n_after = bandwidth(*ele_edges(ele_df_new))
+        c_after = bandwidth(*cell_pairs(ele_df_new))
+        print("Node bandwidth (max, mean) " + str(n_before) + " -> " + str(n_after))
+        print("Cell bandwidth (max, mean) " + str(c_before) + " -> " + str(c_after))
+        perm_addr = perm_addr or os.path.splitext(save_addr)[0] + "_perm.npz"
+        np.savez(perm_addr, cell=cell_order, node=node_old)
+    # [node1_new_id, node2_new_id] of each edge
+    outer_en = node_map[edge_outer[["Start", "End"]].to_numpy()]
+    inner_en = node_map[edge_inner[["Start", "End"]].to_numpy()]
+    mid_en = node_map[edge_mid[["Start", "End"]].to_numpy()]
 
-    # for the boundary edge, the order of node index should be adjusted by the Right Hand's Rule
-    # transform into the original ID, row id = "ID" - 1
-    xy_1 = np.array([[node_df["X"].iloc[node_r[id_1] - 1], node_df["Y"].iloc[node_r[id_1] - 1]] for id_1 in outer_ec[:, 0]])
-    xy_2 = np.array([[node_df["X"].iloc[node_r[id_2] - 1], node_df["Y"].iloc[node_r[id_2] - 1]] for id_2 in outer_ec[:, 1]])
-    c_1 = [node_r[c_n1] for c_n1 in outer_ec[:, 4]]
-    c1_xy = np.array([[node_df["X"].iloc[c - 1], node_df["Y"].iloc[c - 1]] for c in c_1])
-    # using cross product to verifying the RHR
-    z1_cross = np.cross(xy_2 - xy_1, c1_xy - xy_1)
-    z1_cross = z1_cross.reshape((len(z1_cross), 1))
-    z1_cross = np.concatenate((z1_cross, z1_cross), axis=1)
-    # create a candidate
-    outer_temp = np.copy(outer_ec[:, 0:4])
-    outer_temp.T[[0, 1]] = outer_temp.T[[1, 0]]
-    outer_ec_m = np.where(z1_cross < 0, outer_ec[:, 0:2], outer_temp[:, 0:2])
-    outer_ec_m = np.concatenate((outer_ec_m, outer_ec[:, 2:4]), axis=1)
-    del outer_temp
-
-    xy_1 = np.array([[node_df["X"].iloc[node_r[id_1] - 1], node_df["Y"].iloc[node_r[id_1] - 1]] for id_1 in inner_ec[:, 0]])
-    xy_2 = np.array([[node_df["X"].iloc[node_r[id_2] - 1], node_df["Y"].iloc[node_r[id_2] - 1]] for id_2 in inner_ec[:, 1]])
-    c_1 = [node_r[c_n1] for c_n1 in inner_ec[:, 4]]
-    c1_xy = np.array([[node_df["X"].iloc[c - 1], node_df["Y"].iloc[c - 1]] for c in c_1])
-    z1_cross = np.cross(xy_2 - xy_1, c1_xy - xy_1)
-    z1_cross = z1_cross.reshape((len(z1_cross), 1))
-    z1_cross = np.concatenate((z1_cross, z1_cross), axis=1)
-    inner_temp = np.copy(inner_ec[:, 0:4])
-    inner_temp.T[[0, 1]] = inner_temp.T[[1, 0]]
-    inner_ec_m = np.where(z1_cross < 0, inner_ec[:, 0:2], inner_temp[:, 0:2])
-    inner_ec_m = np.concatenate((inner_ec_m, inner_ec[:, 2:4]), axis=1)
-    del inner_temp
+    # find the cells which the edges belong to by the prebuilt edge->cell index
+    # [node1, node2, cell1, cell2, 3rd node of cell1] where cell2 = 0 for the boundary edge
+    ec_index = edge_cell_index(ele_df_new)
+    outer_ec = edge_cell_find(ec_index, outer_en)
+    inner_ec = edge_cell_find(ec_index, inner_en)
+    mid_ec = edge_cell_find(ec_index, mid_en)
+    if renumber is not None:
+        # faces of a zone are ordered by their cells
+        outer_ec, inner_ec, mid_ec = [ec[np.lexsort((ec[:, 3], ec[:, 2]))] for ec in [outer_ec, inner_ec, mid_ec]]
 
+    # for the boundary edge, the order of node index should be adjusted by the Right Hand's Rule
+    outer_ec_m = face_rhr(outer_ec, node_xy, boundary=True)
+    inner_ec_m = face_rhr(inner_ec, node_xy, boundary=True)
     # for the middle edge, the order of cell index should be adjusted by the Right Hand's Rule
-    xy_1 = np.array([[node_df["X"].iloc[node_r[id_1] - 1], node_df["Y"].iloc[node_r[id_1] - 1]] for id_1 in mid_ec[:, 0]])
-    xy_2 = np.array([[node_df["X"].iloc[node_r[id_2] - 1], node_df["Y"].iloc[node_r[id_2] - 1]] for id_2 in mid_ec[:, 1]])
-    c_1 = [node_r[c_n1] for c_n1 in mid_ec[:, 4]]
-    c1_xy = np.array([[node_df["X"].iloc[c - 1], node_df["Y"].iloc[c - 1]] for c in c_1])
-    z1_cross = np.cross(xy_2 - xy_1, c1_xy - xy_1)
-    z1_cross = z1_cross.reshape((len(z1_cross), 1))
-    z1_cross = np.concatenate((z1_cross, z1_cross), axis=1)
-    mid_temp = np.copy(mid_ec[:, 0:4])
-    mid_temp.T[[2, 3]] = mid_temp.T[[3, 2]]
-    mid_ec_m = np.where(z1_cross < 0, mid_ec[:, 2:4], mid_temp[:, 2:4])
-    mid_ec_m = np.concatenate((mid_ec[:, 0:2], mid_ec_m), axis=1)
+    mid_ec_m = face_rhr(mid_ec, node_xy, boundary=False)
 
     # create .msh file
-    msh_file = open(save_addr, mode="a")
-    # Dimension
-    msh_file.write("(2 2)\n")
-    # [1] Node summary
-    msh_file.write("(10 (0 1 "+format(l_outer+l_inner+l_mid,"x")+" 0))\n")
-    # nodes on outer boundary
-    msh_file.write("(10 (1 1 "+format(l_outer,"x")+" 1 2)(\n")
-    node_outer = node_outer.drop(columns=["Node_marker", "Id"])
-    for i in range(0, l_outer):
-        msh_file.write(" ".join(map(str, node_outer.iloc[i]))+"\n")
-    msh_file.write("))\n")
-    # nodes on inner boundary
-    msh_file.write("(10 (2 "+format(l_outer+1, "x")+" "+format(l_outer+l_inner, "x")+" 1 2)(\n")
-    node_inner = node_inner.drop(columns=["Node_marker", "Id"])
-    for i in range(0, l_inner):
-        msh_file.write(" ".join(map(str, node_inner.iloc[i]))+"\n")
-    msh_file.write("))\n")
-    # nodes in the middle
-    msh_file.write("(10 (3 "+format(l_outer+l_inner+1, "x")+" "+format(l_outer+l_inner+l_mid, "x") + " 1 2)(\n")
-    node_mid = node_mid.drop(columns=["Node_marker", "Id"])
-    for i in range(0, l_mid):
-        msh_file.write(" ".join(map(str, node_mid.iloc[i]))+"\n")
-    msh_file.write("))\n")
-    # [2] Face/Edge summary
-    msh_file.write("(13 (0 1 "+format(le_outer+le_inner+le_mid, "x")+" 0))\n")
-    # edges on outer boundary
-    # for wall condition, type = 3
-    msh_file.write("(13 (1 1 "+format(le_outer, "x")+" 3 2)(\n")
-    for i in range(0, le_outer):
-        msh_file.write(" ".join(map(lambda j: format(j, "x"), outer_ec_m[i]))+"\n")
-    msh_file.write("))\n")
-    # edges on inner boundary
-    msh_file.write("(13 (2 "+format(le_outer+1, "x")+" "+format(le_outer+le_inner, "x")+" 3 2)(\n")
-    for i in range(0, le_inner):
-        msh_file.write(" ".join(map(lambda j: format(j, "x"), inner_ec_m[i]))+"\n")
-    msh_file.write("))\n")
-    # edges in the middle
-    msh_file.write("(13 (3 "+format(le_outer+le_inner+1, "x")+" "+format(le_outer+le_inner+le_mid, "x")+" 2 2)(\n")
-    for i in range(0, le_mid):
-        msh_file.write(" ".join(map(lambda j: format(j, "x"), mid_ec_m[i]))+"\n")
-    msh_file.write("))\n")
-    # [3] Cell summary
-    l_cell = len(ele_df_new)
-    msh_file.write("(12 (0 1 " + format(l_cell, "x") + " 0))\n")
-    msh_file.write("(12 (3 1 " + format(l_cell, "x") + " 1 0)(\n")
-    # For 2D cell, 1 - tri, 2 - quad
-    for i in range(0, l_cell):
-        msh_file.write("1 ")
-    msh_file.write("\n))\n")
-    # [4] Zone summary
-    # outer zone
-    msh_file.write("(45 (1 wall outer_boundary)())\n")
-    # inner zone
-    msh_file.write("(45 (2 wall inner_boundary)())\n")
-    # mid zone
-    # msh_file.write("(45 (3 fluid mid_region)())")
- 
+    # for .msh file, outer zone:1, inner zone:2, mid zone:3
+    # for wall condition, type = 3, for interior, type = 2
+    node_zone = [(1, node_xy[:l_outer]), (2, node_xy[l_outer:l_outer+l_inner]), (3, node_xy[l_outer+l_inner:])]
+    face_zone = [(1, 3, outer_ec_m, "outer_boundary"), (2, 3, inner_ec_m, "inner_boundary"), (3, 2, mid_ec_m, None)]
+    write_msh(save_addr, node_zone, face_zone, cell_num=len(ele_df_new), binary=binary)
+
+
 # cad2poly(pt_addr, save_addr, bd_marker=1)
 # os.system("triangle -epa100 XX.poly")
 # poly2msh(node_addr, edge_addr, ele_addr, save_addr)
@@ -0,0 +1,114 @@
+# geometry of OpenFOAM 2D meshes (one cell thick in z direction) from polyMesh arrays
+# faces are stored in CSR form, i.e. vertex ids of face i are face[offset[i]:offset[i+1]]
+import numpy as np
+import shapely
+
+
+def face_take(face, offset, order):
+    '''
+    Take faces in CSR form by face ids (in the given order)
+    Returns the flat vertex ids and the offsets of taken faces
+    '''
+    # only the offsets of taken faces are read, e.g. from a memory-mapped store
+    order = np.asarray(order, dtype=np.int64)
+    size = offset[order + 1] - offset[order]
+    new_offset = np.concatenate([[0], np.cumsum(size)])
+    # position of every vertex in the original flat array
+    pos = np.repeat(offset[order] - new_offset[:-1], size) + np.arange(new_offset[-1])
+    return face[pos], new_offset
+
+
+def cell_polygon(point, face, offset, owner):
+    '''
+    Get the polygon of every cell from its face on the lower z plane of the mesh
+    Parameters
+    ----------
+    point : (n, 3) array of point coordinates
+    face, offset : faces in CSR form
+    owner : owner cell ids of faces
+    Returns
+    -------
+    the vertex ids and the offsets of cell polygons in CSR form, ordered by cell id
+    '''
+    z = point[:, 2]
+    z_low = z.min() + 1e-6 * max(z.max() - z.min(), 1.0)
+    # faces whose vertices are all on the lower plane
+    low = np.logical_and.reduceat(z[face] <= z_low, offset[:-1])
+    fid = np.flatnonzero(low)
+    cell = owner[fid]
+    order = np.argsort(cell, kind="stable")
+    if not np.array_equal(cell[order], np.arange(len(fid))):
+        raise ValueError("Each cell should have exactly one face on the lower plane")
+    return face_take(face, offset, fid[order])
+
+
+def csr_polygons(point, face, offset):
+    '''
+    Build shapely polygons (in x-y plane) of faces in CSR form in one vectorized pass
+    '''
+    ring_id = np.repeat(np.arange(len(offset) - 1), np.diff(offset))
+    return shapely.polygons(shapely.linearrings(point[face, 0:2], indices=ring_id))
+
+
+def polygon_area_centroid(point, face, offset):
+    '''
+    Signed area and centroid (in x-y plane) of faces in CSR form by the vectorized shoelace formula
+    (counterclockwise faces have positive area, zero-area faces take the mean of their vertices as centroid)
+    Returns (n,) array of areas and (n, 2) array of centroids
+    '''
+    size = np.diff(offset)
+    first = np.repeat(offset[:-1], size)
+    # the next vertex of every vertex in its face
+    nxt = np.arange(len(face)) + 1
+    nxt[offset[1:] - 1] = offset[:-1]
+    # coordinates relative to the first vertex of the face, which keeps precision for large coordinates
+    x0 = point[face[first], 0]
+    y0 = point[face[first], 1]
+    x = point[face, 0] - x0
+    y = point[face, 1] - y0
+    cross = x * y[nxt] - x[nxt] * y
+    area2 = np.add.reduceat(cross, offset[:-1])
+    cx = np.add.reduceat((x + x[nxt]) * cross, offset[:-1])
+    cy = np.add.reduceat((y + y[nxt]) * cross, offset[:-1])
+    flat = area2 == 0
+    denom = np.where(flat, 1, 3 * area2)
+    cx = np.where(flat, np.add.reduceat(x, offset[:-1]) / size, cx / denom)
+    cy = np.where(flat, np.add.reduceat(y, offset[:-1]) / size, cy / denom)
+    return area2 / 2, np.column_stack([cx + x0[offset[:-1]], cy + y0[offset[:-1]]])
+
+
+def cell_geometry(point, cell_poly, cell_poly_offset):
+    '''
+    Area and center of cells of a 2D mesh from cell polygons (see cell_polygon)
+    Returns (n,) array of cell areas and (n, 3) array of cell centers (z is the middle of the mesh)
+    '''
+    area, center = polygon_area_centroid(point, cell_poly, cell_poly_offset)
+    z = point[:, 2]
+    z_mid = np.full(len(area), (z.min() + z.max()) / 2)
+    return np.abs(area), np.column_stack([center, z_mid])
+
+
+def face_cell(owner, face_id):
+    '''
+    The cell of every face of the mesh layer (faces are ordered by face_id), i.e. its owner cell
+    '''
+    return owner[face_id]
+
+
+def cell_face(owner, neighbour, face_id):
+    '''
+    Faces (in face ids of the mesh layer, faces are ordered by face_id) of every cell in CSR form
+    i.e. faces of cell i are cf_face[cf_offset[i]:cf_offset[i+1]] in ascending order
+    neighbour: neighbour cells of OpenFOAM faces, -1 (or missing) for boundary faces
+    '''
+    n_face = len(owner)
+    neighbour = np.concatenate([neighbour, np.full(n_face - len(neighbour), -1, dtype=neighbour.dtype)])
+    row = np.empty(n_face, dtype=np.int64)
+    row[face_id] = np.arange(n_face)
+    # every face belongs to its owner cell and, for internal faces, its neighbour cell
+    internal = neighbour >= 0
+    cf_cell = np.concatenate([owner, neighbour[internal]])
+    cf_face = np.concatenate([row, row[internal]])
+    order = np.lexsort((cf_face, cf_cell))
+    n_cell = int(owner.max()) + 1 if n_face > 0 else 0
+    return cf_face[order], np.concatenate([[0], np.cumsum(np.bincount(cf_cell, minlength=n_cell))])
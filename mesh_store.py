@@ -0,0 +1,162 @@
+# binary mesh store shared by all tools, i.e. a directory of .npy arrays and a manifest.json
+# arrays are written once from OpenFOAM polyMesh and opened as read-only memory maps
+import hashlib
+import json
+import os
+import numpy as np
+from foam_reader import foam_file, read_points, read_faces, read_labels, read_boundary
+from foam_to_txt import face_order
+from mesh_geometry import face_take, cell_polygon, cell_geometry, face_cell, cell_face
+
+# polyMesh files the store is built from
+mesh_files = ["points", "faces", "owner", "neighbour", "boundary"]
+# version of the arrays in the store, a store of an older version is rebuilt
+store_version = 2
+
+
+def array_hash(arr):
+    # content hash of an array, i.e. its dtype, shape and bytes
+    key = hashlib.sha1((arr.dtype.str + str(arr.shape)).encode())
+    key.update(memoryview(np.ascontiguousarray(arr)).cast("B"))
+    return key.hexdigest()
+
+
+def source_hash(src):
+    # content hash of the polyMesh files the store is built from
+    key = hashlib.sha1()
+    for name in mesh_files:
+        with open(foam_file(src, name), "rb") as f:
+            for block in iter(lambda: f.read(1 << 24), b""):
+                key.update(block)
+    return key.hexdigest()
+
+
+def file_hash(path, key):
+    '''
+    Hash an input into key: a file by its content (with its sidecar files for .shp, e.g. .dbf, .shx, .prj),
+    a directory (e.g. simulation results) by the relative path, size and modification time of its files
+    '''
+    if os.path.isdir(path):
+        for (root, dirs, files) in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                stat = os.stat(os.path.join(root, name))
+                rel = os.path.relpath(os.path.join(root, name), path)
+                key.update((rel + " " + str(stat.st_size) + " " + str(stat.st_mtime_ns) + "\n").encode())
+        return
+    files = [path]
+    stem, ext = os.path.splitext(path)
+    if ext.lower() == ".shp":
+        files += [stem + e for e in [".shx", ".dbf", ".prj", ".cpg"] if os.path.isfile(stem + e)]
+    for file in files:
+        key.update((os.path.basename(file) + "\n").encode())
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 24), b""):
+                key.update(block)
+
+
+def save_store(store_dir, arrays, source=""):
+    '''
+    Write arrays (a dictionary of name -> array) as .npy files with a manifest of their content hashes
+    The manifest is written last, so a store without manifest.json is incomplete
+    '''
+    os.makedirs(store_dir, exist_ok=True)
+    manifest_file = os.path.join(store_dir, "manifest.json")
+    if os.path.isfile(manifest_file):
+        os.remove(manifest_file)
+    entry = {}
+    for (name, arr) in arrays.items():
+        np.save(os.path.join(store_dir, name + ".npy"), arr)
+        entry[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "sha1": array_hash(arr)}
+    key = hashlib.sha1(json.dumps(entry, sort_keys=True).encode()).hexdigest()
+    with open(manifest_file + ".part", "w") as f:
+        json.dump({"hash": key, "source": source, "version": store_version, "arrays": entry}, f, indent=1)
+    os.replace(manifest_file + ".part", manifest_file)
+    return key
+
+
+def store_manifest(store_dir):
+    manifest_file = os.path.join(store_dir, "manifest.json")
+    if not os.path.isfile(manifest_file):
+        raise FileNotFoundError("No mesh store (or an incomplete one) in " + store_dir)
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def store_hash(store_dir):
+    '''
+    The content hash of the whole store, e.g. as the cache key of results derived from the mesh
+    '''
+    return store_manifest(store_dir)["hash"]
+
+
+def open_store(store_dir, names=None, verify=False):
+    '''
+    Open arrays of the mesh store as read-only memory maps (pages are shared by all processes)
+    Parameters
+    ----------
+    names: the arrays to open, None for all arrays
+    verify: recompute content hashes of the opened arrays (reads them through), otherwise
+    only their dtypes and shapes are checked against the manifest
+    Returns
+    -------
+    a dictionary of name -> array
+    '''
+    entry = store_manifest(store_dir)["arrays"]
+    store = {}
+    for name in (entry.keys() if names is None else names):
+        if name not in entry:
+            raise ValueError("No array " + name + " in mesh store " + store_dir)
+        arr = np.load(os.path.join(store_dir, name + ".npy"), mmap_mode="r")
+        if arr.dtype.str != entry[name]["dtype"] or list(arr.shape) != entry[name]["shape"]:
+            raise ValueError("Array " + name + " does not match the manifest of mesh store " + store_dir)
+        if verify and array_hash(arr) != entry[name]["sha1"]:
+            raise ValueError("Content hash of array " + name + " does not match, rebuild mesh store " + store_dir)
+        store[name] = arr
+    return store
+
+
+def build_store(src, store_dir, force=False):
+    '''
+    Build the mesh store from OpenFOAM polyMesh files in src, skipped if the store is built from the same files
+    by the same store_version
+    Arrays
+    ------
+    point: (n, 3) point coordinates
+    face, face_offset: faces in CSR form, ordered as foam_to_txt (the "id" of the mesh layer)
+    face_id: the OpenFOAM face id of face i
+    owner, neighbour: owner and neighbour cells of OpenFOAM faces (neighbour of boundary faces is -1)
+    face_patch: the boundary patch index of OpenFOAM faces (-1 for internal faces)
+    fc: the cell of face i (the owner cell)
+    cell_face, cell_face_offset: faces (in face ids of the mesh layer) of every cell in CSR form
+    cell_poly, cell_poly_offset: the polygon (lower z plane face) of every cell in CSR form
+    cell_area, cell_center: the area (in x-y plane) and the (n, 3) center of every cell
+    '''
+    source = source_hash(src)
+    if not force and os.path.isfile(os.path.join(store_dir, "manifest.json")):
+        manifest = store_manifest(store_dir)
+        if manifest["source"] == source and manifest.get("version") == store_version:
+            return manifest["hash"]
+    point = read_points(foam_file(src, "points"))
+    face, offset = read_faces(foam_file(src, "faces"))
+    owner = read_labels(foam_file(src, "owner"))
+    neighbour = read_labels(foam_file(src, "neighbour"))
+    n_face = len(offset) - 1
+    face_patch = np.full(n_face, -1, dtype=np.int32)
+    for (k, (name, kind, start, num)) in enumerate(read_boundary(foam_file(src, "boundary"))):
+        face_patch[start:start+num] = k
+    neighbour = np.concatenate([neighbour, np.full(n_face - len(neighbour), -1, dtype=np.int64)])
+    face_id = face_order(offset)
+    cf_face, cf_offset = cell_face(owner, neighbour, face_id)
+    cell_poly, cell_poly_offset = cell_polygon(point, face, offset, owner)
+    cell_area, cell_center = cell_geometry(point, cell_poly, cell_poly_offset)
+    c_face, c_offset = face_take(face, offset, face_id)
+    arrays = {"point": point, "face": c_face, "face_offset": c_offset, "face_id": face_id,
+              "owner": owner, "neighbour": neighbour, "face_patch": face_patch, "fc": face_cell(owner, face_id),
+              "cell_face": cf_face, "cell_face_offset": cf_offset, "cell_poly": cell_poly,
+              "cell_poly_offset": cell_poly_offset, "cell_area": cell_area, "cell_center": cell_center}
+    return save_store(store_dir, arrays, source=source)
+
+
+if __name__ == "__main__":
+    print(build_store(src="case_10m", store_dir="case_10m/mesh_store"))
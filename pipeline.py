@@ -0,0 +1,243 @@
+# run the whole workflow, i.e. cad2poly -> triangle -> poly2msh -> OpenFOAM mesh -> mesh store -> mesh layer
+# -> runoff coeff / gully number / pictures / flood statistics, as a DAG of stages
+# every stage is cached in work_dir/<stage>-<key>, where key is the hash of its input files, parameters
+# and the keys of the stages it depends on, so a rerun only recomputes invalidated stages
+# caches shared by stages of different keys (e.g. the overlap matrix, the rasterized mesh) are in work_dir/cache,
+# they are keyed by the mesh and the grid themselves
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mesh"))
+import meshConversion
+from mesh_store import build_store, open_store, store_hash, file_hash
+from polygon import write_mesh_layer
+from center_coeff import get_runcoeff
+from gully_number import get_gully
+from polygon_attribute import attach_attibute
+from flood_stats import get_stats
+
+
+# default parameters of the pipeline configuration
+defaults = {"work_dir": "pipeline", "bd_marker": 1, "tol": 0.0, "triangle_cmd": "triangle",
+            "triangle_switches": "-epa100", "binary_msh": False, "renumber": None,
+            "foam_cmd": [["fluentMeshToFoam", "-case", "{case}", "{msh}"]], "layer_ext": ".shp", "lut": None,
+            "nodata_coeff": 1, "runoff_mode": "area", "cell_center": None, "n": None, "step": None, "unit_size": None,
+            "prefix": "case", "picture": {}, "threshold": 0.01}
+
+
+def run_poly(cfg, dep, out):
+    meshConversion.cad2poly(cfg["cad_csv"], os.path.join(out, "mesh.poly"), bd_marker=cfg["bd_marker"], tol=cfg["tol"])
+
+
+def run_triangle(cfg, dep, out):
+    # Triangle writes mesh.1.node, mesh.1.ele, mesh.1.edge next to the .poly file
+    shutil.copy(os.path.join(dep["poly"], "mesh.poly"), out)
+    subprocess.run([cfg["triangle_cmd"], cfg["triangle_switches"], "mesh.poly"], cwd=out, check=True)
+
+
+def run_msh(cfg, dep, out):
+    tri = os.path.join(dep["triangle"], "mesh.1")
+    meshConversion.poly2msh(tri + ".node", tri + ".edge", tri + ".ele", os.path.join(out, "mesh.msh"),
+                            binary=cfg["binary_msh"], renumber=cfg["renumber"])
+
+
+def run_foam(cfg, dep, out):
+    # the OpenFOAM case template (system/controlDict ...) is copied, then the mesh is converted (and extruded)
+    # by foam_cmd, a list of commands where {case} and {msh} are replaced by the case directory and the .msh file
+    case = os.path.join(out, "case")
+    shutil.copytree(cfg["foam_case"], case)
+    for cmd in cfg["foam_cmd"]:
+        subprocess.run([c.format(case=case, msh=os.path.join(dep["msh"], "mesh.msh")) for c in cmd], check=True)
+
+
+def run_store(cfg, dep, out):
+    src = cfg["poly_mesh"] if cfg.get("poly_mesh") else os.path.join(dep["foam"], "case", "constant", "polyMesh")
+    build_store(src, os.path.join(out, "mesh_store"))
+
+
+def run_layer(cfg, dep, out):
+    mesh = open_store(os.path.join(dep["store"], "mesh_store"), ["point", "face", "face_offset"])
+    write_mesh_layer(mesh["point"], mesh["face"], mesh["face_offset"], os.path.join(out, "mesh" + cfg["layer_ext"]))
+
+
+def shared_cache(cfg):
+    # the cache directory shared by all runs, so changing e.g. the LUT or picture options does not recompute them
+    cache = os.path.join(cfg["work_dir"], "cache")
+    os.makedirs(cache, exist_ok=True)
+    return cache
+
+
+def run_runoff(cfg, dep, out):
+    # cell center mode (centers from the cell center file if given, otherwise from the mesh store)
+    # or area-weighted mode
+    store = os.path.join(dep["store"], "mesh_store")
+    if cfg["runoff_mode"] == "center":
+        p = cfg["cell_center"] if cfg["cell_center"] else store
+        store = None
+    else:
+        p = None
+    # one overlap matrix per landcover and mesh, so configs of different landcovers or meshes keep their own
+    mesh_dir = os.path.join(dep["store"], "mesh_store")
+    key = hashlib.sha1((os.path.abspath(cfg["landcover"]) + " " + store_hash(mesh_dir)).encode()).hexdigest()[:16]
+    get_runcoeff(lc=cfg["landcover"], p=p, dest=out, lut=cfg["lut"], nodata_coeff=cfg["nodata_coeff"],
+                 mesh=store, cache=os.path.join(shared_cache(cfg), "overlap_" + key + ".npz"))
+
+
+def run_gully(cfg, dep, out):
+    get_gully(store=os.path.join(dep["store"], "mesh_store"), g_src=cfg["gully"],
+              dest=os.path.join(out, "num_gully.txt"))
+
+
+def run_pictures(cfg, dep, out):
+    attach_attibute(mesh=os.path.join(dep["layer"], "mesh" + cfg["layer_ext"]), result_dir=cfg["result_dir"],
+                    tar_dir=out, n=cfg["n"], step=cfg["step"], unit_size=cfg["unit_size"], prefix=cfg["prefix"],
+                    store=os.path.join(dep["store"], "mesh_store"), cache_dir=shared_cache(cfg), **cfg["picture"])
+
+
+def run_stats(cfg, dep, out):
+    # statistics of cells as attributes of a cell polygon layer
+    get_stats(result_dir=cfg["result_dir"], n=cfg["n"], step=cfg["step"],
+              store=os.path.join(dep["store"], "mesh_store"), dest=os.path.join(out, "stats" + cfg["layer_ext"]),
+              threshold=cfg["threshold"])
+
+
+# stages in topological order
+# deps: stages it depends on, need: configuration entries the stage runs only if they are given,
+# files: input files / directories hashed into the key, params: parameters hashed into the key
+# lazy: the stage runs only if a selected stage depends on it or it is a target
+stages = {
+    "poly": {"deps": [], "need": ["cad_csv"], "files": ["cad_csv"], "params": ["bd_marker", "tol"], "run": run_poly},
+    "triangle": {"deps": ["poly"], "need": [], "files": [], "params": ["triangle_cmd", "triangle_switches"],
+                 "run": run_triangle},
+    "msh": {"deps": ["triangle"], "need": [], "files": [], "params": ["binary_msh", "renumber"], "run": run_msh},
+    "foam": {"deps": ["msh"], "need": ["foam_case"], "files": ["foam_case"], "params": ["foam_cmd"], "run": run_foam},
+    "store": {"deps": ["foam"], "need": [], "files": ["poly_mesh"], "params": [], "run": run_store},
+    "layer": {"deps": ["store"], "need": [], "files": [], "params": ["layer_ext"], "run": run_layer, "lazy": True},
+    "runoff": {"deps": ["store"], "need": ["landcover"], "files": ["landcover", "lut", "cell_center"],
+               "params": ["nodata_coeff", "runoff_mode"], "run": run_runoff},
+    "gully": {"deps": ["store"], "need": ["gully"], "files": ["gully"], "params": [], "run": run_gully},
+    "pictures": {"deps": ["store", "layer"], "need": ["result_dir", "n", "step", "unit_size"], "files": ["result_dir"],
+                 "params": ["n", "step", "unit_size", "prefix", "picture"], "run": run_pictures},
+    "stats": {"deps": ["store"], "need": ["result_dir", "n", "step"], "files": ["result_dir"],
+              "params": ["n", "step", "threshold", "layer_ext"], "run": run_stats},
+}
+
+
+def stage_deps(name, cfg):
+    # the mesh store is built from an existing polyMesh directly if poly_mesh is given
+    if name == "store" and cfg.get("poly_mesh"):
+        return []
+    return stages[name]["deps"]
+
+
+def stage_plan(cfg, targets=()):
+    '''
+    Select the stages to run, i.e. stages whose needed configuration entries are given and
+    whose dependencies are selected (lazy stages only if they are needed or in targets), and compute their keys
+    Returns an ordered dictionary of stage name -> key
+    '''
+    keys = {}
+    for (name, stage) in stages.items():
+        deps = stage_deps(name, cfg)
+        if cfg.get("poly_mesh") and name in ["poly", "triangle", "msh", "foam"]:
+            continue
+        if any(cfg.get(k) is None for k in stage["need"]) or any(d not in keys for d in deps):
+            continue
+        key = hashlib.sha1(json.dumps({"stage": name, "deps": {d: keys[d] for d in deps},
+                                       "params": {p: cfg[p] for p in stage["params"]}}, sort_keys=True).encode())
+        for f in stage["files"]:
+            if cfg.get(f) is not None:
+                key.update((f + "\n").encode())
+                file_hash(cfg[f], key)
+        keys[name] = key.hexdigest()[:16]
+    # drop lazy stages nobody needs, in reverse order so that a lazy stage only needed by a dropped one is dropped too
+    for name in reversed(list(keys)):
+        needed = name in targets or any(name in stage_deps(d, cfg) for d in keys)
+        if stages[name].get("lazy", False) and not needed:
+            del keys[name]
+    return keys
+
+
+def run_stage(name, cfg, dep, out):
+    # the stage is run in a temporary directory which is renamed when it is finished,
+    # so an interrupted stage is never taken as cached
+    part = out + ".part"
+    if os.path.isdir(part):
+        shutil.rmtree(part)
+    os.makedirs(part)
+    stages[name]["run"](cfg, dep, part)
+    with open(os.path.join(part, "stage.json"), "w") as f:
+        json.dump({"stage": name, "deps": dep}, f, indent=1)
+    if os.path.isdir(out):
+        shutil.rmtree(out)
+    os.replace(part, out)
+    return name
+
+
+def run_pipeline(cfg, workers=2, force=(), targets=()):
+    '''
+    cfg: the pipeline configuration, a dictionary of (see defaults for parameters with default values)
+    cad_csv: AutoCAD DataExtraction .csv of the mesh region
+    foam_case: OpenFOAM case template directory, poly_mesh: an existing polyMesh directory (replaces the stages
+    before the mesh store), landcover, lut, cell_center: see get_runcoeff, runoff_mode: "area" (area-weighted)
+    or "center" (sampled at cell centers), gully: gully shp file,
+    result_dir, n, step, unit_size, prefix: see attach_attibute, picture: other keyword arguments of attach_attibute
+    threshold: see get_stats (flood statistics are reduced if result_dir, n and step are given)
+    workers: the number of stages run concurrently, e.g. runoff coeff and gully number
+    force: stages to rerun even if they are cached (stages depending on them are rerun too)
+    targets: lazy stages to run even if no other stage needs them, e.g. "layer" for the mesh layer alone
+    Returns a dictionary of stage name -> output directory
+    '''
+    cfg = dict(defaults, **cfg)
+    keys = stage_plan(cfg, targets=targets)
+    work_dir = cfg["work_dir"]
+    os.makedirs(work_dir, exist_ok=True)
+    out = {name: os.path.abspath(os.path.join(work_dir, name + "-" + key)) for (name, key) in keys.items()}
+    rerun = set(force)
+    for name in keys:
+        if any(d in rerun for d in stage_deps(name, cfg)):
+            rerun.add(name)
+    pending = list(keys)
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(int(workers), 1)) as pool:
+        while len(pending) > 0 or len(running) > 0:
+            for name in list(pending):
+                deps = stage_deps(name, cfg)
+                if not all(d in done for d in deps):
+                    continue
+                pending.remove(name)
+                if name not in rerun and os.path.isfile(os.path.join(out[name], "stage.json")):
+                    print("Stage " + name + " is cached in " + out[name])
+                    done.add(name)
+                    continue
+                print("Stage " + name + " is running")
+                running[pool.submit(run_stage, name, cfg, {d: out[d] for d in deps}, out[name])] = name
+            if len(running) == 0:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                future.result()
+                print("Stage " + name + " is finished in " + out[name])
+                done.add(name)
+    with open(os.path.join(work_dir, "pipeline.json"), "w") as f:
+        json.dump(out, f, indent=1)
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the OpenFOAM-GDAL workflow with cached stages")
+    parser.add_argument("config", help="the .json pipeline configuration, see run_pipeline")
+    parser.add_argument("--workers", type=int, default=2, help="the number of stages run concurrently")
+    parser.add_argument("--force", nargs="*", default=[], help="stages to rerun even if they are cached")
+    parser.add_argument("--targets", nargs="*", default=[], help="lazy stages to run even if not needed, e.g. layer")
+    args = parser.parse_args()
+    with open(args.config) as f:
+        config = json.load(f)
+    run_pipeline(config, workers=args.workers, force=args.force, targets=args.targets)
@@ -1,50 +1,77 @@
 # convert Fluent msh face to polygon layer in ArcGIS
-# Fluent mesh is consisted of triangles and quadrangles
-import ogr
-import numpy as np
-
-
-# create ArcGIS polygon according to points' coordinates
-def create_polygon(unit, point_ref):
-    poly = ogr.Geometry(ogr.wkbPolygon)
-    ring = ogr.Geometry(ogr.wkbLinearRing)
-    l = len(unit)
-    for i in range(0, l):
-        index = int(unit[i])
-        ring.AddPoint(point_ref[index][0], point_ref[index][1])
-    poly.AddGeometry(ring)
-    return poly
-
-
-face_3 = np.loadtxt("case_10m/face_3.txt")
-face_4 = np.loadtxt("case_10m/face_4.txt", delimiter=' ')
-point = np.loadtxt("case_10m/point.txt")
-out_shp = r"shp/mesh_10m.shp"
-
-driver = ogr.GetDriverByName("ESRI Shapefile")
-data_source = driver.CreateDataSource(out_shp)
-layer = data_source.CreateLayer("", None, ogr.wkbPolygon)
-layer.CreateField(ogr.FieldDefn("id", ogr.OFTInteger))
-defn = layer.GetLayerDefn()
-
-n4 = len(face_4)
-n3 = len(face_3)
-for i in range(0, n4):
-    poly = create_polygon(unit=face_4[i], point_ref=point)
-    # create a feature
-    feat = ogr.Feature(defn)
-    feat.SetField("id", i)
-    # Make a geometry, from shape object
-    geom = ogr.CreateGeometryFromWkt(poly.ExportToWkt())
-    feat.SetGeometry(geom)
-    layer.CreateFeature(feat)
-
-for i in range(n4, n4+n3):
-    poly = create_polygon(unit=face_3[int(i-n4)], point_ref=point)
-    feat = ogr.Feature(defn)
-    feat.SetField("id", i)
-    geom = ogr.CreateGeometryFromWkt(poly.ExportToWkt())
-    feat.SetGeometry(geom)
-    layer.CreateFeature(feat)
-
-ds = layer = feat = geom = None
+# Fluent mesh faces can be triangles, quadrangles or any other polygons, which are stored in CSR form
+from osgeo import ogr
+import os
+import shapely
+from mesh_geometry import csr_polygons
+from mesh_store import open_store
+
+
+# OGR driver of the output layer by file extension
+layer_driver = {".shp": "ESRI Shapefile", ".gpkg": "GPKG", ".fgb": "FlatGeobuf"}
+
+
+def face_wkb(point, face, offset):
+    '''
+    Build the WKB of all face polygons from point and face arrays at once (rings are closed)
+    '''
+    return shapely.to_wkb(csr_polygons(point, face, offset))
+
+
+def write_mesh_layer(point, face, offset, out, batch=100000, fields=None, ids=None):
+    '''
+    Write mesh faces as a polygon layer with an "id" (face id) field
+    Parameters
+    ----------
+    point : (n, 2) or (n, 3) array of point coordinates
+    face, offset : faces in CSR form, i.e. vertex ids of face i are face[offset[i]:offset[i+1]]
+    out : the output file, .shp (ESRI Shapefile, limited to 2 GB), .gpkg (GeoPackage) or .fgb (FlatGeobuf)
+    batch : the number of features written in one transaction
+    fields : other attributes of faces, a dictionary of field name -> (n,) array (integer or real)
+    ids : the "id" of faces, None for 0, 1, ..., n-1 (e.g. face ids of a part of the mesh)
+    '''
+    ext = os.path.splitext(out)[1].lower()
+    if ext not in layer_driver:
+        raise ValueError("Unsupported layer file " + out + ", use .shp, .gpkg or .fgb")
+    driver = ogr.GetDriverByName(layer_driver[ext])
+    if os.path.exists(out):
+        driver.DeleteDataSource(out)
+    data_source = driver.CreateDataSource(out)
+    name = os.path.splitext(os.path.basename(out))[0]
+    # the spatial index is built once after all features are written
+    options = ["SPATIAL_INDEX=NO"] if ext == ".gpkg" else []
+    layer = data_source.CreateLayer(name, None, ogr.wkbPolygon, options=options)
+    layer.CreateField(ogr.FieldDefn("id", ogr.OFTInteger))
+    fields = {} if fields is None else fields
+    for (key, arr) in fields.items():
+        layer.CreateField(ogr.FieldDefn(key, ogr.OFTInteger if arr.dtype.kind in "iu" else ogr.OFTReal))
+    # values are converted to Python numbers once
+    value = {key: arr.tolist() for (key, arr) in fields.items()}
+    ids = range(len(offset) - 1) if ids is None else ids.tolist()
+    defn = layer.GetLayerDefn()
+    wkb = face_wkb(point, face, offset)
+    n = len(wkb)
+    for start in range(0, n, batch):
+        layer.StartTransaction()
+        for i in range(start, min(start + batch, n)):
+            feat = ogr.Feature(defn)
+            feat.SetField("id", ids[i])
+            for key in value:
+                feat.SetField(key, value[key][i])
+            feat.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb[i]))
+            layer.CreateFeature(feat)
+        layer.CommitTransaction()
+        print(str(min(start + batch, n)) + "/" + str(n) + " faces written")
+    if ext == ".gpkg":
+        sql = "SELECT CreateSpatialIndex('" + name + "', '" + layer.GetGeometryColumn() + "')"
+        data_source.ReleaseResultSet(data_source.ExecuteSQL(sql))
+    elif ext == ".shp":
+        data_source.ExecuteSQL("CREATE SPATIAL INDEX ON " + name)
+    # FlatGeobuf builds its packed R-tree when the file is closed
+    data_source = layer = feat = None
+
+
+if __name__ == "__main__":
+    # vertex ids of face i are face[face_offset[i]:face_offset[i+1]]
+    mesh = open_store("case_10m/mesh_store", ["point", "face", "face_offset"])
+    write_mesh_layer(mesh["point"], mesh["face"], mesh["face_offset"], out=r"shp/mesh_10m.shp")
@@ -1,96 +1,285 @@
 # attach OpenFOAM simulation result(s) to polygon layer's attribute(s) in ArcGIS
 # and save them as pictures
-import ogr
-import gdal
-import re
+from osgeo import gdal, ogr
+import hashlib
+import os
 import numpy as np
-import gzip
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from foam_reader import read_step, prefetch
+from mesh_store import open_store, file_hash
+from interpolation import interp_engine, interp_apply, interp_inside
 
 
-def attach_attibute(mesh, result_dir, tar_dir, n, step, unit_size, prefix, shift):   # shift = 22
+def mesh_key(mesh, unit_size):
     '''
-    mesh: the address the ArcGIS .shp file of OpenFOAM mesh is stored in
+    Hash the mesh layer (with its sidecar files, e.g. the .dbf of face ids) and the picture pixel size
+    as the cache key of the cell id raster
+    '''
+    key = hashlib.sha1(str(unit_size).encode())
+    file_hash(mesh, key)
+    return key.hexdigest()
+
+
+def face_raster(mesh, unit_size, cache_dir=None):
+    '''
+    Rasterize the "id" (face id) of the mesh layer once into a face id raster
+    Parameters
+    ----------
+    mesh: the address the mesh layer (.shp, .gpkg or .fgb) of OpenFOAM mesh is stored in
+    unit_size: picture pixel size
+    cache_dir: the directory the face id raster is cached in, keyed by mesh and pixel size
+    Returns
+    -------
+    face_id: (rows, cols) array of face ids, -1 for pixels out of the mesh
+    gt: the geotransform of pictures
+    '''
+    if cache_dir is not None:
+        cache = os.path.join(cache_dir, "face_id_" + mesh_key(mesh, unit_size) + ".npz")
+        if os.path.isfile(cache):
+            data = np.load(cache)
+            return data["face_id"], tuple(data["gt"])
+    # the mesh layer can be ESRI Shapefile, GeoPackage or FlatGeobuf
+    mesh_ds = ogr.Open(mesh, 0)
+    mesh_layer = mesh_ds.GetLayer()
+    # set the basic information for the output pictures
+    pixelWidth = pixelHeight = unit_size
+    x_min, x_max, y_min, y_max = mesh_layer.GetExtent()
+    cols = int((x_max - x_min) / pixelHeight)
+    rows = int((y_max - y_min) / pixelWidth)
+    gt = (x_min, pixelWidth, 0, y_min, 0, pixelHeight)
+    target_ds = gdal.GetDriverByName('MEM').Create("", cols, rows, 1, gdal.GDT_Int32)
+    target_ds.SetGeoTransform(gt)
+    band = target_ds.GetRasterBand(1)
+    band.Fill(-1)
+    gdal.RasterizeLayer(target_ds, [1], mesh_layer, options=["ATTRIBUTE=id"])
+    face_id = band.ReadAsArray()
+    target_ds = mesh_ds = None
+    if cache_dir is not None:
+        np.savez(cache, face_id=face_id, gt=np.array(gt))
+    return face_id, gt
+
+
+def cell_raster(mesh, unit_size, store, cache_dir=None):
+    '''
+    Get the cell id raster of pictures, i.e. the cell every pixel falls in
+    Returns
+    -------
+    cell_id: (rows, cols) array of cell ids (0 for pixels out of the mesh)
+    inside: (rows, cols) boolean array, True for pixels in the mesh
+    gt: the geotransform of pictures
+    n_cell: the number of cells
+    '''
+    # the corresponding relationship between face (the "id" of the mesh layer) and cell, i.e. fc[face_i] = cell_i
+    fc = open_store(store, ["fc"])["fc"]
+    face_id, gt = face_raster(mesh, unit_size, cache_dir=cache_dir)
+    inside = face_id >= 0
+    cell_id = np.asarray(fc, dtype=np.int64)[np.where(inside, face_id, 0)]
+    return cell_id, inside, gt, int(np.max(fc)) + 1
+
+
+# scale of int16 encoded fields, i.e. value = stored integer * scale (h is in cm)
+int16_scale = {"h": 0.1, "u": 0.001, "v": 0.001}
+
+
+def raster_options(out):
+    '''
+    GDAL data type and creation options of pictures
+    out: output options, i.e. {"compress", "cog", "encoding", "nodata"}
+    compress: None, "DEFLATE", "ZSTD" or "LZW", compressed GTiff pictures are tiled and use a predictor
+    cog: write Cloud-Optimized GeoTIFF with overview pyramids
+    encoding: "float32", "float16" (half precision) or "int16" (scaled by int16_scale)
+    '''
+    dtype = gdal.GDT_Int16 if out["encoding"] == "int16" else gdal.GDT_Float32
+    options = ["NBITS=16"] if out["encoding"] == "float16" else []
+    if out["cog"]:
+        options += ["COMPRESS=" + (out["compress"] or "DEFLATE"), "PREDICTOR=YES", "BLOCKSIZE=256",
+                    "OVERVIEWS=AUTO", "RESAMPLING=AVERAGE", "BIGTIFF=IF_SAFER"]
+    elif out["compress"] is not None:
+        options += ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "COMPRESS=" + out["compress"],
+                    "PREDICTOR=" + ("2" if out["encoding"] == "int16" else "3"), "BIGTIFF=IF_SAFER"]
+    return dtype, options
+
+
+def cog_temp(name):
+    # the temporary tiled GTiff a COG is copied from
+    return name + ".tmp.tiff"
+
+
+def open_raster(name, rows, cols, n_band, gt, out):
+    # COG is copied from a temporary tiled GTiff when it is closed, so no picture (or band stack) is held in memory
+    dtype, options = raster_options(out)
+    if out["cog"]:
+        name = cog_temp(name)
+        options = ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "BIGTIFF=YES"]
+    target_ds = gdal.GetDriverByName('GTiff').Create(name, cols, rows, n_band, dtype, options=options)
+    target_ds.SetGeoTransform(gt)
+    return target_ds
+
+
+def write_band(target_ds, k, arr, inside, field, description, out, xoff=0, yoff=0):
+    '''
+    Encode pixel values into band k (1-based), pixels out of the mesh are set to NoData
+    xoff, yoff: the column and row of the upper-left pixel of arr, i.e. a window of the band is written
+    '''
+    band = target_ds.GetRasterBand(k)
+    band.SetDescription(description)
+    if out["encoding"] == "int16":
+        arr = np.clip(np.round(arr / int16_scale[field]), -32767, 32767).astype(np.int16)
+        arr[~inside] = -32768
+        band.SetNoDataValue(-32768)
+        band.SetScale(int16_scale[field])
+        band.SetOffset(0)
+    else:
+        arr = np.where(inside, arr, out["nodata"]).astype(np.float32)
+        band.SetNoDataValue(out["nodata"])
+    band.WriteArray(arr, xoff, yoff)
+
+
+def close_raster(target_ds, name, out):
+    if out["cog"]:
+        _, options = raster_options(out)
+        gdal.GetDriverByName('COG').CreateCopy(name, target_ds, options=options)
+        target_ds = None
+        os.remove(cog_temp(name))
+    target_ds = None
+
+
+def pixel_value(pixel, value):
+    # gather cell values by the cell id raster, or interpolate them by the interpolation engine (a dictionary)
+    if isinstance(pixel, dict):
+        return interp_apply(pixel, value)
+    return value[pixel]
+
+
+def step_names(tar_dir, prefix, t, layout):
+    # names of pictures of time t, i.e. h, u, v pictures for "single" layout, one picture for "band" layout
+    if layout == "band":
+        return [tar_dir + "/" + prefix + "_" + str(t) + ".tiff"]
+    return [tar_dir + "/" + prefix + "_" + f + "_" + str(t) + ".tiff" for f in ["h", "u", "v"]]
+
+
+# read-only mesh mapping and output options shared by export workers (inherited by forked workers)
+shared = {}
+
+
+def export_init(pixel, inside, gt, n_cell, out):
+    shared["pixel"] = pixel
+    shared["inside"] = inside
+    shared["gt"] = gt
+    shared["n_cell"] = n_cell
+    shared["out"] = out
+
+
+def export_step(result_dir, tar_dir, prefix, t):
+    # read and export pictures of time t
+    export_write(tar_dir, prefix, t, read_step(result_dir, t, shared["n_cell"]))
+    return t
+
+
+def step_field(step_data):
+    # h (in cm), u, v of cells
+    h, U = step_data
+    return {"h": h * 100, "u": U[:, 0], "v": U[:, 1]}
+
+
+def export_write(tar_dir, prefix, t, step_data):
+    '''
+    Export pictures of time t, pictures are written to temporary files and then renamed
+    so that an interrupted step is never taken as finished
+    '''
+    pixel = shared["pixel"]
+    inside = shared["inside"]
+    out = shared["out"]
+    field = step_field(step_data)
+    names = step_names(tar_dir, prefix, t, out["layout"])
+    rows, cols = inside.shape
+    if out["layout"] == "band":
+        target_ds = open_raster(names[0] + ".part", rows, cols, 3, shared["gt"], out)
+        for (k, f) in enumerate(["h", "u", "v"]):
+            write_band(target_ds, k + 1, pixel_value(pixel, field[f]), inside, f, f, out)
+        close_raster(target_ds, names[0] + ".part", out)
+    else:
+        for (name, f) in zip(names, ["h", "u", "v"]):
+            target_ds = open_raster(name + ".part", rows, cols, 1, shared["gt"], out)
+            write_band(target_ds, 1, pixel_value(pixel, field[f]), inside, f, f, out)
+            close_raster(target_ds, name + ".part", out)
+    for name in names:
+        os.replace(name + ".part", name)
+
+
+def attach_attibute(mesh, result_dir, tar_dir, n, step, unit_size, prefix, shift=None, store="mesh_store",
+                    cache_dir=None, workers=1, resume=False, layout="single", compress=None, cog=False,
+                    encoding="float32", nodata=255, interp=False):
+    '''
+    mesh: the address the mesh layer (.shp, .gpkg or .fgb) of OpenFOAM mesh is stored in
     result_dir: the address OpenFOAM simulation result is stored in
     tar_dir: the address pictures generated by this function is stored in
     n: the total number of result file we want to process
     step: time step for result file
     unit_size: picture pixel size
     prefix: prefix for picture name
-    shift: use the shift distance so that we can get the result line e.g. (x,y,z) in OpenFOAM result file directly
+    shift: not used any more, h and U files are parsed by their FoamFile header (kept for old calls)
+    store: the directory of the mesh store, the face -> cell relationship "fc" is read from it (see mesh_store)
+    cache_dir: the directory the rasterized mesh is cached in (None for no caching)
+    workers: the number of processes exporting time steps in parallel
+    resume: skip time steps whose pictures already exist
+    layout: "single" for prefix_h_t, prefix_u_t, prefix_v_t pictures, "band" for one 3-band picture prefix_t
+    per time step, "stack" for one picture prefix_stack with h, u, v bands of all time steps
+    (stack is written by one process, workers and resume are not used)
+    compress, cog, encoding: see raster_options
+    nodata: NoData value of pixels out of the mesh for float32/float16 pictures (-32768 for int16)
+    interp: interpolate pixels linearly from node-averaged cell values (see interpolation) instead of
+    taking the value of the cell the pixel falls in, the mesh layer is not used then (the grid is from the store)
     '''
-    # create fields for ArcGIS layers
-    driver = ogr.GetDriverByName("ESRI Shapefile")
-    mesh_ds = driver.Open(mesh, 1)
-    mesh_layer = mesh_ds.GetLayer()
-    mesh_layer.CreateField(ogr.FieldDefn("h", ogr.OFTReal))
-    mesh_layer.CreateField(ogr.FieldDefn("u", ogr.OFTReal))
-    mesh_layer.CreateField(ogr.FieldDefn("v", ogr.OFTReal))
-    # load fc.npy to get the corresponding relationship between OpenFOAM face and cell, i.e. [face_i, cell_i]
-    # Note: [face_i, cell_i] is extracted by OpenFOAM using 'const labelList& faces = mesh.cells()[celli];'
-    fc = np.load("fc.npy")
     n = int(n)
     step = int(step)
     unit_size = int(unit_size)
-    for i in range(1, n):
-        h_result_add = result_dir + "/" + str(i*step) + "/h.gz"
-        U_result_add = result_dir + "/" + str(i*step) + "/U.gz"
-        zeta_file = gzip.open(h_result_add, "r")
-        zeta_lines = zeta_file.readlines()
-        U_file = gzip.open(U_result_add, "r")
-        U_lines = U_file.readlines()
-        for mesh in mesh_layer:
-            face_id = mesh.GetField("id")
-            cell_id = fc[int(face_id)]
-            h_i = float(zeta_lines[int(cell_id + shift)])
-            U_i = U_lines[int(cell_id + shift)].decode('utf-8')
-            U_i = re.split(r"[\(\)]", U_i)
-            U_i = re.split(r"\s", U_i[1])
-            u_i = float(U_i[0])
-            v_i = float(U_i[1])
-            # set field value
-            mesh.SetField("h", h_i*100)
-            mesh.SetField("u", u_i)
-            mesh.SetField("v", v_i)
-            mesh_layer.SetFeature(mesh)
-        mesh_layer.ResetReading()  # reset reader pointer to the beginning
-        h_result_name = tar_dir + "/" + prefix + "_h_" + str(i*step) + ".tiff"
-        u_result_name = tar_dir + "/" + prefix + "_u_" + str(i*step) + ".tiff"
-        v_result_name = tar_dir + "/" + prefix + "_v_" + str(i*step) + ".tiff"
-        # set the basic information for the output pictures
-        pixelWidth = pixelHeight = unit_size
-        x_min, x_max, y_min, y_max = mesh_layer.GetExtent()
-        cols = int((x_max - x_min) / pixelHeight)
-        rows = int((y_max - y_min) / pixelWidth)
-        NoData_value = 255
-        # convert h to tiff
-        target_ds = gdal.GetDriverByName('GTiff').Create(h_result_name, cols, rows, 1, gdal.GDT_Float32)
-        target_ds.SetGeoTransform((x_min, pixelWidth, 0, y_min, 0, pixelHeight))
-        band = target_ds.GetRasterBand(1)
-        band.SetNoDataValue(NoData_value)
-        band.FlushCache()
-        gdal.RasterizeLayer(target_ds, [1], mesh_layer, options=["ATTRIBUTE=h"])
-        target_ds = None
-        # convert u to tiff
-        u_target_ds = gdal.GetDriverByName('GTiff').Create(u_result_name, cols, rows, 1, gdal.GDT_Float32)
-        u_target_ds.SetGeoTransform((x_min, pixelWidth, 0, y_min, 0, pixelHeight))
-        u_band = u_target_ds.GetRasterBand(1)
-        u_band.SetNoDataValue(NoData_value)
-        u_band.FlushCache()
-        gdal.RasterizeLayer(u_target_ds, [1], mesh_layer, options=["ATTRIBUTE=u"])
-        u_target_ds = None
-        # convert v to tiff
-        v_target_ds = gdal.GetDriverByName('GTiff').Create(v_result_name, cols, rows, 1, gdal.GDT_Float32)
-        v_target_ds.SetGeoTransform((x_min, pixelWidth, 0, y_min, 0, pixelHeight))
-        v_band = v_target_ds.GetRasterBand(1)
-        v_band.SetNoDataValue(NoData_value)
-        v_band.FlushCache()
-        gdal.RasterizeLayer(v_target_ds, [1], mesh_layer, options=["ATTRIBUTE=v"])
-        v_target_ds = None
-    mesh_ds.ExecuteSQL("ALTER TABLE mesh_10m DROP COLUMN h")  # delete field by execution of SQL
-    mesh_ds.ExecuteSQL("ALTER TABLE mesh_10m DROP COLUMN u")
-    mesh_ds.ExecuteSQL("ALTER TABLE mesh_10m DROP COLUMN v")
-
-
-attach_attibute(mesh=sys.argv[1], result_dir=sys.argv[2], tar_dir=sys.argv[3], n=sys.argv[4], step=sys.argv[5],
-                unit_size=sys.argv[6], prefix=sys.argv[7], shift=22)
+    workers = int(workers)
+    out = {"layout": layout, "compress": compress, "cog": cog, "encoding": encoding, "nodata": nodata}
+    # the mesh is rasterized (or interpolation weights are computed) only once,
+    # and every picture is gathered (or interpolated) from cell values
+    if interp:
+        pixel = interp_engine(store, unit_size, cache_dir=cache_dir)
+        inside = interp_inside(pixel)
+        gt = pixel["gt"]
+        n_cell = len(open_store(store, ["cell_poly_offset"])["cell_poly_offset"]) - 1
+    else:
+        pixel, inside, gt, n_cell = cell_raster(mesh, unit_size, store, cache_dir=cache_dir)
+    t_list = [i*step for i in range(1, n)]
+    if layout == "stack":
+        stack_name = tar_dir + "/" + prefix + "_stack.tiff"
+        target_ds = open_raster(stack_name + ".part", inside.shape[0], inside.shape[1], 3 * len(t_list), gt, out)
+        for (k, (t, step_data)) in enumerate(prefetch(partial(read_step, result_dir, n=n_cell), t_list)):
+            field = step_field(step_data)
+            for (j, f) in enumerate(["h", "u", "v"]):
+                write_band(target_ds, 3*k + j + 1, pixel_value(pixel, field[f]), inside, f, f + "_" + str(t), out)
+            print("Time " + str(t) + " exported (" + str(k+1) + "/" + str(len(t_list)) + ")")
+        close_raster(target_ds, stack_name + ".part", out)
+        os.replace(stack_name + ".part", stack_name)
+        return
+    if resume:
+        t_list = [t for t in t_list if not all(os.path.isfile(f) for f in step_names(tar_dir, prefix, t, layout))]
+        print("The number of time steps to export is " + str(len(t_list)))
+    if workers > 1:
+        export = partial(export_step, result_dir, tar_dir, prefix)
+        with ProcessPoolExecutor(max_workers=workers, initializer=export_init,
+                                 initargs=(pixel, inside, gt, n_cell, out)) as pool:
+            done = pool.map(export, t_list)
+            # results are yielded in the order of time steps
+            for (k, t) in enumerate(done):
+                print("Time " + str(t) + " exported (" + str(k+1) + "/" + str(len(t_list)) + ")")
+    else:
+        export_init(pixel, inside, gt, n_cell, out)
+        # the next time step is read and decompressed in background while the current one is exported
+        for (k, (t, step_data)) in enumerate(prefetch(partial(read_step, result_dir, n=n_cell), t_list)):
+            export_write(tar_dir, prefix, t, step_data)
+            print("Time " + str(t) + " exported (" + str(k+1) + "/" + str(len(t_list)) + ")")
+
+
+if __name__ == "__main__":
+    # the directory of the mesh store is optional
+    store = {"store": sys.argv[8]} if len(sys.argv) > 8 else {}
+    attach_attibute(mesh=sys.argv[1], result_dir=sys.argv[2], tar_dir=sys.argv[3], n=sys.argv[4], step=sys.argv[5],
+                    unit_size=sys.argv[6], prefix=sys.argv[7], **store)
@@ -0,0 +1,191 @@
+# convert a whole OpenFOAM run into one chunked, compressed (time, cell) array store
+# the store is written in Zarr v2 directory format (byte shuffle + zlib, only NumPy is needed), i.e.
+# dest/h, dest/u, dest/v: (time, cell) fields chunked by whole time steps for snapshots
+# dest/h_series, dest/u_series, dest/v_series: the same fields chunked by cell blocks for hydrographs
+# dest/time: times of steps, dest/mesh/*: mesh topology (cell polygons in CSR form) from the mesh store
+import json
+import os
+import sys
+import zlib
+import numpy as np
+from functools import partial
+from foam_reader import read_step, prefetch
+from mesh_store import open_store, store_hash
+
+fields = ["h", "u", "v"]
+
+
+def zarr_array(dest, name, shape, chunks, dtype, attrs=None, level=1):
+    '''
+    Create an empty Zarr v2 array dest/name, chunks are filled by write_chunk
+    '''
+    path = os.path.join(dest, name)
+    os.makedirs(path, exist_ok=True)
+    dtype = np.dtype(dtype)
+    meta = {"zarr_format": 2, "shape": list(shape), "chunks": list(chunks), "dtype": dtype.str, "order": "C",
+            "fill_value": "NaN" if dtype.kind == "f" else 0, "compressor": {"id": "zlib", "level": level},
+            "filters": [{"id": "shuffle", "elementsize": dtype.itemsize}]}
+    with open(os.path.join(path, ".zarray"), "w") as f:
+        json.dump(meta, f, indent=1)
+    with open(os.path.join(path, ".zattrs"), "w") as f:
+        json.dump({} if attrs is None else attrs, f, indent=1)
+
+
+def zarr_meta(dest, name):
+    with open(os.path.join(dest, name, ".zarray")) as f:
+        return json.load(f)
+
+
+def write_chunk(dest, name, index, arr, meta):
+    '''
+    Write the chunk of chunk index (a tuple) of array dest/name, arr is padded to the full chunk shape
+    '''
+    dtype = np.dtype(meta["dtype"])
+    chunk = np.full(meta["chunks"], np.nan if dtype.kind == "f" else 0, dtype=dtype)
+    chunk[tuple(slice(0, s) for s in arr.shape)] = arr
+    # byte shuffle, i.e. the k-th bytes of all items are stored together
+    raw = chunk.reshape(-1).view(np.uint8).reshape((-1, dtype.itemsize)).T.tobytes()
+    file = os.path.join(dest, name, ".".join(map(str, index)))
+    with open(file + ".part", "wb") as f:
+        f.write(zlib.compress(raw, meta["compressor"]["level"]))
+    os.replace(file + ".part", file)
+
+
+def read_chunk(dest, name, index, meta):
+    # read one chunk as an array of the full chunk shape, missing chunk is filled by fill value
+    dtype = np.dtype(meta["dtype"])
+    file = os.path.join(dest, name, ".".join(map(str, index)))
+    if not os.path.isfile(file):
+        return np.full(meta["chunks"], np.nan if dtype.kind == "f" else 0, dtype=dtype)
+    with open(file, "rb") as f:
+        raw = np.frombuffer(zlib.decompress(f.read()), dtype=np.uint8)
+    return raw.reshape((dtype.itemsize, -1)).T.copy().view(dtype).reshape(meta["chunks"])
+
+
+def write_array(dest, name, arr, attrs=None, chunk=1 << 20, level=1):
+    # write a whole (mesh) array, chunked along the first axis
+    chunks = (min(max(len(arr), 1), chunk),) + arr.shape[1:]
+    zarr_array(dest, name, arr.shape, chunks, arr.dtype, attrs=attrs, level=level)
+    meta = zarr_meta(dest, name)
+    for (k, start) in enumerate(range(0, len(arr), chunks[0])):
+        write_chunk(dest, name, (k,) + (0,) * (arr.ndim - 1), arr[start:start+chunks[0]], meta)
+
+
+def read_block(dest, name, start, stop):
+    '''
+    Read the block [start[0]:stop[0], start[1]:stop[1], ...] of array dest/name
+    only the chunks overlapping the block are read and decompressed
+    '''
+    meta = zarr_meta(dest, name)
+    chunks = meta["chunks"]
+    stop = [min(b, s) for (b, s) in zip(stop, meta["shape"])]
+    out = np.empty([b - a for (a, b) in zip(start, stop)], dtype=np.dtype(meta["dtype"]))
+    ranges = [range(a // c, (b - 1) // c + 1) for (a, b, c) in zip(start, stop, chunks)]
+    for index in np.ndindex(*[len(r) for r in ranges]):
+        index = tuple(r[i] for (r, i) in zip(ranges, index))
+        lo = [max(i * c, a) for (i, c, a) in zip(index, chunks, start)]
+        hi = [min((i + 1) * c, b) for (i, c, b) in zip(index, chunks, stop)]
+        chunk = read_chunk(dest, name, index, meta)
+        out[tuple(slice(l - a, h - a) for (l, h, a) in zip(lo, hi, start))] = \
+            chunk[tuple(slice(l - i * c, h - i * c) for (l, h, i, c) in zip(lo, hi, index, chunks))]
+    return out
+
+
+def export_results(result_dir, n, step, store, dest, crs=None, chunk_cell=262144, series_chunk=(16, 4096), level=1):
+    '''
+    Convert h, U of time steps step, 2*step, ..., (n-1)*step into a (time, cell) array store
+    Parameters
+    ----------
+    result_dir: the address OpenFOAM simulation result is stored in
+    store: the directory of the mesh store
+    dest: the directory of the array store
+    crs: the coordinate reference system of the mesh, e.g. "EPSG:4547" or WKT (saved as metadata)
+    chunk_cell: the number of cells in one chunk of snapshot arrays (one time step per chunk)
+    series_chunk: (time steps, cells) in one chunk of hydrograph arrays, None for no hydrograph arrays
+    (series_chunk[0] time steps of all cells are buffered in memory)
+    level: zlib compression level
+    '''
+    mesh = open_store(store, ["point", "cell_poly", "cell_poly_offset"])
+    n_cell = len(mesh["cell_poly_offset"]) - 1
+    t_list = [i*int(step) for i in range(1, int(n))]
+    n_t = len(t_list)
+    os.makedirs(dest, exist_ok=True)
+    with open(os.path.join(dest, ".zgroup"), "w") as f:
+        json.dump({"zarr_format": 2}, f)
+    with open(os.path.join(dest, ".zattrs"), "w") as f:
+        json.dump({"crs": crs, "mesh_hash": store_hash(store), "n_cell": n_cell, "n_time": n_t,
+                   "units": {"h": "m", "u": "m/s", "v": "m/s", "time": "s"}}, f, indent=1)
+    # mesh topology, i.e. vertices of cell i are mesh/cell_poly[mesh/cell_poly_offset[i]:mesh/cell_poly_offset[i+1]]
+    os.makedirs(os.path.join(dest, "mesh"), exist_ok=True)
+    with open(os.path.join(dest, "mesh", ".zgroup"), "w") as f:
+        json.dump({"zarr_format": 2}, f)
+    for name in ["point", "cell_poly", "cell_poly_offset"]:
+        write_array(dest, "mesh/" + name, np.asarray(mesh[name]), attrs={"crs": crs}, level=level)
+    write_array(dest, "time", np.array(t_list, dtype=np.float64), attrs={"_ARRAY_DIMENSIONS": ["time"]}, level=level)
+    dims = {"_ARRAY_DIMENSIONS": ["time", "cell"]}
+    c_cell = min(chunk_cell, max(n_cell, 1))
+    for f in fields:
+        zarr_array(dest, f, (n_t, n_cell), (1, c_cell), np.float32, attrs=dims, level=level)
+    meta = zarr_meta(dest, "h")
+    if series_chunk is not None:
+        s_time, s_cell = min(series_chunk[0], max(n_t, 1)), min(series_chunk[1], max(n_cell, 1))
+        for f in fields:
+            zarr_array(dest, f + "_series", (n_t, n_cell), (s_time, s_cell), np.float32, attrs=dims, level=level)
+        s_meta = zarr_meta(dest, "h_series")
+        buf = {f: np.empty((s_time, n_cell), dtype=np.float32) for f in fields}
+    for (k, (t, (h, U))) in enumerate(prefetch(partial(read_step, result_dir, n=n_cell), t_list)):
+        value = {"h": h, "u": U[:, 0], "v": U[:, 1]}
+        for f in fields:
+            for (j, start) in enumerate(range(0, n_cell, c_cell)):
+                write_chunk(dest, f, (k, j), value[f][start:start+c_cell].astype(np.float32)[None, :], meta)
+        if series_chunk is not None:
+            for f in fields:
+                buf[f][k % s_time] = value[f]
+            # a row of hydrograph chunks is written when s_time steps are buffered (or at the last step)
+            if (k + 1) % s_time == 0 or k + 1 == n_t:
+                rows = k % s_time + 1
+                for f in fields:
+                    for (j, start) in enumerate(range(0, n_cell, s_cell)):
+                        write_chunk(dest, f + "_series", (k // s_time, j), buf[f][:rows, start:start+s_cell], s_meta)
+        print("Time " + str(t) + " stored (" + str(k+1) + "/" + str(n_t) + ")")
+
+
+def read_cells(dest, name, t_index, cells):
+    '''
+    Read the field of some cells at the time step t_index from the snapshot array dest/name
+    only the chunks holding the cells are read and decompressed
+    '''
+    meta = zarr_meta(dest, name)
+    cells = np.asarray(cells, dtype=np.int64)
+    out = np.empty(len(cells), dtype=np.dtype(meta["dtype"]))
+    chunk_id = cells // meta["chunks"][1]
+    order = np.argsort(chunk_id, kind="stable")
+    cut = np.flatnonzero(np.diff(chunk_id[order])) + 1
+    for sel in np.split(order, cut) if len(cells) > 0 else []:
+        j = chunk_id[sel[0]]
+        chunk = read_chunk(dest, name, (t_index // meta["chunks"][0], j), meta)[t_index % meta["chunks"][0]]
+        out[sel] = chunk[cells[sel] - j * meta["chunks"][1]]
+    return out
+
+
+def snapshot(dest, t_index, field="h"):
+    '''
+    Read the field of all cells at the time step t_index (see dest/time)
+    '''
+    n_cell = zarr_meta(dest, field)["shape"][1]
+    return read_block(dest, field, (t_index, 0), (t_index + 1, n_cell))[0]
+
+
+def hydrograph(dest, cell, field="h"):
+    '''
+    Read the field of one cell at all time steps, from hydrograph arrays if they exist
+    Returns times and values
+    '''
+    name = field + "_series" if os.path.isdir(os.path.join(dest, field + "_series")) else field
+    n_t = zarr_meta(dest, name)["shape"][0]
+    time = read_block(dest, "time", (0,), (n_t,))
+    return time, read_block(dest, name, (0, cell), (n_t, cell + 1))[:, 0]
+
+
+if __name__ == "__main__":
+    export_results(result_dir=sys.argv[1], n=sys.argv[2], step=sys.argv[3], store=sys.argv[4], dest=sys.argv[5])
@@ -0,0 +1,6 @@
+# regression tests of the vectorized algorithms, run by "python -m pytest tests" from the repository root
+# modules are imported as the tools import each other, i.e. from the repository root, mesh/ and benchmark/
+import os
+import sys
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, "mesh"), os.path.join(root, "benchmark")]
@@ -0,0 +1,87 @@
+# interpolation engine: weights reproduce linear fields exactly, node averaging keeps constants
+import numpy as np
+import pytest
+import shapely
+import synthetic
+from mesh_geometry import csr_polygons
+from interpolation import node_matrix, barycentric, bilinear, pixel_weights, interp_engine, interp_apply, \
+    interp_inside
+from mesh_store import build_store
+
+
+def linear(xy):
+    return 3.0 + 2.0 * xy[:, 0] - 0.5 * xy[:, 1]
+
+
+def mixed_mesh():
+    '''
+    A distorted quadrangle, a triangle and a pentagon sharing edges
+    Returns point (n, 3), cell_poly and cell_poly_offset
+    '''
+    point = np.array([[0, 0], [4, 0.5], [5, 4], [0.5, 3], [7, 1], [7, 6], [3, 7], [1, 6]], dtype=float)
+    cell_poly = np.array([0, 1, 2, 3, 1, 4, 2, 3, 2, 5, 6, 7])
+    offset = np.array([0, 4, 7, 12])
+    return np.column_stack([point, np.zeros(len(point))]), cell_poly, offset
+
+
+def test_barycentric_and_bilinear_invert_the_maps():
+    rng = np.random.default_rng(0)
+    a, b, c = [rng.random((50, 2)) * 10 for _ in range(3)]
+    w = rng.dirichlet([1, 1, 1], 50)
+    p = w[:, 0:1] * a + w[:, 1:2] * b + w[:, 2:3] * c
+    assert np.allclose(barycentric(p, a, b, c), w)
+    # a non-parallelogram quadrangle
+    q = [np.array([[0, 0]]), np.array([[4, 0.5]]), np.array([[5, 4]]), np.array([[0.5, 3]])]
+    u, v = rng.random((2, 50))
+    p = ((1 - u) * (1 - v))[:, None] * q[0] + (u * (1 - v))[:, None] * q[1] + (u * v)[:, None] * q[2] \
+        + ((1 - u) * v)[:, None] * q[3]
+    w = bilinear(p, *[np.repeat(x, 50, axis=0) for x in q])
+    assert np.allclose(w, np.column_stack([(1 - u) * (1 - v), u * (1 - v), u * v, (1 - u) * v]))
+
+
+def test_pixel_weights_are_exact_for_linear_fields():
+    point, cell_poly, offset = mixed_mesh()
+    x, y = np.meshgrid(np.linspace(-1, 8, 61), np.linspace(-1, 8, 67))
+    xy = np.column_stack([x.ravel(), y.ravel()])
+    pix, node, weight = pixel_weights(point, cell_poly, offset, xy)
+    assert len(pix) > 0 and np.allclose(weight.sum(axis=1), 1)
+    # linear fields are bilinear in (u, v) of any convex quadrangle, so the inverse bilinear map is exact too
+    value = np.einsum("ij,ij->i", weight, linear(point[:, 0:2])[node])
+    assert np.allclose(value, linear(xy[pix]))
+
+
+def test_pixel_weights_keep_pixels_of_the_mesh_only():
+    point, cell_poly, offset = mixed_mesh()
+    x, y = np.meshgrid(np.linspace(-1, 8, 61), np.linspace(-1, 8, 67))
+    xy = np.column_stack([x.ravel(), y.ravel()])
+    pix, _, _ = pixel_weights(point, cell_poly, offset, xy)
+    mesh = shapely.union_all(csr_polygons(point, cell_poly, offset))
+    assert np.array_equal(pix, np.flatnonzero(shapely.intersects_xy(mesh, xy[:, 0], xy[:, 1])))
+
+
+def test_node_matrix_keeps_constants():
+    point, cell_poly, offset = mixed_mesh()
+    row, col, weight = node_matrix(cell_poly, offset, np.array([7.0, 2.5, 12.0]), len(point))
+    node = np.bincount(row, weights=weight * np.full(3, 4.2)[col], minlength=len(point))
+    assert np.allclose(node, 4.2)
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    base = tmp_path_factory.mktemp("interp")
+    synthetic.poly_mesh(str(base / "polyMesh"), 100, dx=10.0)
+    build_store(str(base / "polyMesh"), str(base / "store"))
+    return str(base / "store")
+
+
+def test_engine_on_a_store(store, tmp_path):
+    engine = interp_engine(store, 3, cache_dir=str(tmp_path))
+    n_cell = int(engine["node_col"].max()) + 1
+    picture = interp_apply(engine, np.full(n_cell, 1.5), fill=-1)
+    inside = interp_inside(engine)
+    assert inside.all() and np.allclose(picture[inside], 1.5)
+    # the cached engine gives the same picture
+    value = np.random.default_rng(0).random(n_cell)
+    cached = interp_engine(store, 3, cache_dir=str(tmp_path))
+    assert np.array_equal(interp_apply(cached, value), interp_apply(engine, value))
+    assert cached["shape"] == engine["shape"] and cached["gt"] == engine["gt"]
@@ -0,0 +1,98 @@
+# cad2poly topology: vertex merging, planar faces, outer boundary and holes
+import numpy as np
+import pytest
+import synthetic
+from meshConversion import near_pairs, vertex_index, boundary_hole, hole_seed, cad2poly
+
+
+def square(x, y, size):
+    # corners of an axis-aligned square in counter-clockwise order
+    return np.array([[x, y], [x + size, y], [x + size, y + size], [x, y + size]], dtype=float)
+
+
+def ring_segments(corners):
+    # segments (start, end) of a closed ring given by its corners
+    return np.concatenate([corners, np.roll(corners, -1, axis=0)], axis=1)
+
+
+def classify(seg):
+    # outer boundary and holes of segments as sets of vertex coordinates
+    pt_set, pt_inv = vertex_index(np.concatenate([seg[:, 0:2], seg[:, 2:4]]))
+    s_index, e_index = pt_inv.reshape((2, -1)) + 1
+    outer, holes = boundary_hole(pt_set, s_index, e_index)
+
+    def coords(ring):
+        return frozenset(map(tuple, pt_set[np.asarray(ring) - 1].tolist()))
+    return coords(outer), set(coords(h) for h in holes), pt_set, holes
+
+
+def test_near_pairs_brute_force():
+    xy = np.random.default_rng(0).random((300, 2))
+    i, j = near_pairs(xy, 0.05)
+    d = np.linalg.norm(xy[:, None] - xy[None, :], axis=2)
+    ref = set(zip(*np.nonzero(np.triu(d <= 0.05, k=1))))
+    assert set(zip(i.tolist(), j.tolist())) == set((int(a), int(b)) for (a, b) in ref)
+
+
+def test_vertex_index_tolerance_is_a_distance():
+    # 0.49 and 0.51 are on both sides of a grid line of 0.05, (2, 2) - (2.3, 2) - (2.6, 2) is a chain
+    pts = np.array([[0.49, 0], [0.51, 0], [5, 5], [5, 5], [2, 2], [2.3, 2], [2.6, 2]])
+    pt_set, pt_inv = vertex_index(pts, tol=0.05)
+    assert pt_inv[0] == pt_inv[1] and len(pt_set) == 5
+    pt_set, pt_inv = vertex_index(pts, tol=0.31)
+    assert len(set(pt_inv[4:].tolist())) == 1 and len(pt_set) == 3
+    # exact matching keeps near points apart and merges identical ones only
+    pt_set, pt_inv = vertex_index(pts)
+    assert len(pt_set) == 6 and pt_inv[2] == pt_inv[3]
+    assert np.array_equal(pt_set[pt_inv], pts)
+
+
+def test_holes_found_and_invariant_to_segment_order():
+    holes = [square(2, 2, 2), square(6, 2, 1), square(2, 6, 3)]
+    seg = np.concatenate([ring_segments(square(0, 0, 10))] + [ring_segments(h) for h in holes])
+    outer, hole_set, pt_set, hole_ids = classify(seg)
+    assert outer == frozenset(map(tuple, square(0, 0, 10).tolist()))
+    assert hole_set == set(frozenset(map(tuple, h.tolist())) for h in holes)
+    # every seed is inside its hole
+    seed = hole_seed(pt_set, hole_ids)
+    for (h, p) in zip(hole_ids, seed):
+        xy = pt_set[np.asarray(h) - 1]
+        assert np.all(p > xy.min(axis=0)) and np.all(p < xy.max(axis=0))
+    # shuffled and reversed segments give the same faces
+    rng = np.random.default_rng(1)
+    flip = rng.random(len(seg)) < 0.5
+    shuffled = np.where(flip[:, None], seg[:, [2, 3, 0, 1]], seg)[rng.permutation(len(seg))]
+    assert classify(shuffled)[0:2] == (outer, hole_set)
+
+
+def test_hole_touching_the_outer_boundary():
+    # a notch on the bottom edge is a bounded face next to the outer contour, but not the largest one
+    bottom = np.array([[0, 0, 4, 0], [4, 0, 6, 0], [6, 0, 10, 0]], dtype=float)
+    notch = np.array([[4, 0, 4, 2], [4, 2, 6, 2], [6, 2, 6, 0]], dtype=float)
+    seg = np.concatenate([bottom, ring_segments(square(0, 0, 10))[1:], notch])
+    outer, hole_set, _, _ = classify(seg)
+    assert outer == frozenset([(0, 0), (4, 0), (6, 0), (10, 0), (10, 10), (0, 10)])
+    assert hole_set == {frozenset([(4, 0), (6, 0), (6, 2), (4, 2)])}
+
+
+def test_open_outline_raises():
+    seg = np.array([[0, 0, 1, 0], [1, 0, 1, 1], [1, 1, 0, 1]], dtype=float)
+    with pytest.raises(ValueError, match="not closed"):
+        classify(seg)
+
+
+def test_cad2poly_holes(tmp_path):
+    csv = tmp_path / "cad.csv"
+    synthetic.cad_csv(str(csv), 200)
+    cad2poly(str(csv), str(tmp_path / "cad.poly"))
+    lines = [ln.split() for ln in open(tmp_path / "cad.poly") if not ln.startswith("#")]
+    n_pt = int(lines[0][0])
+    n_seg = int(lines[n_pt + 1][0])
+    n_hole = int(lines[n_pt + n_seg + 2][0])
+    seed = np.array([ln[1:3] for ln in lines[n_pt + n_seg + 3:]], dtype=float)
+    # synthetic holes are unit squares at (4i + 1.5, 4j + 1.5)
+    k = int(np.sqrt(200 / 8))
+    assert n_hole == k * k == len(seed)
+    cell = np.floor((seed - 1.5) / 4)
+    assert np.all((seed - 1.5 - 4 * cell > 0) & (seed - 1.5 - 4 * cell < 1))
+    assert len(np.unique(cell, axis=0)) == k * k
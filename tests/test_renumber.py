@@ -0,0 +1,115 @@
+# poly2msh renumbering: orderings are permutations, they improve locality, and the mesh is unchanged
+import re
+import numpy as np
+import pytest
+import synthetic
+from meshConversion import rcm_order, curve_key, renumber_order, bandwidth, graph_csr, poly2msh
+
+
+def grid_graph(nx, ny):
+    # edges of a nx x ny grid graph, vertex ids shuffled
+    i = np.arange(nx * ny).reshape(ny, nx)
+    a = np.concatenate([i[:, :-1].ravel(), i[:-1, :].ravel()])
+    b = np.concatenate([i[:, 1:].ravel(), i[1:, :].ravel()])
+    perm = np.random.default_rng(0).permutation(nx * ny)
+    return perm[a], perm[b]
+
+
+def read_msh(file):
+    '''
+    Parse an ASCII .msh file written by write_msh
+    Returns (n, 2) node coordinates and (m, 4) faces [node1, node2, cell1, cell2] (1-based, cell2 = 0 on walls)
+    '''
+    text = open(file).read()
+    node = [np.array(body.split(), dtype=float).reshape(-1, 2)
+            for body in re.findall(r"\(10 \([0-9a-f]+ [0-9a-f]+ [0-9a-f]+ 1 2\)\(\n(.*?)\)\)", text, re.S)]
+    face = [np.array([int(v, 16) for v in body.split()]).reshape(-1, 4)
+            for body in re.findall(r"\(13 \([0-9a-f]+ [0-9a-f]+ [0-9a-f]+ \d+ 2\)\(\n(.*?)\)\)", text, re.S)]
+    return np.concatenate(node), np.concatenate(face)
+
+
+def canonical_mesh(node, face):
+    # the mesh as a set of faces by coordinates: (node1, node2, nodes of cell1, nodes of cell2)
+    cell_node = {}
+    for (n1, n2, c1, c2) in face.tolist():
+        for c in [c1, c2]:
+            cell_node.setdefault(c, set()).update([n1, n2])
+    xy = [tuple(p) for p in node.tolist()]
+
+    def cell(c):
+        return frozenset(xy[n - 1] for n in cell_node[c]) if c > 0 else None
+    return set((xy[n1 - 1], xy[n2 - 1], cell(c1), cell(c2)) for (n1, n2, c1, c2) in face.tolist())
+
+
+@pytest.mark.parametrize("kind", ["rcm", "hilbert", "morton"])
+def test_orderings_are_permutations(kind):
+    a, b = grid_graph(17, 11)
+    xy = np.random.default_rng(1).random((17 * 11, 2))
+    order = renumber_order(kind, 17 * 11, a, b, xy)
+    assert np.array_equal(np.sort(order), np.arange(17 * 11))
+
+
+def test_rcm_reduces_bandwidth():
+    a, b = grid_graph(30, 20)
+    order = rcm_order(30 * 20, a, b)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    # a grid of width 20 has an ordering of bandwidth 20
+    assert bandwidth(rank[a], rank[b])[0] <= 21 < bandwidth(a, b)[0]
+
+
+def test_rcm_covers_disconnected_graphs():
+    a, b = grid_graph(5, 5)
+    order = rcm_order(30, a, b)
+    assert np.array_equal(np.sort(order), np.arange(30))
+
+
+def test_graph_csr_drops_loops_and_duplicates():
+    ptr, nbr = graph_csr(3, [0, 0, 1, 2], [1, 1, 1, 0])
+    assert ptr.tolist() == [0, 2, 3, 4] and nbr.tolist() == [1, 2, 0, 0]
+
+
+def test_hilbert_curve_is_continuous():
+    # on a 2^bits grid the Hilbert index is a bijection and consecutive points are neighbours
+    bits = 4
+    x, y = np.meshgrid(np.arange(1 << bits), np.arange(1 << bits))
+    xy = np.column_stack([x.ravel(), y.ravel()]).astype(float)
+    key = curve_key(xy, "hilbert", bits=bits)
+    assert np.array_equal(np.sort(key), np.arange(len(xy)))
+    path = xy[np.argsort(key)]
+    assert np.all(np.abs(np.diff(path, axis=0)).sum(axis=1) == 1)
+
+
+def test_morton_interleaves_bits():
+    xy = np.array([[0, 0], [1, 0], [0, 1], [1, 1], [3, 3]], dtype=float)
+    assert curve_key(xy, "morton", bits=2).tolist() == [0, 1, 2, 3, 15]
+
+
+def test_unknown_renumbering_raises():
+    with pytest.raises(ValueError):
+        renumber_order("metis", 3, [0], [1], np.zeros((3, 2)))
+
+
+@pytest.mark.parametrize("kind", ["rcm", "hilbert"])
+def test_renumbered_mesh_is_the_same_mesh(tmp_path, kind):
+    prefix = str(tmp_path / "tri")
+    synthetic.triangle_files(prefix, 400)
+    files = [prefix + ".node", prefix + ".edge", prefix + ".ele"]
+    poly2msh(*files, str(tmp_path / "base.msh"))
+    poly2msh(*files, str(tmp_path / "new.msh"), renumber=kind)
+    base = read_msh(tmp_path / "base.msh")
+    new = read_msh(tmp_path / "new.msh")
+    assert len(new[1]) == len(base[1])
+    assert canonical_mesh(*new) == canonical_mesh(*base)
+    # the permutation maps .msh cells and nodes back to Triangle's
+    perm = np.load(tmp_path / "new_perm.npz")
+    tri_xy = np.loadtxt(prefix + ".node", skiprows=1, comments="#")[:, 1:3]
+    tri_ele = np.loadtxt(prefix + ".ele", skiprows=1, dtype=np.int64)[:, 1:4]
+    assert np.array_equal(new[0], tri_xy[perm["node"] - 1])
+    node, face = new
+    cell_node = {}
+    for (n1, n2, c1, c2) in face.tolist():
+        for c in [c1, c2]:
+            cell_node.setdefault(c, set()).update([n1, n2])
+    for c in range(1, len(perm["cell"]) + 1):
+        assert set(perm["node"][np.array(sorted(cell_node[c])) - 1]) == set(tri_ele[perm["cell"][c - 1]])
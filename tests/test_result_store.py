@@ -0,0 +1,79 @@
+# result store: the hand-written Zarr v2 writer and readers against the OpenFOAM fields and zarr-python
+import numpy as np
+import pytest
+import synthetic
+from foam_reader import read_step
+from mesh_store import build_store, open_store
+from result_store import zarr_array, zarr_meta, write_chunk, read_chunk, write_array, read_block, read_cells, \
+    export_results, snapshot, hydrograph
+
+
+@pytest.fixture(scope="module")
+def run(tmp_path_factory):
+    # a mesh store of 60 cells, fields of 5 time steps and their array store with chunks of ragged sizes
+    base = tmp_path_factory.mktemp("run")
+    synthetic.poly_mesh(str(base / "polyMesh"), 60)
+    build_store(str(base / "polyMesh"), str(base / "store"))
+    n_cell = len(open_store(str(base / "store"), ["cell_poly_offset"])["cell_poly_offset"]) - 1
+    synthetic.fields(str(base / "result"), n_cell, [2, 4, 6, 8, 10])
+    export_results(str(base / "result"), 6, 2, str(base / "store"), str(base / "zr"), crs="EPSG:4547",
+                   chunk_cell=7, series_chunk=(2, 9))
+    h = np.stack([read_step(str(base / "result"), t, n=n_cell)[0] for t in [2, 4, 6, 8, 10]]).astype(np.float32)
+    return {"dest": str(base / "zr"), "store": str(base / "store"), "h": h, "n_cell": n_cell,
+            "u": np.stack([read_step(str(base / "result"), t, n=n_cell)[1][:, 0] for t in [2, 4, 6, 8, 10]])}
+
+
+def test_chunk_round_trip(tmp_path):
+    arr = np.random.default_rng(0).random((5, 3)).astype(np.float64)
+    zarr_array(str(tmp_path), "a", (5, 3), (4, 3), np.float64)
+    meta = zarr_meta(str(tmp_path), "a")
+    write_chunk(str(tmp_path), "a", (0, 0), arr[:4], meta)
+    write_chunk(str(tmp_path), "a", (1, 0), arr[4:], meta)
+    assert np.array_equal(read_chunk(str(tmp_path), "a", (0, 0), meta), arr[:4])
+    # the last chunk is padded by the fill value, a missing chunk is all fill value
+    assert np.isnan(read_chunk(str(tmp_path), "a", (1, 0), meta)[1:]).all()
+    assert np.isnan(read_chunk(str(tmp_path), "a", (2, 0), meta)).all()
+    assert np.array_equal(read_block(str(tmp_path), "a", (1, 1), (5, 3)), arr[1:, 1:])
+
+
+def test_export_matches_fields(run):
+    dest = run["dest"]
+    n_t, n_cell = run["h"].shape
+    assert np.array_equal(read_block(dest, "h", (0, 0), (n_t, n_cell)), run["h"])
+    assert np.array_equal(read_block(dest, "h_series", (0, 0), (n_t, n_cell)), run["h"])
+    assert np.array_equal(read_block(dest, "u", (0, 0), (n_t, n_cell)), run["u"].astype(np.float32))
+    assert np.array_equal(snapshot(dest, 3), run["h"][3])
+    time, value = hydrograph(dest, n_cell - 1)
+    assert time.tolist() == [2, 4, 6, 8, 10] and np.array_equal(value, run["h"][:, -1])
+    cells = np.array([n_cell - 1, 0, 8, 7, 8])
+    assert np.array_equal(read_cells(dest, "h", 2, cells), run["h"][2, cells])
+
+
+def test_mesh_arrays_are_copied(run):
+    mesh = open_store(run["store"], ["point", "cell_poly", "cell_poly_offset"])
+    for name in ["point", "cell_poly", "cell_poly_offset"]:
+        arr = np.asarray(mesh[name])
+        assert np.array_equal(read_block(run["dest"], "mesh/" + name, (0,) * arr.ndim, arr.shape), arr)
+
+
+def test_zarr_python_reads_the_store(run):
+    zarr = pytest.importorskip("zarr")
+    group = zarr.open_group(run["dest"], mode="r")
+    assert np.array_equal(group["h"][:], run["h"])
+    assert np.array_equal(group["h_series"][:], run["h"])
+    assert group["time"][:].tolist() == [2, 4, 6, 8, 10]
+    assert group.attrs["crs"] == "EPSG:4547" and group.attrs["n_cell"] == run["n_cell"]
+    assert group["h"].attrs["_ARRAY_DIMENSIONS"] == ["time", "cell"]
+
+
+def test_zarr_python_writes_readable_chunks(tmp_path):
+    # chunks written by zarr-python (shuffle + zlib) are read back by read_block
+    zarr = pytest.importorskip("zarr")
+    numcodecs = pytest.importorskip("numcodecs")
+    arr = np.random.default_rng(0).random((9, 13)).astype(np.float32)
+    z = zarr.open_array(str(tmp_path / "z"), mode="w", shape=arr.shape, chunks=(4, 5), dtype="<f4",
+                        compressor=numcodecs.Zlib(level=1), filters=[numcodecs.Shuffle(elementsize=4)])
+    z[:] = arr
+    assert np.array_equal(read_block(str(tmp_path), "z", (0, 0), arr.shape), arr)
+    write_array(str(tmp_path), "w", np.arange(10, dtype=np.int64), chunk=3)
+    assert zarr.open_array(str(tmp_path / "w"), mode="r")[:].tolist() == list(range(10))
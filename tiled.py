@@ -0,0 +1,473 @@
+# out-of-core tiled processing of city-scale meshes
+# cells are partitioned into square tiles by their centers, and a tile is processed with its own cells and its halo
+# cells (cells of neighbour tiles whose centers are within the halo distance of the tile), so every tile is an
+# independent worker job whose memory is bounded by the tile size, and per-tile outputs are merged into seamless
+# final outputs (runoff coeff, gully numbers, the mesh layer and pictures)
+# plan_dir/plan.json: the tiles, plan_dir/tile_<k>.npz: own and halo cells of tile k,
+# plan_dir/<job>/tile_<k>.npz: the output of a job for tile k
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import shapely
+from osgeo import gdal, ogr
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from center_coeff import load_lut, apply_lut, sample_raster, sample_pixels, overlap_matrix, area_coeff
+from gully_number import load_layer, gully_join
+from interpolation import node_matrix, pixel_cell, pixel_weights, interp_apply
+from mesh_geometry import face_take, csr_polygons
+from mesh_store import open_store, store_hash
+from polygon import layer_driver, write_mesh_layer
+from polygon_attribute import open_raster, write_band, close_raster, step_names
+from result_store import zarr_meta, read_block, read_chunk
+
+
+def tile_index(xy, origin, tile_size, nx, ny):
+    # the tile (row-major, clipped to the tile grid) every point falls in
+    ix = np.clip(np.floor((xy[:, 0] - origin[0]) / tile_size), 0, nx - 1).astype(np.int64)
+    iy = np.clip(np.floor((xy[:, 1] - origin[1]) / tile_size), 0, ny - 1).astype(np.int64)
+    return iy * nx + ix
+
+
+def tile_file(plan_dir, k):
+    return os.path.join(plan_dir, "tile_" + str(k) + ".npz")
+
+
+def tile_plan(store, plan_dir, tile_size, halo=None, chunk=1 << 22):
+    '''
+    Partition cells of the mesh store into square tiles by their centers
+    Parameters
+    ----------
+    store: the directory of the mesh store
+    plan_dir: the directory the plan is saved in
+    tile_size: the side length of tiles
+    halo: cells of neighbour tiles whose centers are within halo of the tile are its halo cells, it should be
+    larger than twice the largest cell and not larger than tile_size (default tile_size / 10)
+    chunk: the number of points or cells read at once
+    Returns
+    -------
+    the plan (see load_plan)
+    '''
+    tile_size = float(tile_size)
+    halo = tile_size / 10 if halo is None else float(halo)
+    if halo > tile_size:
+        raise ValueError("The halo (" + str(halo) + ") should not be larger than the tile size")
+    mesh = open_store(store, ["point", "cell_center"])
+    point = mesh["point"]
+    center = mesh["cell_center"]
+    # the extent of points, which is also the extent of the mesh layer and pictures (see face_raster)
+    lo = np.full(2, np.inf)
+    hi = np.full(2, -np.inf)
+    for start in range(0, len(point), chunk):
+        xy = np.asarray(point[start:start+chunk, 0:2])
+        lo = np.minimum(lo, xy.min(axis=0))
+        hi = np.maximum(hi, xy.max(axis=0))
+    nx = max(int(np.ceil((hi[0] - lo[0]) / tile_size)), 1)
+    ny = max(int(np.ceil((hi[1] - lo[1]) / tile_size)), 1)
+    n_cell = len(center)
+    tile = np.empty(n_cell, dtype=np.int32)
+    for start in range(0, n_cell, chunk):
+        tile[start:start+chunk] = tile_index(np.asarray(center[start:start+chunk]), lo, tile_size, nx, ny)
+    # cells of tile k are order[offset[k]:offset[k+1]] in ascending order
+    order = np.argsort(tile, kind="stable")
+    offset = np.concatenate([[0], np.cumsum(np.bincount(tile, minlength=nx * ny))])
+    tile = None
+    os.makedirs(plan_dir, exist_ok=True)
+    tiles = []
+    for k in range(nx * ny):
+        ix, iy = k % nx, k // nx
+        box = [lo[0] + ix * tile_size, lo[1] + iy * tile_size, lo[0] + (ix + 1) * tile_size,
+               lo[1] + (iy + 1) * tile_size]
+        own = order[offset[k]:offset[k+1]]
+        # halo cells are taken from the 8 neighbour tiles
+        nb = [j * nx + i for j in range(iy - 1, iy + 2) for i in range(ix - 1, ix + 2)
+              if 0 <= i < nx and 0 <= j < ny and (i, j) != (ix, iy)]
+        cand = np.sort(np.concatenate([order[offset[j]:offset[j+1]] for j in nb] + [np.zeros(0, dtype=np.int64)]))
+        xy = np.asarray(center[cand, 0:2]).reshape((-1, 2))
+        near = (xy[:, 0] >= box[0] - halo) & (xy[:, 0] <= box[2] + halo) & \
+            (xy[:, 1] >= box[1] - halo) & (xy[:, 1] <= box[3] + halo)
+        np.savez(tile_file(plan_dir, k), own=own, halo=cand[near], box=np.array(box))
+        tiles.append({"id": k, "box": box, "n_own": len(own), "n_halo": int(near.sum())})
+    plan = {"store": os.path.abspath(store), "store_hash": store_hash(store), "tile_size": tile_size, "halo": halo,
+            "extent": [lo[0], lo[1], hi[0], hi[1]], "shape": [ny, nx], "n_cell": n_cell, "tiles": tiles}
+    with open(os.path.join(plan_dir, "plan.json"), "w") as f:
+        json.dump(plan, f, indent=1)
+    print(str(nx * ny) + " tiles planned, at most " + str(max(t["n_own"] + t["n_halo"] for t in tiles)) +
+          " cells in one tile")
+    return plan
+
+
+def load_plan(plan_dir):
+    '''
+    Load the plan, i.e. a dictionary of the mesh store, its hash, tile_size, halo, extent of points,
+    shape (rows, cols) of the tile grid, n_cell and tiles (id, box, n_own, n_halo)
+    '''
+    with open(os.path.join(plan_dir, "plan.json")) as f:
+        plan = json.load(f)
+    if store_hash(plan["store"]) != plan["store_hash"]:
+        raise ValueError("Mesh store " + plan["store"] + " has changed, plan the tiles again")
+    return plan
+
+
+def tile_mesh(store, cells):
+    '''
+    Read the polygons of some cells from the mesh store, with points renumbered locally
+    Returns local points, cell polygons in CSR form (local point ids) and global ids of local points
+    '''
+    mesh = open_store(store, ["point", "cell_poly", "cell_poly_offset"])
+    poly, offset = face_take(mesh["cell_poly"], mesh["cell_poly_offset"], cells)
+    pid, local = np.unique(poly, return_inverse=True)
+    return np.asarray(mesh["point"][pid]), local.reshape(-1), offset, pid
+
+
+def tile_job(job, plan_dir, kwargs, item):
+    # run a job for tile k, its output is written to a temporary file and then renamed
+    k, part = item
+    plan = load_plan(plan_dir)
+    tile = dict(np.load(tile_file(plan_dir, k)))
+    tile["id"] = k
+    out = job(plan, tile, part, **kwargs)
+    np.savez(part[:-4] + ".part.npz", **out)
+    os.replace(part[:-4] + ".part.npz", part)
+    return k
+
+
+def run_tiles(plan_dir, job, name, workers=1, resume=False, **kwargs):
+    '''
+    Run job(plan, tile, part, **kwargs) for every tile as an independent worker job, which returns a dictionary of
+    arrays saved as the part file plan_dir/name/tile_<k>.npz (the job may write other files next to it)
+    workers: the number of processes running tiles in parallel
+    resume: skip tiles whose part files exist, otherwise all tiles are run again
+    Returns the list of part files in tile order
+    '''
+    plan = load_plan(plan_dir)
+    part_dir = os.path.join(plan_dir, name)
+    if not resume and os.path.isdir(part_dir):
+        shutil.rmtree(part_dir)
+    os.makedirs(part_dir, exist_ok=True)
+    parts = [os.path.join(part_dir, "tile_" + str(t["id"]) + ".npz") for t in plan["tiles"]]
+    todo = [(t["id"], p) for (t, p) in zip(plan["tiles"], parts) if not os.path.isfile(p)]
+    run = partial(tile_job, job, plan_dir, kwargs)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            done = pool.map(run, todo)
+            for (i, k) in enumerate(done):
+                print("Tile " + str(k) + " " + name + " done (" + str(i+1) + "/" + str(len(todo)) + ")")
+    else:
+        for (i, item) in enumerate(todo):
+            run(item)
+            print("Tile " + str(item[0]) + " " + name + " done (" + str(i+1) + "/" + str(len(todo)) + ")")
+    return parts
+
+
+def job_runcoeff(plan, tile, part, lc, lut=None, nodata_coeff=1, area=False):
+    # runoff coeff of own cells, only the window of the landcover covering the tile is read
+    own = tile["own"]
+    if len(own) == 0:
+        return {"cell": own, "coeff": np.zeros(0), "out": 0}
+    ds = gdal.Open(lc)
+    lut = load_lut(lut)
+    if area:
+        point, poly, offset, _ = tile_mesh(plan["store"], own)
+        overlap = overlap_matrix(ds, csr_polygons(point, poly, offset))
+        lc_class = sample_pixels(ds, overlap["col"], overlap["row"], nodata=np.nan)
+        coeff = area_coeff(overlap, lc_class, lut, len(own), nodata_coeff)
+        out = len(own) - len(np.unique(overlap["cell"][~np.isnan(lc_class)]))
+    else:
+        center = np.asarray(open_store(plan["store"], ["cell_center"])["cell_center"][own])
+        lc_class = sample_raster(ds, center[:, 0:2], nodata=np.nan)
+        coeff = apply_lut(lc_class, lut, nodata_coeff)
+        out = int(np.isnan(lc_class).sum())
+    ds = None
+    return {"cell": own, "coeff": coeff, "out": out}
+
+
+def tiled_runcoeff(plan_dir, lc, dest, lut=None, nodata_coeff=1, area=False, workers=1, resume=False, chunk=1 << 20):
+    '''
+    Tiled get_runcoeff, i.e. dest/alpha.txt of the runoff coeff of all cells
+    lc, lut, nodata_coeff: see get_runcoeff
+    area: weight the runoff coeff by the area fraction of every landcover class inside the cell polygon,
+    otherwise the landcover is sampled at cell centers
+    '''
+    plan = load_plan(plan_dir)
+    parts = run_tiles(plan_dir, job_runcoeff, "runoff", workers=workers, resume=resume, lc=lc, lut=lut,
+                      nodata_coeff=nodata_coeff, area=area)
+    coeff = np.lib.format.open_memmap(os.path.join(plan_dir, "runoff.npy"), mode="w+", dtype=np.float64,
+                                      shape=(plan["n_cell"],))
+    out_num = 0
+    for part in parts:
+        data = np.load(part)
+        coeff[data["cell"]] = data["coeff"]
+        out_num += int(data["out"])
+    if out_num > 0:
+        print("The number of cells out of landcover or on NoData is " + str(out_num))
+    with open(dest + "/alpha.txt", "w") as f:
+        for start in range(0, plan["n_cell"], chunk):
+            np.savetxt(f, coeff[start:start+chunk], fmt="%g")
+    coeff = None
+
+
+def job_gully(plan, tile, part, g_src):
+    '''
+    Gullies whose points fall in the tile, joined to the faces of own and halo cells
+    Returns (cell, face, fid, name) of every gully in every face of every cell, as get_gully counts them
+    '''
+    gully_file = ogr.Open(g_src, 0)
+    g_layer = gully_file.GetLayer()
+    g_layer.SetAttributeFilter("NAME LIKE 'Y%'")
+    box = tile["box"]
+    g_layer.SetSpatialFilterRect(box[0], box[1], box[2], box[3])
+    fid, gully, name = load_layer(g_layer, field="NAME")
+    gully_file = None
+    # a gully on the border of tiles belongs to the tile its point falls in
+    ny, nx = plan["shape"]
+    xy = shapely.get_coordinates(gully).reshape((-1, 2))
+    keep = tile_index(xy, plan["extent"], plan["tile_size"], nx, ny) == tile["id"]
+    fid, gully, name = fid[keep], gully[keep], name[keep]
+    cells = np.sort(np.concatenate([tile["own"], tile["halo"]]))
+    if len(fid) == 0 or len(cells) == 0:
+        none = np.zeros(0, dtype=np.int64)
+        return {"cell": none, "face": none, "fid": none, "name": np.zeros(0, dtype=str)}
+    mesh = open_store(plan["store"], ["point", "face", "face_offset", "cell_face", "cell_face_offset"])
+    cf_face, cf_offset = face_take(mesh["cell_face"], mesh["cell_face_offset"], cells)
+    cf_cell = np.repeat(cells, np.diff(cf_offset))
+    face_id, local = np.unique(cf_face, return_inverse=True)
+    face, offset = face_take(mesh["face"], mesh["face_offset"], face_id)
+    g_index, g_face = gully_join(csr_polygons(mesh["point"], face, offset), gully)
+    # every (gully, face) pair counts for every tile cell of the face
+    order = np.argsort(local.reshape(-1), kind="stable")
+    ptr = np.concatenate([[0], np.cumsum(np.bincount(local.reshape(-1), minlength=len(face_id)))])
+    cnt = ptr[g_face + 1] - ptr[g_face]
+    pos = np.repeat(ptr[g_face] - np.concatenate([[0], np.cumsum(cnt)[:-1]]), cnt) + np.arange(cnt.sum())
+    g_index = np.repeat(g_index, cnt)
+    return {"cell": cf_cell[order[pos]], "face": np.repeat(face_id[g_face], cnt), "fid": fid[g_index],
+            "name": name[g_index].astype(str)}
+
+
+def tiled_gully(plan_dir, g_src, dest, workers=1, resume=False):
+    '''
+    Tiled get_gully, i.e. the txt file dest of the number and names of gullies in every cell
+    g_src: the address of gully shp file, only gullies in the tile are read by every job
+    '''
+    plan = load_plan(plan_dir)
+    parts = run_tiles(plan_dir, job_gully, "gully", workers=workers, resume=resume, g_src=g_src)
+    data = [np.load(part) for part in parts]
+    cell, face, fid, name = [np.concatenate([d[k] for d in data]) for k in ["cell", "face", "fid", "name"]]
+    # gullies of a cell are listed by its faces and then by the order of gullies in the layer, as get_gully
+    order = np.lexsort((fid, face, cell))
+    name = name[order].tolist()
+    g_offset = np.concatenate([[0], np.cumsum(np.bincount(cell, minlength=plan["n_cell"]))])
+    with open(dest, mode="w") as out_file:
+        out_file.write("Num\tPoints\n")
+        for c in range(plan["n_cell"]):
+            g_list = name[g_offset[c]:g_offset[c+1]]
+            out_file.write(str(len(g_list)) + "\t" + "\t".join(g_list) + "\n")
+
+
+def job_layer(plan, tile, part):
+    # the layer of faces owned by own cells (every face belongs to the tile of its owner cell)
+    mesh = open_store(plan["store"], ["point", "face", "face_offset", "fc", "cell_face", "cell_face_offset"])
+    own = tile["own"]
+    cf_face, _ = face_take(mesh["cell_face"], mesh["cell_face_offset"], own)
+    face_id = np.unique(cf_face)
+    face_id = face_id[np.isin(mesh["fc"][face_id], own)]
+    if len(face_id) > 0:
+        face, offset = face_take(mesh["face"], mesh["face_offset"], face_id)
+        write_mesh_layer(mesh["point"], face, offset, part[:-4] + ".gpkg", ids=face_id)
+    return {"n_face": len(face_id)}
+
+
+def merge_layers(src, out):
+    '''
+    Merge layers into one layer (with one spatial index) by GDAL through an OGR VRT union layer,
+    so features are streamed by GDAL instead of being loaded into memory
+    src: the list of layer files written by write_mesh_layer
+    out: the output file, .shp, .gpkg or .fgb
+    '''
+    ext = os.path.splitext(out)[1].lower()
+    if ext not in layer_driver:
+        raise ValueError("Unsupported layer file " + out + ", use .shp, .gpkg or .fgb")
+    name = os.path.splitext(os.path.basename(out))[0]
+    vrt = out + ".vrt"
+    with open(vrt, "w") as f:
+        f.write("<OGRVRTDataSource>\n<OGRVRTUnionLayer name=\"" + name + "\">\n")
+        for (k, file) in enumerate(src):
+            f.write("<OGRVRTLayer name=\"part_" + str(k) + "\"><SrcDataSource>" + os.path.abspath(file) +
+                    "</SrcDataSource><SrcLayer>" + os.path.splitext(os.path.basename(file))[0] +
+                    "</SrcLayer></OGRVRTLayer>\n")
+        f.write("</OGRVRTUnionLayer>\n</OGRVRTDataSource>\n")
+    driver = ogr.GetDriverByName(layer_driver[ext])
+    if os.path.exists(out):
+        driver.DeleteDataSource(out)
+    gdal.VectorTranslate(out, vrt, format=layer_driver[ext], layerName=name)
+    if ext == ".shp":
+        data_source = ogr.Open(out, 1)
+        data_source.ExecuteSQL("CREATE SPATIAL INDEX ON " + name)
+        data_source = None
+    # GeoPackage and FlatGeobuf build their spatial indexes when they are written
+    os.remove(vrt)
+
+
+def tiled_layer(plan_dir, out, workers=1, resume=False):
+    '''
+    Tiled mesh layer, i.e. every tile writes the faces of its own cells (with "id" of face ids) as a GeoPackage,
+    and they are merged into the layer out (.shp, .gpkg or .fgb), the order of features differs from write_mesh_layer
+    '''
+    parts = run_tiles(plan_dir, job_layer, "layer", workers=workers, resume=resume)
+    merge_layers([p[:-4] + ".gpkg" for p in parts if int(np.load(p)["n_face"]) > 0], out)
+
+
+def picture_grid(plan, unit_size):
+    # the geotransform and shape of pictures covering the mesh extent, as face_raster
+    x_min, y_min, x_max, y_max = plan["extent"]
+    gt = (x_min, unit_size, 0, y_min, 0, unit_size)
+    return gt, int((y_max - y_min) / unit_size), int((x_max - x_min) / unit_size)
+
+
+def job_pixels(plan, tile, part, unit_size, interp=False):
+    '''
+    The window of pixels whose centers fall in the tile, and how they are computed from values of own and halo cells,
+    i.e. the cell every pixel falls in, or the interpolation engine (see interpolation) of the window
+    '''
+    gt, rows, cols = picture_grid(plan, unit_size)
+    box = tile["box"]
+    # pixels are split between tiles by their centers
+    c0, c1 = [int(np.clip(np.ceil((x - gt[0]) / unit_size - 0.5), 0, cols)) for x in [box[0], box[2]]]
+    r0, r1 = [int(np.clip(np.ceil((y - gt[3]) / unit_size - 0.5), 0, rows)) for y in [box[1], box[3]]]
+    x, y = np.meshgrid(gt[0] + (np.arange(c0, c1) + 0.5) * unit_size, gt[3] + (np.arange(r0, r1) + 0.5) * unit_size)
+    xy = np.column_stack([x.ravel(), y.ravel()])
+    cells = np.sort(np.concatenate([tile["own"], tile["halo"]]))
+    window = np.array([r0, r1, c0, c1])
+    if len(cells) == 0 or len(xy) == 0:
+        none = np.zeros(0, dtype=np.int64)
+        return {"window": window, "cells": cells, "pix": none, "cell": none}
+    point, poly, offset, _ = tile_mesh(plan["store"], cells)
+    if not interp:
+        pix, cell = pixel_cell(point, poly, offset, xy)
+        return {"window": window, "cells": cells, "pix": pix, "cell": cell}
+    pix, node, weight = pixel_weights(point, poly, offset, xy)
+    # nodes are averaged from own and halo cells, which is exact if the halo covers all cells around the window
+    area = np.asarray(open_store(plan["store"], ["cell_area"])["cell_area"][cells])
+    row, col, node_weight = node_matrix(poly, offset, area, len(point))
+    return {"window": window, "cells": cells, "pix": pix, "node": node, "weight": weight, "node_row": row,
+            "node_col": col, "node_weight": node_weight, "n_point": len(point)}
+
+
+def tile_picture(data, value, nodata):
+    # pixel values of the window of a tile from values of its cells, and the mask of pixels in the mesh
+    r0, r1, c0, c1 = data["window"].tolist()
+    shape = (r1 - r0, c1 - c0)
+    inside = np.zeros(shape[0] * shape[1], dtype=bool)
+    inside[data["pix"]] = True
+    if "node" in data:
+        arr = interp_apply(dict(data, shape=shape), value, fill=nodata)
+    else:
+        arr = np.full(shape[0] * shape[1], nodata, dtype=np.float64)
+        arr[data["pix"]] = value[data["cell"]]
+    return arr.reshape(shape), inside.reshape(shape)
+
+
+def step_values(results, name, k, scratch):
+    '''
+    Decompress the field of all cells at time step k chunk by chunk (every chunk once) into a memory-mapped
+    scratch .npy file, so tiles gather their cells from it in any order without holding the field in memory
+    '''
+    meta = zarr_meta(results, name)
+    n_cell = meta["shape"][1]
+    c_time, c_cell = meta["chunks"]
+    value = np.lib.format.open_memmap(scratch, mode="w+", dtype=np.dtype(meta["dtype"]), shape=(n_cell,))
+    for (j, start) in enumerate(range(0, n_cell, c_cell)):
+        value[start:start+c_cell] = read_chunk(results, name, (k // c_time, j), meta)[k % c_time][:n_cell - start]
+    return value
+
+
+def export_tiled_step(plan_dir, parts, results, tar_dir, prefix, gt, shape, out, item):
+    # write h, u, v pictures of one time step tile by tile, i.e. one tile window of cell values at once
+    k, t = item
+    names = step_names(tar_dir, prefix, t, "single")
+    fields = ["h", "u", "v"]
+    scratch = [os.path.join(plan_dir, "step_" + str(k) + "_" + f + ".npy") for f in fields]
+    value = [step_values(results, f, k, file) for (f, file) in zip(fields, scratch)]
+    target = [open_raster(name + ".part", shape[0], shape[1], 1, gt, out) for name in names]
+    for part in parts:
+        data = dict(np.load(part))
+        if data["window"][1] <= data["window"][0] or data["window"][3] <= data["window"][2]:
+            continue
+        for (target_ds, f, v) in zip(target, fields, value):
+            v = v[data["cells"]].astype(np.float64)
+            # h is in cm, as polygon_attribute
+            v = v * 100 if f == "h" else v
+            arr, inside = tile_picture(data, v, 0)
+            write_band(target_ds, 1, arr, inside, f, f, out, xoff=int(data["window"][2]), yoff=int(data["window"][0]))
+    for (target_ds, name) in zip(target, names):
+        close_raster(target_ds, name + ".part", out)
+        os.replace(name + ".part", name)
+    value = None
+    for file in scratch:
+        os.remove(file)
+    return t
+
+
+def tiled_pictures(plan_dir, results, tar_dir, unit_size, prefix, t_index=None, interp=False, workers=1,
+                   resume=False, compress="DEFLATE", encoding="float32", nodata=255):
+    '''
+    Tiled attach_attibute, i.e. prefix_h_t, prefix_u_t, prefix_v_t pictures of time steps, written tile window by
+    tile window so that neither the whole picture nor the whole mesh is in memory
+    results: the array store of results (see result_store.export_results),
+        every chunk of a time step is decompressed once
+    t_index: indices of time steps in the array store to export, None for all
+    interp: interpolate pixels linearly from node-averaged cell values (see interpolation)
+    workers: the number of processes for tiles and then for time steps
+    resume: reuse pixel windows of tiles computed before
+    compress, encoding, nodata: see polygon_attribute.raster_options (pictures are tiled GTiff, not COG)
+    '''
+    plan = load_plan(plan_dir)
+    unit_size = float(unit_size)
+    name = "pixels_" + format(unit_size, "g") + ("_linear" if interp else "")
+    parts = run_tiles(plan_dir, job_pixels, name, workers=workers, resume=resume, unit_size=unit_size, interp=interp)
+    gt, rows, cols = picture_grid(plan, unit_size)
+    n_t = zarr_meta(results, "h")["shape"][0]
+    time = read_block(results, "time", (0,), (n_t,))
+    t_index = range(n_t) if t_index is None else t_index
+    item = [(k, int(time[k]) if float(time[k]).is_integer() else float(time[k])) for k in t_index]
+    out = {"compress": compress, "cog": False, "encoding": encoding, "nodata": nodata}
+    export = partial(export_tiled_step, plan_dir, parts, results, tar_dir, prefix, gt, (rows, cols), out)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for (i, t) in enumerate(pool.map(export, item)):
+                print("Time " + str(t) + " exported (" + str(i+1) + "/" + str(len(item)) + ")")
+    else:
+        for (i, it) in enumerate(item):
+            export(it)
+            print("Time " + str(it[1]) + " exported (" + str(i+1) + "/" + str(len(item)) + ")")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Out-of-core tiled processing of city-scale meshes")
+    parser.add_argument("command", choices=["plan", "runoff", "gully", "layer", "pictures"])
+    parser.add_argument("plan_dir", help="the directory of the tile plan")
+    parser.add_argument("--store", help="the mesh store (plan)")
+    parser.add_argument("--tile-size", type=float, help="the side length of tiles (plan)")
+    parser.add_argument("--halo", type=float, default=None, help="the halo distance of tiles (plan)")
+    parser.add_argument("--src", help="landcover tiff (runoff), gully shp (gully) or result array store (pictures)")
+    parser.add_argument("--dest", help="output directory (runoff, pictures) or file (gully, layer)")
+    parser.add_argument("--area", action="store_true", help="area-weighted runoff coeff (runoff)")
+    parser.add_argument("--unit-size", type=float, help="picture pixel size (pictures)")
+    parser.add_argument("--prefix", default="case", help="prefix for picture name (pictures)")
+    parser.add_argument("--interp", action="store_true", help="interpolate pictures linearly (pictures)")
+    parser.add_argument("--workers", type=int, default=1, help="the number of worker processes")
+    parser.add_argument("--resume", action="store_true", help="skip tiles finished before")
+    args = parser.parse_args()
+    if args.command == "plan":
+        tile_plan(args.store, args.plan_dir, args.tile_size, halo=args.halo)
+    elif args.command == "runoff":
+        tiled_runcoeff(args.plan_dir, args.src, args.dest, area=args.area, workers=args.workers, resume=args.resume)
+    elif args.command == "gully":
+        tiled_gully(args.plan_dir, args.src, args.dest, workers=args.workers, resume=args.resume)
+    elif args.command == "layer":
+        tiled_layer(args.plan_dir, args.dest, workers=args.workers, resume=args.resume)
+    else:
+        tiled_pictures(args.plan_dir, args.src, args.dest, args.unit_size, args.prefix, interp=args.interp,
+                       workers=args.workers, resume=args.resume)